@@ -0,0 +1,104 @@
+"""
+Microbenchmark of the json <-> firestore type conversion, reports documents per second.
+
+    poetry run python -m benchmarks.conversion [--documents 20000]
+
+No firestore connection is needed, documents are generated in memory.
+"""
+import argparse
+import io
+import json
+import re
+import time
+from datetime import datetime, timezone
+
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+
+from firebatch.endcoding import ISO8601_REGEX, ORJSON_AVAILABLE, convert_to_firestore_types, document_encoder, field_path_tree, to_json
+from firebatch.utils import iter_documents
+from google.cloud.firestore_v1 import GeoPoint
+
+
+def baseline_convert(db, data, timestamp_convert, geopoint_convert):
+    """convert_to_firestore_types before the conversion engine, kept as the reference point."""
+    if isinstance(data, dict):
+        if geopoint_convert and 'latitude' in data and 'longitude' in data and len(data) == 2:
+            return GeoPoint(data['latitude'], data['longitude'])
+        elif '__geopoint__' in data and len(data) == 1:
+            geodata = data['__geopoint__']
+            return GeoPoint(geodata['latitude'], geodata['longitude'])
+        elif '__timestamp__' in data and len(data) == 1:
+            return datetime.fromisoformat(data['__timestamp__'])
+        elif '__doc_ref__' in data and len(data) == 1:
+            return db.document(data['__doc_ref__'])
+        return {key: baseline_convert(db, value, timestamp_convert, geopoint_convert) for key, value in data.items()}
+    elif timestamp_convert and isinstance(data, str) and re.match(ISO8601_REGEX, data):
+        return datetime.fromisoformat(data)
+    elif isinstance(data, list):
+        return [baseline_convert(db, item, timestamp_convert, geopoint_convert) for item in data]
+    return data
+
+
+def make_document(i: int) -> dict:
+    return {
+        "name": f"user {i}",
+        "email": f"user{i}@example.com",
+        "created": "2024-01-02T03:04:05.123456Z",
+        "location": {"latitude": 48.2 + i % 10, "longitude": 16.3},
+        "tags": [f"tag{j}" for j in range(10)],
+        "profile": {"bio": "lorem ipsum dolor sit amet " * 4, "age": i % 90, "score": i * 0.5,
+                    "history": [{"event": "login", "at": "2024-02-03T04:05:06Z", "device": "phone"} for _ in range(5)]},
+    }
+
+
+def make_snapshot_data(i: int) -> dict:
+    """The same document as returned by firestore, timestamps are DatetimeWithNanoseconds."""
+    at = DatetimeWithNanoseconds(2024, 2, 3, 4, 5, 6, tzinfo=timezone.utc)
+    data = make_document(i)
+    data["created"] = DatetimeWithNanoseconds(2024, 1, 2, 3, 4, 5, 123456, tzinfo=timezone.utc)
+    data["location"] = GeoPoint(**data["location"])
+    data["profile"]["history"] = [dict(event, at=at) for event in data["profile"]["history"]]
+    return data
+
+
+def rate(label: str, count: int, fn) -> float:
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<45} {count / elapsed:>12,.0f} docs/s")
+    return count / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--documents", type=int, default=20000)
+    args = parser.parse_args()
+
+    documents = [make_document(i) for i in range(args.documents)]
+    count = len(documents)
+    hints = field_path_tree(["created", "location", "profile.history.at"])
+    print(f"{count} documents, orjson {'available' if ORJSON_AVAILABLE else 'not installed'}\n")
+
+    print("json -> firestore (timestamp and geopoint conversion)")
+    before = rate("  baseline (re.match per string)", count, lambda: [baseline_convert(None, d, True, True) for d in documents])
+    after = rate("  convert_to_firestore_types", count, lambda: [convert_to_firestore_types(None, d, True, True) for d in documents])
+    hinted = rate("  convert_to_firestore_types with field paths", count,
+                  lambda: [convert_to_firestore_types(None, d, True, True, hints) for d in documents])
+    print(f"  speedup {after / before:.2f}x, with field paths {hinted / before:.2f}x\n")
+
+    converted = [make_snapshot_data(i) for i in range(count)]
+    print("firestore -> json")
+    before = rate("  to_json per document", count, lambda: [to_json(d, timestamp_convert=True, geopoint_convert=True) for d in converted])
+    encode = document_encoder(timestamp_convert=True, geopoint_convert=True)
+    after = rate("  document_encoder", count, lambda: [encode(d) for d in converted])
+    print(f"  speedup {after / before:.2f}x\n")
+
+    lines = "".join(json.dumps(d) + "\n" for d in documents)
+    print("jsonl -> dict")
+    before = rate("  json.loads per line", count, lambda: [json.loads(line) for line in io.StringIO(lines)])
+    after = rate("  iter_documents", count, lambda: list(iter_documents(io.StringIO(lines))))
+    print(f"  speedup {after / before:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
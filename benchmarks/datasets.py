@@ -0,0 +1,65 @@
+"""Synthetic datasets for the benchmarks, written as firebatch jsonl exports."""
+import json
+import random
+from typing import Iterator
+
+SHAPES = ("flat", "nested")
+
+def _timestamp(rng: random.Random) -> str:
+    return f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}.{rng.randint(0, 999999):06d}Z"
+
+def _geopoint(rng: random.Random) -> dict:
+    return {"latitude": round(rng.uniform(-90, 90), 6), "longitude": round(rng.uniform(-180, 180), 6)}
+
+def _nested(rng: random.Random, collection: str, depth: int) -> dict:
+    node = {
+        "label": f"node-{rng.randint(0, 10**6)}",
+        "weight": rng.random(),
+        "seen": {"__timestamp__": _timestamp(rng)},
+        "where": {"__geopoint__": _geopoint(rng)},
+        "items": [{"sku": f"sku-{rng.randint(0, 9999)}", "qty": rng.randint(1, 5), "at": _timestamp(rng)} for _ in range(3)],
+    }
+    if depth > 1:
+        node["child"] = _nested(rng, collection, depth - 1)
+        node["owner"] = {"__doc_ref__": f"{collection}/doc-{rng.randint(0, 999):06d}"}
+    return node
+
+def make_document(rng: random.Random, index: int, collection: str, shape: str) -> dict:
+    """A document with scalars, timestamps (markers and iso strings), geopoints and document references."""
+    data = {
+        "index": index,
+        "name": f"user {index}",
+        "email": f"user{index}@example.com",
+        "active": rng.random() < 0.5,
+        "score": rng.random() * 100,
+        "tags": rng.sample(["a", "b", "c", "d", "e", "f", "g", "h"], 3),
+        "created": {"__timestamp__": _timestamp(rng)},
+        "updated": _timestamp(rng),
+        "location": {"__geopoint__": _geopoint(rng)},
+        "friend": {"__doc_ref__": f"{collection}/doc-{rng.randint(0, max(index, 1)):06d}"},
+    }
+    if shape == "nested":
+        data["profile"] = _nested(rng, collection, 3)
+        data["history"] = [_nested(rng, collection, 1) for _ in range(4)]
+    elif shape != "flat":
+        raise ValueError(f"Unknown shape '{shape}', use one of {', '.join(SHAPES)}.")
+    return {"__doc_id__": f"doc-{index:06d}", "__data__": data}
+
+def iter_dataset(size: int, collection: str, shape: str = "flat", seed: int = 42) -> Iterator[dict]:
+    rng = random.Random(seed)
+    for index in range(size):
+        yield make_document(rng, index, collection, shape)
+
+def write_dataset(path: str, size: int, collection: str, shape: str = "flat", seed: int = 42):
+    """Writes the dataset as jsonl, the format `firebatch write` reads and `firebatch read` produces."""
+    with open(path, "w") as file:
+        for document in iter_dataset(size, collection, shape, seed):
+            file.write(json.dumps(document) + "\n")
+
+def write_updates(path: str, size: int, seed: int = 7):
+    """Partial updates of every document of a dataset of the given size."""
+    rng = random.Random(seed)
+    with open(path, "w") as file:
+        for index in range(size):
+            update = {"score": rng.random() * 100, "active": rng.random() < 0.5, "updated": _timestamp(rng)}
+            file.write(json.dumps({"__doc_id__": f"doc-{index:06d}", "__data__": update}) + "\n")
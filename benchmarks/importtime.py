@@ -0,0 +1,58 @@
+"""
+Import time of the CLI, measured with python -X importtime in a fresh interpreter.
+
+    poetry run python -m benchmarks.importtime [--budget-ms 150] [--module firebatch.cli]
+
+Prints the slowest imports and exits with 1 when the cumulative import time of the module exceeds
+the budget, or when it imports one of the heavy libraries that must stay lazy.
+"""
+import argparse
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+# loaded by the commands that need them, never by importing the CLI
+LAZY_MODULES = ("google.cloud.firestore", "google.api_core", "grpc", "tqdm", "pydantic", "pyarrow", "firebatch.operations")
+
+def import_times(module: str) -> List[Tuple[str, int, int]]:
+    """(module, self us, cumulative us) of every import done by `import module`, in import order."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, check=True)
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times.append((name.strip(), int(self_us), int(cumulative_us)))
+    return times
+
+def lazy_modules_imported(times: List[Tuple[str, int, int]]) -> List[str]:
+    names = {name for name, _, _ in times}
+    return sorted(name for name in names if any(name == lazy or name.startswith(f"{lazy}.") for lazy in LAZY_MODULES))
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time of the firebatch CLI.")
+    parser.add_argument("--module", default="firebatch.cli")
+    parser.add_argument("--budget-ms", type=float, default=150.0)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    times = import_times(args.module)
+    cumulative: Dict[str, int] = {name: cumulative_us for name, _, cumulative_us in times}
+    total_ms = cumulative[args.module] / 1000
+    for name, self_us, cumulative_us in sorted(times, key=lambda item: -item[2])[:args.top]:
+        print(f"{cumulative_us / 1000:>9.1f}ms {self_us / 1000:>9.1f}ms  {name}")
+    print(f"\nimport {args.module}: {total_ms:.1f}ms (budget {args.budget_ms:.0f}ms)")
+
+    failed = False
+    lazy = lazy_modules_imported(times)
+    if lazy:
+        print(f"imports modules that must be loaded lazily: {', '.join(lazy)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print("over budget")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
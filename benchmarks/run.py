@@ -0,0 +1,178 @@
+"""
+Throughput benchmark of the read, write, update and delete commands.
+
+Runs the commands on synthetic datasets against an in-process fake of the Firestore API (default) or
+the Firestore emulator (--backend emulator, needs FIRESTORE_EMULATOR_HOST), with an optional latency
+injected into every RPC. Reports docs/s, peak RSS and the number of RPCs per method, and writes the
+results as json so runs can be compared:
+
+    poetry run python -m benchmarks.run --sizes 1000,10000 --latency-ms 20 --output after.json --compare before.json
+
+Every measurement runs in a fresh process, so the peak RSS of one command does not hide the next.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from typing import List, Optional
+from unittest import mock
+
+from benchmarks.datasets import SHAPES, write_dataset, write_updates
+from tests.fake_firestore import PROJECT, fake_client, instrument_client
+
+COMMANDS = ("write", "read", "update", "delete")
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def _client(backend: str):
+    if backend == "fake":
+        return fake_client()
+    if not os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        raise RuntimeError("--backend emulator needs FIRESTORE_EMULATOR_HOST, e.g. 'gcloud emulators firestore start --host-port=localhost:8080'.")
+    from google.cloud import firestore
+    return instrument_client(firestore.Client(project=PROJECT))
+
+def measure(command: str, shape: str, size: int, dataset: str, updates: str, workdir: str,
+            backend: str = "fake", latency: float = 0.0, parallel: int = 1, batch_size: int = 500, max_in_flight: int = 4) -> dict:
+    """Runs a single command and returns its measurement. The collection is seeded first unless the command is write."""
+    from firebatch import operations
+
+    client = _client(backend)
+    api = client._firestore_api
+    collection = f"bench_{shape}_{size}_{command}_{uuid.uuid4().hex[:8]}"
+
+    with mock.patch.object(operations, "initialize_firestore_client", return_value=client):
+        if command != "write":
+            with open(dataset) as file:
+                operations.write_documents(collection, file, format="jsonl", timestamp_convert=True)
+        api.reset()
+        api.latency = latency
+        rss_before = _peak_rss_mb()
+        start = time.perf_counter()
+
+        if command == "write":
+            with open(dataset) as file:
+                operations.write_documents(collection, file, format="jsonl", timestamp_convert=True,
+                                           batch_size=batch_size, max_in_flight=max_in_flight)
+        elif command == "read":
+            with open(os.path.join(workdir, f"{collection}.jsonl"), "w") as output:
+                operations.export_collection_documents(output, collection, False, "jsonl", parallel=parallel)
+        elif command == "update":
+            with open(updates) as file:
+                from firebatch.utils import iter_documents
+                operations.update_documents_in_firestore(collection, iter_documents(file, "jsonl"), timestamp_convert=True,
+                                                         batch_size=batch_size, max_in_flight=max_in_flight)
+        elif command == "delete":
+            doc_ids = [f"doc-{index:06d}" for index in range(size)]
+            operations.delete_documents_in_firestore(collection, doc_ids, batch_size=batch_size, max_in_flight=max_in_flight)
+        else:
+            raise ValueError(f"Unknown command '{command}', use one of {', '.join(COMMANDS)}.")
+
+        seconds = time.perf_counter() - start
+
+    peak_rss = _peak_rss_mb()
+    return {
+        "command": command,
+        "shape": shape,
+        "documents": size,
+        "seconds": round(seconds, 4),
+        "docs_per_second": round(size / seconds, 1),
+        "peak_rss_mb": round(peak_rss, 1),
+        "rss_growth_mb": round(peak_rss - rss_before, 1),
+        "rpcs": dict(sorted(api.rpcs.items())),
+    }
+
+def _key(result: dict) -> tuple:
+    return result["command"], result["shape"], result["documents"]
+
+def compare(previous: dict, current: dict) -> List[str]:
+    """Lines comparing the docs/s and peak RSS of the measurements both result files contain."""
+    before = {_key(result): result for result in previous["results"]}
+    lines = []
+    for result in current["results"]:
+        old = before.get(_key(result))
+        if old is None:
+            continue
+        lines.append(f"{result['command']:<8} {result['shape']:<7} {result['documents']:>8} docs  "
+                     f"{old['docs_per_second']:>10,.0f} -> {result['docs_per_second']:>10,.0f} docs/s "
+                     f"({result['docs_per_second'] / old['docs_per_second']:.2f}x)  "
+                     f"peak rss {old['peak_rss_mb']:.0f} -> {result['peak_rss_mb']:.0f} MB")
+    return lines
+
+def run(commands: List[str], shapes: List[str], sizes: List[int], backend: str = "fake", latency: float = 0.0,
+        parallel: int = 1, batch_size: int = 500, max_in_flight: int = 4, isolate: bool = True, verbose: bool = True) -> dict:
+    results = []
+    with tempfile.TemporaryDirectory(prefix="firebatch-bench-") as workdir:
+        for shape in shapes:
+            for size in sizes:
+                dataset = os.path.join(workdir, f"{shape}-{size}.jsonl")
+                updates = os.path.join(workdir, f"{shape}-{size}-updates.jsonl")
+                write_dataset(dataset, size, "users", shape)
+                write_updates(updates, size)
+                for command in commands:
+                    arguments = (command, shape, size, dataset, updates, workdir, backend, latency, parallel, batch_size, max_in_flight)
+                    if isolate:
+                        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+                            result = executor.submit(measure, *arguments).result()
+                    else:
+                        result = measure(*arguments)
+                    results.append(result)
+                    if verbose:
+                        rpcs = ", ".join(f"{method} {count}" for method, count in result["rpcs"].items())
+                        print(f"{command:<8} {shape:<7} {size:>8} docs  {result['docs_per_second']:>10,.0f} docs/s  "
+                              f"peak rss {result['peak_rss_mb']:>6.0f} MB  rpcs: {rpcs}", file=sys.stderr)
+
+    return {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": {"backend": backend, "latency_ms": latency * 1000, "parallel": parallel,
+                   "batch_size": batch_size, "max_in_flight": max_in_flight},
+        "results": results,
+    }
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Throughput benchmark of the firebatch commands.")
+    parser.add_argument("--commands", default=",".join(COMMANDS), help="comma separated commands to run")
+    parser.add_argument("--shapes", default="flat,nested", help=f"comma separated dataset shapes ({', '.join(SHAPES)})")
+    parser.add_argument("--sizes", default="1000,10000", help="comma separated numbers of documents")
+    parser.add_argument("--backend", choices=("fake", "emulator"), default="fake")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="latency added to every RPC")
+    parser.add_argument("--parallel", type=int, default=1, help="partitions of the read command")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--max-in-flight", type=int, default=4)
+    parser.add_argument("--no-isolate", action="store_true", help="run all measurements in this process")
+    parser.add_argument("--output", help="write the results as json to this file (default stdout)")
+    parser.add_argument("--compare", help="results json of a previous run to compare with")
+    args = parser.parse_args(argv)
+
+    report = run([command.strip() for command in args.commands.split(",")],
+                 [shape.strip() for shape in args.shapes.split(",")],
+                 [int(size) for size in args.sizes.split(",")],
+                 backend=args.backend, latency=args.latency_ms / 1000, parallel=args.parallel,
+                 batch_size=args.batch_size, max_in_flight=args.max_in_flight, isolate=not args.no_isolate)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as file:
+            for line in compare(json.load(file), report):
+                print(line, file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
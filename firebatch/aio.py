@@ -0,0 +1,610 @@
+"""
+The asyncio engine: reads, batch commits and recursive deletes on a Firestore AsyncClient.
+
+Every RPC is a coroutine, so a single thread keeps many partition streams, commits and subcollection
+listings in flight; how many at the same time is bounded by a semaphore (concurrency, max_in_flight).
+The functions can be used directly from asyncio code:
+
+    db = create_async_firestore_client()
+    async for document in stream_documents(db, "users", conditions=[("age", ">=", 18)], parallel=4):
+        ...
+    async with AsyncBatchCommitter(db) as committer:
+        await committer.set(db.collection("users").document("a"), {"name": "A"})
+
+iter_async turns the async iterators into plain iterators for the synchronous CLI, iter_threaded feeds
+the documents parsed from files to the loop.
+"""
+import asyncio
+import queue
+import random
+import threading
+import time
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple, Union
+
+from google.cloud.firestore_v1.async_query import AsyncCollectionGroup
+from firebatch.batching import MAX_BATCH_SIZE, RETRYABLE_ERRORS
+from firebatch.columnar import ROW_GROUP_SIZE
+from firebatch.deletion import LIST_PAGE_SIZE
+from firebatch.endcoding import field_path_tree
+from firebatch.metrics import metrics
+from firebatch.firestore_client import create_async_firestore_client
+from firebatch.operations import aggregation_alias, document_preparer, document_serializer, print_verbose, write_document_stream
+from firebatch.partitions import partition_query
+from firebatch.utils import apply_query_options, get_query_reference, projection_fields
+import logging
+logger = logging.getLogger(__name__)
+
+CONCURRENCY = 16
+_DONE = object()
+
+class _Failed:
+    """Carries an exception of a producer task to the consumer."""
+    def __init__(self, error: BaseException):
+        self.error = error
+
+async def _aiter(items: Union[Iterable, AsyncIterable]) -> AsyncIterator:
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+async def _chunks(items: Union[Iterable, AsyncIterable], size: int) -> AsyncIterator[List[Any]]:
+    chunk = []
+    async for item in _aiter(items):
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+async def merge(iterators: List[AsyncIterator], buffer_size: int = 1000) -> AsyncIterator:
+    """Consumes the async iterators concurrently and yields their items as they arrive, at most buffer_size are buffered."""
+    items = asyncio.Queue(buffer_size)
+
+    async def pump(iterator: AsyncIterator):
+        try:
+            async for item in iterator:
+                await items.put(item)
+        except Exception as e:
+            await items.put(_Failed(e))
+        finally:
+            await items.put(_DONE)
+
+    tasks = [asyncio.create_task(pump(iterator)) for iterator in iterators]
+    producers = len(tasks)
+    try:
+        while producers:
+            item = await items.get()
+            if item is _DONE:
+                producers -= 1
+            elif isinstance(item, _Failed):
+                raise item.error
+            else:
+                yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+def iter_async(iterable: AsyncIterable, size: int = 1000) -> Iterator:
+    """Runs the async iterable in an event loop of a background thread and yields its items synchronously,
+    like utils.prefetch. At most size items are buffered, the loop only waits in a worker thread while the buffer is full."""
+    items = queue.Queue(size)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    async def produce():
+        try:
+            async for item in iterable:
+                if stop.is_set():
+                    return
+                try:
+                    items.put_nowait(item)  # no thread hop while the consumer keeps up
+                except queue.Full:
+                    if not await asyncio.to_thread(put, item):
+                        return
+        except BaseException as e:
+            put(_Failed(e))
+        finally:
+            put(_DONE)
+
+    thread = threading.Thread(target=asyncio.run, args=(produce(),), name="firebatch-asyncio", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                break
+            if isinstance(item, _Failed):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+async def iter_threaded(iterable: Iterable, chunk_size: int = 100, buffer_size: int = 10) -> AsyncIterator:
+    """The opposite of iter_async: iterates a blocking iterable (e.g. the documents parsed from a file) in a
+    producer thread and hands its items to the event loop in chunks with loop.call_soon_threadsafe, so parsing
+    does not stall the RPCs of the loop. At most buffer_size chunks are buffered."""
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue()
+    slots = threading.Semaphore(buffer_size)
+    stop = threading.Event()
+
+    def send(chunk) -> bool:
+        while not slots.acquire(timeout=0.1):
+            if stop.is_set():
+                return False
+        loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+        return True
+
+    def produce():
+        try:
+            chunk = []
+            for item in iterable:
+                chunk.append(item)
+                if len(chunk) >= chunk_size:
+                    if stop.is_set() or not send(chunk):
+                        return
+                    chunk = []
+            if chunk and not send(chunk):
+                return
+            send(_DONE)
+        except BaseException as e:
+            send(_Failed(e))
+
+    thread = threading.Thread(target=produce, name="firebatch-parse", daemon=True)
+    thread.start()
+    try:
+        while True:
+            chunk = await chunks.get()
+            slots.release()
+            if chunk is _DONE:
+                return
+            if isinstance(chunk, _Failed):
+                raise chunk.error
+            for item in chunk:
+                yield item
+    finally:
+        stop.set()
+        await asyncio.to_thread(thread.join)
+
+# --- reads
+
+async def _partition_queries(db, collection_path: str, collection_group: bool, partition_count: int,
+                             conditions: List[Tuple[str, str, Any]], select: Optional[List[str]]) -> List[Any]:
+    """The async counterpart of operations._query_partitions, without a checkpoint."""
+    if collection_group:
+        group, collection_ref = db.collection_group(collection_path), None
+    else:
+        collection_ref = get_query_reference(db, collection_path)
+        group = AsyncCollectionGroup(collection_ref)
+    metrics.count("rpcs", method="partition_query")
+    with metrics.timer("rpc", method="partition_query"):
+        partitions = [partition async for partition in group.get_partitions(partition_count)]
+    queries = [partition_query(db, group, partition.start_at and partition.start_at.path, partition.end_at and partition.end_at.path,
+                               conditions, select, collection_ref) for partition in partitions]
+    return [query for query in queries if query is not None]
+
+async def _stream_query(query, semaphore: asyncio.Semaphore) -> AsyncIterator[Any]:
+    async with semaphore:
+        metrics.count("rpcs", method="run_query")
+        count = 0
+        try:
+            async for doc in query.stream():
+                count += 1
+                yield doc
+        finally:
+            metrics.count("documents_read", count)
+
+async def stream_snapshots(db,
+                           collection_path: str,
+                           collection_group: bool = False,
+                           conditions: List[Tuple[str, str, Any]] = [],
+                           order_by: Optional[str] = None,
+                           limit: Optional[int] = None,
+                           select: Optional[List[str]] = None,
+                           parallel: int = 1,
+                           concurrency: int = CONCURRENCY) -> AsyncIterator[Any]:
+    """
+    Yields the document snapshots of the query. With parallel > 1 the query is split into partitions,
+    at most concurrency of them are streamed at the same time and their documents are merged as they arrive.
+    select is a projection as returned by utils.projection_fields.
+    """
+    if parallel > 1:
+        if order_by:
+            raise ValueError("--order-by can not be combined with --parallel.")
+        queries = await _partition_queries(db, collection_path, collection_group, parallel, conditions, select)
+    else:
+        queries = [apply_query_options(get_query_reference(db, collection_path, collection_group), conditions, order_by, limit, select)]
+
+    semaphore = asyncio.Semaphore(concurrency)
+    snapshots = merge([_stream_query(query, semaphore) for query in queries])
+    retrieved = 0
+    try:
+        async for doc in snapshots:
+            yield doc
+            retrieved += 1
+            if limit and retrieved >= limit:
+                break  # partitions can not be limited individually
+    finally:
+        await snapshots.aclose()
+
+async def stream_documents(db,
+                           collection_path: str,
+                           collection_group: bool = False,
+                           raw: bool = False,
+                           conditions: List[Tuple[str, str, Any]] = [],
+                           order_by: Optional[str] = None,
+                           limit: Optional[int] = None,
+                           select: Optional[List[str]] = None,
+                           ids_only: bool = False,
+                           parallel: int = 1,
+                           concurrency: int = CONCURRENCY) -> AsyncIterator[dict]:
+    """Yields the exported documents of the query, like operations.stream_collection_documents (see stream_snapshots)."""
+    doc_to_document = document_serializer(raw, collection_group, ids_only)
+    snapshots = stream_snapshots(db, collection_path, collection_group, conditions, order_by, limit,
+                                 projection_fields(select, ids_only, conditions, order_by), parallel, concurrency)
+    async for doc in snapshots:
+        yield doc_to_document(doc)
+
+async def stream_collections(db,
+                             collection_paths: List[str],
+                             raw: bool = False,
+                             conditions: List[Tuple[str, str, Any]] = [],
+                             concurrency: int = CONCURRENCY) -> AsyncIterator[Tuple[str, dict]]:
+    """Reads several collections concurrently (at most concurrency at the same time) and yields (collection path, document)."""
+    semaphore = asyncio.Semaphore(concurrency)
+    doc_to_document = document_serializer(raw, False)
+
+    async def read(collection_path: str) -> AsyncIterator[Tuple[str, dict]]:
+        query = apply_query_options(get_query_reference(db, collection_path), conditions)
+        async for doc in _stream_query(query, semaphore):
+            yield collection_path, doc_to_document(doc)
+
+    async for item in merge([read(collection_path) for collection_path in collection_paths]):
+        yield item
+
+async def aggregate(db,
+                    collection_path: str,
+                    collection_group: bool = False,
+                    conditions: List[Tuple[str, str, Any]] = [],
+                    sum_fields: List[str] = [],
+                    avg_fields: List[str] = [],
+                    limit: Optional[int] = None) -> Dict[str, Any]:
+    """Counts, sums and averages with one aggregation query, like operations.aggregate_collection."""
+    query_ref = apply_query_options(get_query_reference(db, collection_path, collection_group), conditions, limit=limit)
+    aliases = ["count"] + [aggregation_alias("sum", field) for field in sum_fields] + [aggregation_alias("avg", field) for field in avg_fields]
+    aggregation_query = query_ref.count(alias="count")
+    for field in sum_fields:
+        aggregation_query = aggregation_query.sum(field, alias=aggregation_alias("sum", field))
+    for field in avg_fields:
+        aggregation_query = aggregation_query.avg(field, alias=aggregation_alias("avg", field))
+    metrics.count("rpcs", method="run_aggregation_query")
+    with metrics.timer("rpc", method="run_aggregation_query"):
+        results = await aggregation_query.get()
+    values = {result.alias: result.value for result in results[0]}
+    return {alias: values[alias] for alias in aliases}
+
+# --- writes
+
+class AsyncBatchCommitter:
+    """
+    The asyncio counterpart of batching.BatchCommitter: collects writes into batches of batch_size and commits
+    at most max_in_flight batches at the same time, awaiting a free slot when all are in flight (backpressure).
+    Retryable errors are retried with exponential backoff, any other error is raised by the next call.
+
+    Usage:
+        async with AsyncBatchCommitter(db) as committer:
+            await committer.set(doc_ref, data)
+    """
+    def __init__(self, db,
+                 batch_size: int = MAX_BATCH_SIZE,
+                 max_in_flight: int = 4,
+                 max_retries: int = 5,
+                 backoff: float = 0.5,
+                 dry_run: bool = False):
+        if not 0 < batch_size <= MAX_BATCH_SIZE:
+            raise ValueError(f"batch_size must be between 1 and {MAX_BATCH_SIZE}.")
+        self.db = db
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.dry_run = dry_run
+
+        self.latencies: List[float] = []
+        self.committed_writes = 0
+        self.retries = 0
+
+        self._operations: List[Tuple[str, tuple, dict]] = []
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._tasks = set()
+        self._error: Optional[BaseException] = None
+
+    async def __aenter__(self) -> "AsyncBatchCommitter":
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            await self.close()
+        else:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def set(self, doc_ref, data: dict, merge: bool = False):
+        await self._add('set', (doc_ref, data), {'merge': merge} if merge else {})
+
+    async def update(self, doc_ref, data: dict):
+        await self._add('update', (doc_ref, data), {})
+
+    async def delete(self, doc_ref):
+        await self._add('delete', (doc_ref,), {})
+
+    async def _add(self, method: str, args: tuple, kwargs: dict):
+        self._raise_error()
+        self._operations.append((method, args, kwargs))
+        if len(self._operations) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self):
+        """Starts committing the pending operations, waits while max_in_flight batches are committing."""
+        if not self._operations:
+            return
+        operations, self._operations = self._operations, []
+        await self._slots.acquire()
+        task = asyncio.create_task(self._commit(operations))
+        self._tasks.add(task)
+        task.add_done_callback(self._batch_done)
+        await asyncio.sleep(0)  # let the commit send its request before the caller continues parsing
+
+    async def close(self):
+        """Commits the remaining operations and waits for all batches, raising the first commit error."""
+        await self.flush()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._raise_error()
+
+    def _batch_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        self._slots.release()
+        if not task.cancelled() and task.exception() is not None and self._error is None:
+            self._error = task.exception()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    async def _commit(self, operations: List[Tuple[str, tuple, dict]]):
+        if self.dry_run:
+            self.committed_writes += len(operations)
+            metrics.count("writes_dry_run", len(operations))
+            return
+
+        attempt = 0
+        while True:
+            batch = self.db.batch()
+            for method, args, kwargs in operations:
+                getattr(batch, method)(*args, **kwargs)
+            start = time.perf_counter()
+            metrics.count("rpcs", method="commit")
+            try:
+                await batch.commit()
+            except RETRYABLE_ERRORS as e:
+                metrics.record("rpc", time.perf_counter() - start, method="commit")
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+                attempt += 1
+                self.retries += 1
+                metrics.count("retries", method="commit")
+                metrics.record("backoff", delay, method="commit")
+                logger.warning(f"Batch commit failed ({e.__class__.__name__}), retry {attempt}/{self.max_retries} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            latency = time.perf_counter() - start
+            metrics.record("rpc", latency, method="commit")
+            metrics.count("writes_committed", len(operations))
+            self.latencies.append(latency)
+            self.committed_writes += len(operations)
+            return
+
+    def report(self) -> str:
+        """Summary of the committed batches and their latencies."""
+        if not self.latencies:
+            return f"Committed {self.committed_writes} writes."
+        latencies = sorted(self.latencies)
+        return (f"Committed {self.committed_writes} writes in {len(latencies)} batches ({self.retries} retries), "
+                f"batch latency mean {sum(latencies) / len(latencies) * 1000:.1f}ms, max {latencies[-1] * 1000:.1f}ms.")
+
+async def write_documents(db,
+                          collection_path: str,
+                          documents: Union[Iterable[dict], AsyncIterable[dict]],
+                          timestamp_field: Optional[str] = None,
+                          timestamp_convert: bool = False,
+                          geopoint_convert: bool = False,
+                          convert_fields: Optional[List[str]] = None,
+                          batch_size: int = MAX_BATCH_SIZE,
+                          max_in_flight: int = 4,
+                          dry_run: bool = False) -> int:
+    """Writes the documents (exported by read, or raw ones with auto generated ids) like operations.write_documents.
+    Returns the number of written documents."""
+    collection_ref = get_query_reference(db, collection_path)
+    prepare = document_preparer(db, collection_ref, timestamp_field, timestamp_convert, geopoint_convert,
+                                field_path_tree(convert_fields) if convert_fields else None)
+    written = 0
+    async with AsyncBatchCommitter(db, batch_size=batch_size, max_in_flight=max_in_flight, dry_run=dry_run) as committer:
+        async for document in _aiter(documents):
+            await committer.set(*prepare(document))
+            written += 1
+    logger.debug(committer.report())
+    return written
+
+# --- deletes
+
+async def _with_subcollections(doc_ref, semaphore: asyncio.Semaphore) -> Tuple[Any, List[Any]]:
+    async with semaphore:
+        metrics.count("rpcs", method="list_collection_ids")
+        with metrics.timer("rpc", method="list_collection_ids"):
+            return doc_ref, [collection async for collection in doc_ref.collections()]
+
+async def _list_documents(collection_ref, semaphore: asyncio.Semaphore) -> List[Any]:
+    async with semaphore:
+        # list_documents also returns missing documents, which only exist because they have subcollections
+        with metrics.timer("rpc", method="list_documents"):
+            documents = [doc_ref async for doc_ref in collection_ref.list_documents(page_size=LIST_PAGE_SIZE)]
+        metrics.count("rpcs", len(documents) // LIST_PAGE_SIZE + 1, method="list_documents")
+        return documents
+
+async def delete_documents_recursive(doc_refs: Union[Iterable[Any], AsyncIterable[Any]],
+                                     committer: AsyncBatchCommitter,
+                                     recursive: bool = True,
+                                     concurrency: int = CONCURRENCY) -> Dict[int, int]:
+    """
+    Deletes the documents and, if recursive, all documents in their subcollections, breadth first like
+    deletion.delete_documents_recursive. The subcollections of at most concurrency documents and the documents
+    of at most concurrency subcollections are listed at the same time.
+
+    Returns:
+        Dict[int, int]: The number of deleted documents per level, level 0 are the given documents.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    deleted_per_level = {}
+    level = 0
+    documents = doc_refs
+    while True:
+        subcollections = []
+        deleted = 0
+        async for chunk in _chunks(documents, concurrency * 4):
+            if recursive:
+                documents_with_children = await asyncio.gather(*(_with_subcollections(doc_ref, semaphore) for doc_ref in chunk))
+            else:
+                documents_with_children = [(doc_ref, []) for doc_ref in chunk]
+            for doc_ref, children in documents_with_children:
+                subcollections.extend(children)
+                await committer.delete(doc_ref)
+                deleted += 1
+        deleted_per_level[level] = deleted
+        logger.debug(f"level {level}: deleting {deleted} documents, found {len(subcollections)} subcollections")
+        if not subcollections:
+            return deleted_per_level
+        listed = await asyncio.gather(*(_list_documents(collection_ref, semaphore) for collection_ref in subcollections))
+        documents = [doc_ref for children in listed for doc_ref in children]
+        level += 1
+
+async def delete_documents(db,
+                           collection_path: str,
+                           doc_ids: Union[Iterable[str], AsyncIterable[str]],
+                           recursive: bool = True,
+                           batch_size: int = MAX_BATCH_SIZE,
+                           max_in_flight: int = 4,
+                           concurrency: int = CONCURRENCY) -> Dict[int, int]:
+    """Deletes the documents with the ids (and their subcollections), like operations.delete_documents_in_firestore."""
+    collection_ref = get_query_reference(db, collection_path)
+    async with AsyncBatchCommitter(db, batch_size=batch_size, max_in_flight=max_in_flight) as committer:
+        doc_refs = (collection_ref.document(doc_id) async for doc_id in _aiter(doc_ids))
+        return await delete_documents_recursive(doc_refs, committer, recursive=recursive, concurrency=concurrency)
+
+async def delete_query_documents(db,
+                                 collection_path: str,
+                                 collection_group: bool = False,
+                                 conditions: List[Tuple[str, str, Any]] = [],
+                                 limit: Optional[int] = None,
+                                 recursive: bool = True,
+                                 batch_size: int = MAX_BATCH_SIZE,
+                                 max_in_flight: int = 4,
+                                 concurrency: int = CONCURRENCY) -> Dict[int, int]:
+    """Deletes the documents matching the query (and their subcollections), only their ids are read."""
+    snapshots = stream_snapshots(db, collection_path, collection_group, conditions, limit=limit,
+                                 select=projection_fields(None, True, conditions))
+    async with AsyncBatchCommitter(db, batch_size=batch_size, max_in_flight=max_in_flight) as committer:
+        doc_refs = (doc.reference async for doc in snapshots)
+        return await delete_documents_recursive(doc_refs, committer, recursive=recursive, concurrency=concurrency)
+
+# --- entry points of the CLI (--engine asyncio)
+
+def export_collection_documents(output: TextIO,
+                                collection_path: str,
+                                collection_group: bool,
+                                output_format: str = 'jsonl',
+                                timestamp_convert: bool = False,
+                                geopoint_convert: bool = False,
+                                raw: bool = False,
+                                conditions: List[Tuple[str, str, Any]] = [],
+                                order_by: Optional[str] = None,
+                                limit: Optional[int] = None,
+                                parallel: int = 1,
+                                concurrency: int = CONCURRENCY,
+                                schema: Optional[dict] = None,
+                                row_group_size: int = ROW_GROUP_SIZE,
+                                select: Optional[List[str]] = None,
+                                ids_only: bool = False,
+                                verbose: bool = False) -> int:
+    """Streams the documents of the query into the output like operations.export_collection_documents,
+    the partitions are read by the event loop of a background thread while the documents are encoded."""
+    async def documents() -> AsyncIterator[dict]:
+        db = create_async_firestore_client()
+        async for document in stream_documents(db, collection_path, collection_group, raw, conditions, order_by, limit,
+                                               select, ids_only, parallel, concurrency):
+            yield document
+
+    count = write_document_stream(output, iter_async(documents()), output_format, timestamp_convert, geopoint_convert, schema, row_group_size)
+    print_verbose(f"Read {count} documents of '{collection_path}'.", verbose)
+    return count
+
+def write_collection_documents(collection_path: str,
+                               documents: Iterable[dict],
+                               timestamp_field: Optional[str] = None,
+                               timestamp_convert: bool = False,
+                               geopoint_convert: bool = False,
+                               convert_fields: Optional[List[str]] = None,
+                               batch_size: int = MAX_BATCH_SIZE,
+                               max_in_flight: int = 4,
+                               verbose: bool = False,
+                               dry_run: bool = False) -> int:
+    """Writes the parsed documents like operations.write_documents, with max_in_flight concurrent commits on one event loop."""
+    async def run() -> int:
+        db = create_async_firestore_client()
+        return await write_documents(db, collection_path, iter_threaded(documents), timestamp_field, timestamp_convert, geopoint_convert,
+                                     convert_fields, batch_size, max_in_flight, dry_run)
+
+    written = asyncio.run(run())
+    print_verbose(f"Uploaded {written} documents to '{collection_path}'.", verbose)
+    return written
+
+def delete_collection_documents(collection_path: str,
+                                doc_ids: Optional[List[str]] = None,
+                                collection_group: bool = False,
+                                conditions: List[Tuple[str, str, Any]] = [],
+                                limit: Optional[int] = None,
+                                recursive: bool = True,
+                                batch_size: int = MAX_BATCH_SIZE,
+                                max_in_flight: int = 4,
+                                concurrency: int = CONCURRENCY,
+                                verbose: bool = False,
+                                dry_run: bool = False) -> Dict[int, int]:
+    """Deletes the documents with the ids, or without ids the documents matching the query, and their subcollections.
+    A dry run deletes nothing, only the number of ids or matching documents is reported."""
+    async def run() -> Dict[int, int]:
+        db = create_async_firestore_client()
+        if dry_run:
+            count = len(doc_ids) if doc_ids is not None else (await aggregate(db, collection_path, collection_group, conditions, limit=limit))["count"]
+            print_verbose(f"Dry run: would delete {count} documents of '{collection_path}'.", verbose)
+            return {}
+        if doc_ids is not None:
+            return await delete_documents(db, collection_path, doc_ids, recursive, batch_size, max_in_flight, concurrency)
+        return await delete_query_documents(db, collection_path, collection_group, conditions, limit, recursive,
+                                            batch_size, max_in_flight, concurrency)
+
+    deleted_per_level = asyncio.run(run())
+    for level, deleted in deleted_per_level.items():
+        print_verbose(f"Deleted {deleted} documents on level {level} of '{collection_path}'.", verbose)
+    return deleted_per_level
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+from concurrent.futures import Executor
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO
+
+from firebatch.batching import BatchCommitter
+from firebatch.deletion import _list_documents, _with_subcollections, bounded_map
+from firebatch.endcoding import convert_to_firestore_types, write_json_stream
+from firebatch.fileio import EXTENSIONS, open_input, open_output
+from firebatch.partitions import stream_partition
+from firebatch.utils import iter_documents
+from firebatch.metrics import metrics
+import logging
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+MANIFEST_VERSION = 1
+
+def default_workers() -> int:
+    """Size of the worker pool shared by the collections of a backup or restore. The workers mostly wait
+    for RPCs and the disk, so there are several per core."""
+    return min(32, (os.cpu_count() or 1) * 4)
+
+def collection_path(collection_ref) -> str:
+    return '/'.join(collection_ref._path)
+
+class _HashingWriter:
+    """Passes the text on to the file and hashes it, the checksum covers the uncompressed content."""
+    def __init__(self, file: TextIO):
+        self.file = file
+        self.sha256 = hashlib.sha256()
+
+    def write(self, text: str) -> int:
+        self.sha256.update(text.encode('utf-8'))
+        return self.file.write(text)
+
+def discover_collections(db, executor: Executor, roots: Optional[Iterable[str]] = None, workers: int = 8) -> Iterator[Any]:
+    """
+    Yields the collections of the database (or only the given top level collections) and all their subcollections,
+    breadth first. The documents of one level are listed concurrently and their subcollections are listed
+    concurrently, documents that only exist because they have subcollections included. The listings of a level
+    are submitted before its collections are yielded, so they are not queued behind the work the caller
+    submits for the collections to the same executor.
+    """
+    level = [db.collection(root) for root in roots] if roots else list(db.collections())
+    while level:
+        listings = [executor.submit(_list_documents, collection_ref) for collection_ref in level]
+        yield from level
+        next_level = []
+        for listing in listings:
+            for _, subcollections in bounded_map(executor, _with_subcollections, listing.result(), window=workers * 4):
+                next_level.extend(subcollections)
+        logger.debug(f"discovered {len(level)} collections, {len(next_level)} subcollections below")
+        level = next_level
+
+def export_collection(collection_ref, directory: str, file_name: str, page_size: Optional[int] = None) -> Dict[str, Any]:
+    """Writes the documents of one collection (not its subcollections) as jsonl to the file of the backup directory,
+    compressed by its extension. Returns the manifest entry with the document count and the sha256 checksum."""
+    path = collection_path(collection_ref)
+    documents = ({"__doc_id__": doc.id, "__data__": doc.to_dict()} for doc in stream_partition(collection_ref, page_size=page_size))
+    with open_output(os.path.join(directory, file_name)) as file:
+        writer = _HashingWriter(file)
+        count = write_json_stream(writer, documents)
+    logger.debug(f"exported {count} documents of '{path}' to '{file_name}'")
+    return {"path": path, "file": file_name, "documents": count, "sha256": writer.sha256.hexdigest()}
+
+def backup_collections(db, directory: str, executor: Executor, roots: Optional[Iterable[str]] = None,
+                       compression: Optional[str] = 'gzip', page_size: Optional[int] = None, workers: int = 8) -> Dict[str, Any]:
+    """
+    Exports every discovered collection to its own file in directory/collections while the discovery goes on,
+    all on the shared executor, and writes the manifest last: a backup directory with a manifest is complete.
+    Returns the manifest.
+    """
+    os.makedirs(os.path.join(directory, "collections"), exist_ok=True)
+    extension = f".jsonl{EXTENSIONS.get(compression, '')}"
+    exports = [executor.submit(export_collection, collection_ref, directory, f"collections/{index:06d}{extension}", page_size)
+               for index, collection_ref in enumerate(discover_collections(db, executor, roots, workers))]
+    entries = [export.result() for export in exports]
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "project": db.project,
+        "database": getattr(db, "_database", None),
+        "created": datetime.now(timezone.utc).isoformat(),
+        "documents": sum(entry["documents"] for entry in entries),
+        "collections": entries,
+    }
+    temporary_path = os.path.join(directory, f"{MANIFEST}.tmp")
+    with open(temporary_path, "w") as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(temporary_path, os.path.join(directory, MANIFEST))
+    return manifest
+
+def read_manifest(directory: str) -> Dict[str, Any]:
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        raise ValueError(f"'{directory}' is not a complete backup, '{MANIFEST}' is missing.")
+    with open(path) as file:
+        manifest = json.load(file)
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"Unsupported backup version {manifest.get('version')} in '{path}'.")
+    return manifest
+
+def select_collections(manifest: Dict[str, Any], roots: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+    """The manifest entries of the given top level collections and their subcollections, all without roots."""
+    if not roots:
+        return manifest["collections"]
+    roots = set(roots)
+    return [entry for entry in manifest["collections"] if entry["path"].split('/', 1)[0] in roots]
+
+def verify_collection(directory: str, entry: Dict[str, Any]):
+    """Checks the file of a manifest entry against its checksum and document count, raises ValueError otherwise."""
+    sha256, count = hashlib.sha256(), 0
+    with open_input(os.path.join(directory, entry["file"])) as file:
+        for line in file:
+            sha256.update(line.encode('utf-8'))
+            count += bool(line.strip())
+    if sha256.hexdigest() != entry["sha256"] or count != entry["documents"]:
+        raise ValueError(f"The backup of '{entry['path']}' ('{entry['file']}') does not match its checksum, the file is damaged.")
+
+def restore_collection(db, directory: str, entry: Dict[str, Any], committer: BatchCommitter) -> int:
+    """Writes the documents of a manifest entry back to their collection through the committer, returns their number."""
+    collection_ref = db.collection(entry["path"])
+    count = 0
+    with open_input(os.path.join(directory, entry["file"])) as file:
+        for document in iter_documents(file, "jsonl"):
+            committer.set(collection_ref.document(document["__doc_id__"]), convert_to_firestore_types(db, document["__data__"], False, False))
+            count += 1
+    metrics.count("documents_restored", count)
+    return count
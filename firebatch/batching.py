@@ -0,0 +1,198 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from google.api_core.exceptions import Aborted, DeadlineExceeded, ResourceExhausted
+from firebatch.metrics import metrics
+from firebatch import ratelimit
+import logging
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_SIZE = 500  # firestore limit of writes per batch
+RETRYABLE_ERRORS = (Aborted, ResourceExhausted, DeadlineExceeded)
+
+class BatchCommitter:
+    """
+    Collects write operations into batches and commits several batches concurrently.
+
+    At most max_in_flight batches are committed at the same time, adding more operations blocks until
+    a batch finished (backpressure). Batches failing with a retryable error are retried with exponential
+    backoff, any other error is raised by the next call to set/update/delete/close.
+
+    With a RateController (rate, by default the one of the running command, see ratelimit.rate_controlled)
+    every commit attempt waits for its turn at the controlled rate and concurrency, and retryable errors back it off.
+
+    Callers can mark() the input position reached by the operations added so far. on_progress is then
+    called with the highest position up to which every batch has been committed, batches finishing out
+    of order do not advance it past a batch that is still in flight.
+
+    Usage:
+        with BatchCommitter(db) as committer:
+            committer.set(doc_ref, data)
+    """
+    def __init__(self, db,
+                 batch_size: int = MAX_BATCH_SIZE,
+                 max_in_flight: int = 4,
+                 max_retries: int = 5,
+                 backoff: float = 0.5,
+                 dry_run: bool = False,
+                 on_progress: Optional[Callable[[Any], None]] = None,
+                 rate: Optional[ratelimit.RateController] = None):
+        if not 0 < batch_size <= MAX_BATCH_SIZE:
+            raise ValueError(f"batch_size must be between 1 and {MAX_BATCH_SIZE}.")
+        self.db = db
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.dry_run = dry_run
+        self.on_progress = on_progress
+        self.rate = rate if rate is not None else ratelimit.rate_control
+
+        self.latencies: List[float] = []
+        self.committed_writes = 0
+        self.retries = 0
+
+        self._operations: List[Tuple[str, tuple, dict]] = []
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self._error: Optional[BaseException] = None
+        self._position: Any = None
+        self._next_sequence = 0
+        self._next_done_sequence = 0
+        self._done_positions: Dict[int, Any] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="firebatch-commit")
+
+    def __enter__(self) -> "BatchCommitter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._executor.shutdown(wait=True)
+
+    def set(self, doc_ref, data: dict, merge: bool = False):
+        self._add('set', (doc_ref, data), {'merge': merge} if merge else {})
+
+    def update(self, doc_ref, data: dict):
+        self._add('update', (doc_ref, data), {})
+
+    def delete(self, doc_ref):
+        self._add('delete', (doc_ref,), {})
+
+    def mark(self, position: Any):
+        """Records the input position reached by the operations added so far."""
+        self._position = position
+
+    def _add(self, method: str, args: tuple, kwargs: dict):
+        self._raise_error()
+        # a full batch is only sent when the next operation arrives, so a mark() after the last operation still belongs to it
+        if len(self._operations) >= self.batch_size:
+            self.flush()
+        self._operations.append((method, args, kwargs))
+
+    def flush(self):
+        """Hands the pending operations to a commit thread, blocks while max_in_flight batches are committing."""
+        if not self._operations:
+            return
+        operations, self._operations = self._operations, []
+        sequence, position = self._next_sequence, self._position
+        self._next_sequence += 1
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._commit, operations)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda future: self._batch_done(future, sequence, position))
+
+    def close(self):
+        """Commits the remaining operations and waits for all batches, raising the first commit error."""
+        self.flush()
+        self._executor.shutdown(wait=True)
+        self._raise_error()
+
+    def _batch_done(self, future, sequence: int, position: Any):
+        self._slots.release()
+        error = future.exception()
+        with self._lock:
+            if error is not None:
+                if self._error is None:
+                    self._error = error
+                return
+            self._done_positions[sequence] = position
+            progress = None
+            while self._next_done_sequence in self._done_positions:
+                progress = self._done_positions.pop(self._next_done_sequence)
+                self._next_done_sequence += 1
+            if progress is not None and self.on_progress:
+                self.on_progress(progress)
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def _commit(self, operations: List[Tuple[str, tuple, dict]]):
+        if self.dry_run:
+            with self._lock:
+                self.committed_writes += len(operations)
+            metrics.count("writes_dry_run", len(operations))
+            return
+
+        attempt = 0
+        while True:
+            # the batch is rebuilt for every attempt, so a failed commit never leaves partial state behind
+            with metrics.timer("build_batch"):
+                batch = self.db.batch()
+                for method, args, kwargs in operations:
+                    getattr(batch, method)(*args, **kwargs)
+            if self.rate:
+                self.rate.acquire(len(operations))
+            start, cpu_start = time.perf_counter(), time.thread_time()
+            metrics.count("rpcs", method="commit")
+            try:
+                batch.commit()
+            except RETRYABLE_ERRORS as e:
+                if self.rate:
+                    self.rate.release(contention=True)
+                metrics.record("rpc", time.perf_counter() - start, time.thread_time() - cpu_start, method="commit")
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+                attempt += 1
+                with self._lock:
+                    self.retries += 1
+                metrics.count("retries", method="commit")
+                metrics.record("backoff", delay, method="commit")
+                logger.warning(f"Batch commit failed ({e.__class__.__name__}), retry {attempt}/{self.max_retries} in {delay:.2f}s")
+                time.sleep(delay)
+                continue
+            except BaseException:
+                if self.rate:
+                    self.rate.release()
+                raise
+            if self.rate:
+                self.rate.release()
+            latency = time.perf_counter() - start
+            metrics.record("rpc", latency, time.thread_time() - cpu_start, method="commit")
+            metrics.count("writes_committed", len(operations))
+            with self._lock:
+                self.latencies.append(latency)
+                self.committed_writes += len(operations)
+            logger.debug(f"Committed batch of {len(operations)} writes in {latency * 1000:.1f}ms")
+            return
+
+    def report(self) -> str:
+        """Summary of the committed batches and their latencies."""
+        rate = f" {self.rate.report()}" if self.rate else ""
+        if not self.latencies:
+            return f"Committed {self.committed_writes} writes.{rate}"
+        latencies = sorted(self.latencies)
+        def percentile(p: float) -> float:
+            return latencies[min(int(p * len(latencies)), len(latencies) - 1)] * 1000
+        return (f"Committed {self.committed_writes} writes in {len(latencies)} batches ({self.retries} retries), "
+                f"batch latency mean {sum(latencies) / len(latencies) * 1000:.1f}ms, "
+                f"p50 {percentile(0.5):.1f}ms, p95 {percentile(0.95):.1f}ms, max {latencies[-1] * 1000:.1f}ms.{rate}")
@@ -0,0 +1,264 @@
+import json
+import math
+import os
+import re
+import sqlite3
+import time
+from contextlib import closing
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
+
+from firebatch.endcoding import parse_timestamp
+from firebatch.utils import INEQUALITY_OPERATORS
+import logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 1 << 30
+_MISSING = object()
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (name TEXT PRIMARY KEY, read_time REAL NOT NULL, documents INTEGER NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS documents (snapshot TEXT NOT NULL, path TEXT NOT NULL, doc_id TEXT NOT NULL, data TEXT NOT NULL, PRIMARY KEY (snapshot, path));
+CREATE INDEX IF NOT EXISTS documents_id ON documents (snapshot, doc_id);
+"""
+
+def default_cache_dir() -> str:
+    return os.environ.get("FIREBATCH_CACHE_DIR") or os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "firebatch")
+
+def snapshot_name(project: Optional[str], collection_path: str, collection_group: bool) -> str:
+    return f"{project or ''}:{'group' if collection_group else 'collection'}:{collection_path}"
+
+# --- local evaluation of the query conditions on exported (json) documents
+
+def _sort_key(value: Any) -> Tuple:
+    """Orders and compares the json values of exported documents like firestore orders its types and values."""
+    if value is None:
+        return (0,)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value) if not (isinstance(value, float) and math.isnan(value)) else (2, -math.inf, 'nan')
+    if isinstance(value, str):
+        return (4, value)
+    if isinstance(value, list):
+        return (8, tuple(_sort_key(item) for item in value))
+    if isinstance(value, dict):
+        if len(value) == 1:
+            if '__timestamp__' in value:
+                return (3, parse_timestamp(value['__timestamp__']))
+            if '__doc_ref__' in value:
+                return (6, tuple(value['__doc_ref__'].split('/')))
+            if '__geopoint__' in value:
+                return (7, (value['__geopoint__']['latitude'], value['__geopoint__']['longitude']))
+        return (9, tuple(sorted((key, _sort_key(item)) for key, item in value.items())))
+    raise TypeError(f"Unsupported value: {value!r}")
+
+def _condition_value(value: Any) -> Any:
+    """The value of a --where condition, as apply_query_options passes it to firestore."""
+    if isinstance(value, str) and value.lower() in ("null", "none"):
+        return None
+    return value
+
+def _values(value: Any) -> List[Any]:
+    """The list of an in, not-in or array-contains-any condition, given as a json array or a single value."""
+    if isinstance(value, list):
+        return value
+    if isinstance(value, str) and value.startswith('['):
+        try:
+            return json.loads(value)
+        except json.JSONDecodeError:
+            pass
+    return [value]
+
+def field_value(data: dict, field: str) -> Any:
+    """The value of a dotted field path in the data of a document, _MISSING if it does not exist."""
+    value = data
+    for part in field.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+def matches(data: dict, field: str, operator: str, value: Any) -> bool:
+    """Evaluates a query condition on the data of an exported document."""
+    stored = field_value(data, field)
+    if stored is _MISSING:
+        return False
+    value = _condition_value(value)
+    key = _sort_key(stored)
+    if operator == '==':
+        return key == _sort_key(value)
+    if operator == '!=':
+        return key != _sort_key(value)
+    if operator in ('<', '<=', '>', '>='):
+        other = _sort_key(value)
+        if key[0] != other[0]:
+            return False  # ranges only match values of the same type
+        return {'<': key < other, '<=': key <= other, '>': key > other, '>=': key >= other}[operator]
+    if operator == 'in':
+        return key in [_sort_key(item) for item in _values(value)]
+    if operator == 'not-in':
+        return stored is not None and key not in [_sort_key(item) for item in _values(value)]
+    if operator == 'array-contains':
+        return isinstance(stored, list) and _sort_key(value) in [_sort_key(item) for item in stored]
+    if operator == 'array-contains-any':
+        return isinstance(stored, list) and any(_sort_key(item) in [_sort_key(element) for element in stored] for item in _values(value))
+    raise ValueError(f"Unsupported operator: '{operator}'.")
+
+def _project(data: dict, fields: List[str]) -> dict:
+    """Keeps only the given (dotted) fields of the data, like a firestore projection."""
+    projected = {}
+    for field in fields:
+        value = field_value(data, field)
+        if value is _MISSING:
+            continue
+        target = projected
+        parts = field.split('.')
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+    return projected
+
+def _plain(value: Any, timestamp_convert: bool, geopoint_convert: bool) -> Any:
+    """Unwraps the timestamps and geopoints of a cached document for --timestamp-convert and --geopoint-convert."""
+    if isinstance(value, dict):
+        if len(value) == 1:
+            if timestamp_convert and '__timestamp__' in value:
+                return value['__timestamp__']
+            if geopoint_convert and '__geopoint__' in value:
+                return value['__geopoint__']
+        return {key: _plain(item, timestamp_convert, geopoint_convert) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_plain(item, timestamp_convert, geopoint_convert) for item in value]
+    return value
+
+def _json_path_literal(field: str) -> Optional[str]:
+    """The json path of the field as an sql string literal, the same text in the queries as in their indexes.
+    None if the field can not be addressed, sqlite json paths have no escape for a double quote in a name."""
+    if '"' in field:
+        return None
+    path = '$' + ''.join(f'."{part}"' for part in field.split('.'))
+    return "'" + path.replace("'", "''") + "'"
+
+class SnapshotCache:
+    """
+    A local cache of whole collection snapshots in a SQLite file, so repeated reads of a collection with
+    different filters are answered from disk instead of firestore.
+
+    A snapshot is the whole collection (or collection group) as it was read at one time, one row per document
+    holding its exported json data. query evaluates the conditions, the order and the limit locally with the
+    semantics of firestore. Equality conditions are narrowed in SQLite through an expression index on the field,
+    created the first time the field is filtered on. A snapshot is stored in one transaction, so a failed download
+    keeps the previous one, and the least recently used snapshots are evicted beyond max_bytes.
+    """
+    def __init__(self, directory: Optional[str] = None, max_bytes: int = DEFAULT_CACHE_SIZE):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, "snapshots.sqlite")
+        self._connection = sqlite3.connect(self.path)
+        self._connection.executescript(_SCHEMA)
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self) -> "SnapshotCache":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def age(self, name: str) -> Optional[float]:
+        """Seconds since the snapshot was read from firestore, None if it is not cached."""
+        row = self._connection.execute("SELECT read_time FROM snapshots WHERE name = ?", (name,)).fetchone()
+        return None if row is None else time.time() - row[0]
+
+    def store(self, name: str, documents: Iterable[Tuple[str, str, str]], read_time: float) -> int:
+        """Replaces the snapshot with the documents (path, id, json data) read at read_time and evicts the least
+        recently used snapshots beyond the cache size. Returns the number of stored documents."""
+        count = size = 0
+        with self._connection:
+            self._connection.execute("DELETE FROM documents WHERE snapshot = ?", (name,))
+            for path, doc_id, data in documents:
+                self._connection.execute("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?)", (name, path, doc_id, data))
+                count += 1
+                size += len(path) + len(doc_id) + len(data)
+            self._connection.execute("INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?)", (name, read_time, count, size, time.time()))
+        self._evict(keep=name)
+        return count
+
+    def _evict(self, keep: str):
+        snapshots = self._connection.execute("SELECT name, size FROM snapshots ORDER BY last_used DESC").fetchall()
+        total = 0
+        for name, size in snapshots:
+            total += size
+            if total > self.max_bytes and name != keep:
+                logger.info(f"Evicting the cached snapshot '{name}' ({size} bytes).")
+                with self._connection:
+                    self._connection.execute("DELETE FROM documents WHERE snapshot = ?", (name,))
+                    self._connection.execute("DELETE FROM snapshots WHERE name = ?", (name,))
+                total -= size
+
+    def query(self,
+              name: str,
+              conditions: List[Tuple[str, str, Any]] = [],
+              order_by: Optional[str] = None,
+              limit: Optional[int] = None) -> Iterator[Tuple[str, str, dict]]:
+        """Yields (path, id, data) of the cached documents matching the conditions, ordered like firestore orders
+        the query: by the order_by (or the first inequality) field, then by the document path."""
+        with self._connection:
+            self._connection.execute("UPDATE snapshots SET last_used = ? WHERE name = ?", (time.time(), name))
+        sql = "SELECT path, doc_id, data FROM documents WHERE snapshot = ?"
+        parameters: List[Any] = [name]
+        for field, operator, value in conditions:
+            value = _condition_value(value)
+            path = _json_path_literal(field)
+            if operator == '==' and isinstance(value, (str, int, float)) and not isinstance(value, bool) and path:
+                # narrows the rows in sqlite through the index, the condition is still evaluated exactly below
+                self._index(field, path)
+                sql += f" AND json_extract(data, {path}) = ?"
+                parameters.append(value)
+
+        order_field = order_by or next((field for field, operator, _ in conditions if operator in INEQUALITY_OPERATORS), None)
+        with closing(self._connection.execute(sql + " ORDER BY path", parameters)) as rows:
+            documents = ((path, doc_id, json.loads(data)) for path, doc_id, data in rows)
+            documents = (document for document in documents if all(matches(document[2], *condition) for condition in conditions))
+            if order_field:
+                # firestore only returns documents that have the ordered field
+                ordered = [document for document in documents if field_value(document[2], order_field) is not _MISSING]
+                ordered.sort(key=lambda document: _sort_key(field_value(document[2], order_field)))
+                documents = iter(ordered)
+            for count, document in enumerate(documents, 1):
+                yield document
+                if limit and count >= limit:
+                    return
+
+    def _index(self, field: str, path: str):
+        index_name = "documents_field_" + re.sub(r'\W', '_', field)
+        with self._connection:
+            self._connection.execute(f"CREATE INDEX IF NOT EXISTS \"{index_name}\" ON documents (snapshot, json_extract(data, {path}))")
+
+def cached_documents(cache: SnapshotCache,
+                     name: str,
+                     collection_group: bool,
+                     raw: bool = False,
+                     conditions: List[Tuple[str, str, Any]] = [],
+                     order_by: Optional[str] = None,
+                     limit: Optional[int] = None,
+                     select: Optional[List[str]] = None,
+                     ids_only: bool = False,
+                     timestamp_convert: bool = False,
+                     geopoint_convert: bool = False) -> Iterator[dict]:
+    """Yields the cached documents of the query in the format of read."""
+    for path, doc_id, data in cache.query(name, conditions, order_by, limit):
+        if ids_only:
+            document = {"__doc_id__": doc_id, "__doc_path__": path} if collection_group else {"__doc_id__": doc_id}
+            yield document
+            continue
+        if select:
+            data = _project(data, select)
+        data = _plain(data, timestamp_convert, geopoint_convert)
+        if raw:
+            yield data
+        elif collection_group:
+            yield {"__doc_id__": doc_id, "__doc_path__": path, "__data__": data}
+        else:
+            yield {"__doc_id__": doc_id, "__data__": data}
@@ -0,0 +1,177 @@
+import hashlib
+import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Iterable, List, Optional, Tuple
+
+from firebatch.batching import BatchCommitter
+from firebatch.metrics import metrics
+import logging
+logger = logging.getLogger(__name__)
+
+GET_ALL_CHUNK_SIZE = 300  # documents fetched by one batch_get_documents call
+
+def _tagged(value: Any) -> Any:
+    """A json structure that is equal for two values exactly when firestore stores the same value:
+    every type is tagged, so e.g. 1, 1.0, True and '1' differ, and maps are compared independent of their key order."""
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return {"bool": value}
+    if isinstance(value, int):
+        return {"int": value}
+    if isinstance(value, float):
+        return {"float": repr(value)}
+    if isinstance(value, dict):
+        return {"map": {key: _tagged(item) for key, item in value.items()}}
+    if isinstance(value, (list, tuple)):
+        return {"array": [_tagged(item) for item in value]}
+    if isinstance(value, datetime):
+        # firestore keeps microseconds in UTC, naive datetimes are stored as UTC
+        value = value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+        return {"timestamp": value.isoformat()}
+    if isinstance(value, bytes):
+        return {"bytes": value.hex()}
+    if hasattr(value, "latitude") and hasattr(value, "longitude"):
+        return {"geopoint": [value.latitude, value.longitude]}
+    if hasattr(value, "path") and hasattr(value, "collection"):
+        return {"reference": value.path}
+    raise TypeError(f"Can not compare values of type {type(value).__name__}.")
+
+def canonical_hash(value: Any) -> str:
+    """A hash of a firestore value (a document, a field) that does not depend on the order of map keys."""
+    encoded = json.dumps(_tagged(value), sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.blake2b(encoded.encode('utf-8'), digest_size=16).hexdigest()
+
+def _has_transforms(data: dict) -> bool:
+    """Whether the data holds server side transforms (SERVER_TIMESTAMP, Increment, ArrayUnion, ...), their result is unknown before the write."""
+    for value in data.values():
+        if type(value).__module__.startswith("google.cloud.firestore_v1.transforms"):
+            return True
+        if isinstance(value, dict) and _has_transforms(value):
+            return True
+    return False
+
+class ChangedWritesFilter:
+    """
+    Stands in for a BatchCommitter and only passes on the writes that change the stored document.
+
+    The set and update operations are collected into chunks of chunk_size, the stored documents of a chunk
+    are fetched with one get_all call while the next chunks are collected (at most max_in_flight fetches run
+    at the same time), and every write whose data hashes to the same value as the stored data is dropped.
+    A set is compared with the whole document, an update (or set with merge) with the fields it writes.
+    Fields in ignore_fields (e.g. a server timestamp) are not compared, writes with other transforms and writes
+    to missing documents (including generated ids) are always passed on. Marks are passed on in order, so
+    checkpoints keep working; a resumed run only compares the skipped documents again.
+
+    Usage:
+        with BatchCommitter(db) as committer, ChangedWritesFilter(db, committer) as writes:
+            writes.set(doc_ref, data)
+        print(writes.unchanged)
+    """
+    def __init__(self, db,
+                 committer: BatchCommitter,
+                 chunk_size: int = GET_ALL_CHUNK_SIZE,
+                 max_in_flight: int = 4,
+                 ignore_fields: Iterable[str] = ()):
+        self.db = db
+        self.committer = committer
+        self.chunk_size = chunk_size
+        self.max_in_flight = max_in_flight
+        self.ignore_fields = frozenset(ignore_fields)
+
+        self.changed = 0
+        self.unchanged = 0
+
+        self._operations: List[Tuple[str, tuple, dict]] = []
+        self._writes = 0
+        self._fetches = deque()
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="firebatch-compare")
+
+    def __enter__(self) -> "ChangedWritesFilter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def set(self, doc_ref, data: dict, merge: bool = False):
+        self._add('set', (doc_ref, data), {'merge': merge} if merge else {})
+
+    def update(self, doc_ref, data: dict):
+        self._add('update', (doc_ref, data), {})
+
+    def mark(self, position: Any):
+        self._operations.append(('mark', (position,), {}))
+
+    def _add(self, method: str, args: tuple, kwargs: dict):
+        self._operations.append((method, args, kwargs))
+        self._writes += 1
+        if self._writes >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Starts fetching the stored documents of the collected operations, passes on the chunks already compared."""
+        if self._operations:
+            operations, self._operations, self._writes = self._operations, [], 0
+            self._fetches.append(self._executor.submit(self._compare, operations))
+        while len(self._fetches) >= self.max_in_flight:
+            self._pass_on(self._fetches.popleft().result())
+
+    def close(self):
+        """Compares the remaining operations and passes on the changed ones, the committer is not closed."""
+        self.flush()
+        while self._fetches:
+            self._pass_on(self._fetches.popleft().result())
+        self._executor.shutdown(wait=True)
+
+    def _pass_on(self, operations: List[Tuple[str, tuple, dict, bool]]):
+        unchanged = 0
+        for method, args, kwargs, changed in operations:
+            if method == 'mark':
+                self.committer.mark(*args)
+            elif changed:
+                self.changed += 1
+                getattr(self.committer, method)(*args, **kwargs)
+            else:
+                unchanged += 1
+        self.unchanged += unchanged
+        metrics.count("writes_unchanged", unchanged)
+
+    def _compare(self, operations: List[Tuple[str, tuple, dict]]) -> List[Tuple[str, tuple, dict, bool]]:
+        """Runs in a fetch thread: gets the stored documents of the operations and decides which ones change them."""
+        doc_refs = {args[0].path: args[0] for method, args, _ in operations if method != 'mark'}
+        snapshots = {}
+        if doc_refs:
+            metrics.count("rpcs", method="batch_get_documents")
+            with metrics.timer("rpc", method="batch_get_documents"):
+                snapshots = {snapshot.reference.path: snapshot for snapshot in self.db.get_all(doc_refs.values())}
+            metrics.count("documents_read", len(snapshots))
+        return [(method, args, kwargs, method != 'mark' and self._changes(snapshots.get(args[0].path), method, args[1], kwargs))
+                for method, args, kwargs in operations]
+
+    def _changes(self, snapshot, method: str, data: dict, kwargs: dict) -> bool:
+        if snapshot is None or not snapshot.exists:
+            return True
+        data = {key: value for key, value in data.items() if key not in self.ignore_fields}
+        if _has_transforms(data):
+            return True
+        try:
+            if method == 'set' and not kwargs.get('merge'):
+                stored = {key: value for key, value in snapshot.to_dict().items() if key not in self.ignore_fields}
+                return canonical_hash(stored) != canonical_hash(data)
+            # an update only replaces the given fields (keys can be dotted field paths)
+            for field, value in data.items():
+                try:
+                    stored = snapshot.get(field)
+                except KeyError:
+                    return True
+                if canonical_hash(stored) != canonical_hash(value):
+                    return True
+            return False
+        except TypeError as e:
+            logger.debug(f"'{snapshot.reference.path}' is written, {e}")
+            return True
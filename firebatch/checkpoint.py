@@ -0,0 +1,71 @@
+import json
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+import logging
+logger = logging.getLogger(__name__)
+
+class Checkpoint:
+    """
+    Progress of a command persisted in a small json file, so an interrupted run can continue where it stopped.
+
+    The file is rewritten atomically on every save and removed by complete(). A checkpoint can only be
+    resumed by the same command on the same collection.
+    """
+    def __init__(self, path: str, command: str, target: str):
+        self.path = path
+        self.state = {}
+        self._resumed = False
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as file:
+                state = json.load(file)
+            if state.get("command") != command or state.get("target") != target:
+                raise ValueError(f"Checkpoint '{path}' belongs to '{state.get('command')} {state.get('target')}', not to '{command} {target}'.")
+            self.state = state
+            self._resumed = True
+            logger.info(f"Resuming '{command} {target}' from checkpoint '{path}'.")
+        self.state.update(command=command, target=target)
+
+    @property
+    def resumed(self) -> bool:
+        """The progress was loaded from the file of an earlier run."""
+        return self._resumed
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            return self.state.get(key, default)
+
+    def save(self, **values: Any):
+        """Updates the given top level values and writes the checkpoint file."""
+        with self._lock:
+            self.state.update(values)
+            self._write()
+
+    def save_positions(self, positions: Dict[int, Tuple[str, Optional[dict]]], count: Optional[int] = None):
+        """Records the last written document (path and cursor values) of the partitions of a read."""
+        with self._lock:
+            saved_positions = self.state.setdefault("positions", {})
+            for partition, (path, cursor) in positions.items():
+                saved_positions[str(partition)] = {"path": path, "cursor": cursor}
+            if count is not None:
+                self.state["count"] = count
+            self._write()
+
+    def save_shard(self, shard: str, position: int, done: bool = False):
+        """Records the number of committed input documents of one input shard of a write, done once all are committed."""
+        with self._lock:
+            self.state.setdefault("shards", {})[shard] = {"position": position, "done": done}
+            self._write()
+
+    def _write(self):
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(self.state, file)
+        os.replace(temporary_path, self.path)
+
+    def complete(self):
+        """The command finished, a new run starts from the beginning again."""
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
@@ -1,19 +1,20 @@
-from typing import Any, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 import click
+import functools
 import sys
 import json
-import importlib
 import logging
-from firebatch.operations import download_collection_documents, write_documents, delete_documents_in_firestore 
-from firebatch.operations import process_deletion_file, update_documents_in_firestore, list_firestore_collections
-from firebatch.utils import read_documents, validate_queries
-
-try:
-    from pydantic import ValidationError
-    PYDANTIC_AVAILABLE = True
-except ImportError:
-    PYDANTIC_AVAILABLE = False
-    ValidationError = None
+import os
+import shlex
+from contextlib import contextmanager
+# Only light modules are imported here. firebatch.operations pulls in the firestore client library,
+# it is imported inside the commands so --help and usage errors stay fast.
+from firebatch.utils import iter_documents, validate_queries
+from firebatch.checkpoint import Checkpoint
+from firebatch.metrics import metrics, profiled
+from firebatch.fileio import expand_paths, open_input, open_output, parse_duration, parse_size, resolve_compression
+from firebatch.firestore_client import pool
+from firebatch import ratelimit
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -25,6 +26,10 @@ class StdCommand(click.Command):
         self.params.insert(1, click.Option(['--verbose', '-v'], is_flag=True, help='Enables verbose mode.'))
         self.params.insert(2, click.Option(['--dry-run', '-d'], is_flag=True, help='Runs the command without making any changes.'))
         self.params.insert(3, click.Option(['--collection', '-c'], required=True, help='Firestore collection path (e.g., "users/user_id/orders").'))
+        self.params.append(click.Option(['--metrics'], type=click.Choice(['summary', 'json', 'prometheus']), default=None, help='Record timings per phase (parse, convert, encode, output, fetch, rpc) and counters, and report them at the end.'))
+        self.params.append(click.Option(['--metrics-file'], type=click.Path(dir_okay=False), default=None, help='Write the metrics to this file instead of stderr.'))
+        self.params.append(click.Option(['--profile'], type=click.Choice(['cprofile', 'pyinstrument']), default=None, help='Profile the command, pyinstrument has to be installed separately.'))
+        self.params.append(click.Option(['--profile-file'], type=click.Path(dir_okay=False), default=None, help='Write the profile to this file (pstats for cprofile, html or text for pyinstrument) instead of stderr.'))
 
     def invoke(self, ctx: click.Context) -> Optional[Any]:
         debug = ctx.params.get('debug')
@@ -34,136 +39,749 @@ class StdCommand(click.Command):
             logging.getLogger().setLevel(logging.INFO)
         
         ctx.params.pop('debug', None)  # Remove debug so it's not passed to commands
-        
-        # Continue with the standard command invocation
-        return super().invoke(ctx)
+        metrics_format = ctx.params.pop('metrics', None)
+        metrics_file = ctx.params.pop('metrics_file', None)
+        profiler = ctx.params.pop('profile', None)
+        profile_file = ctx.params.pop('profile_file', None)
+
+        if metrics_format:
+            metrics.enable(command=ctx.command.name, collection=ctx.params.get('collection'))
+        try:
+            with profiled(profiler, profile_file):
+                # Continue with the standard command invocation
+                return super().invoke(ctx)
+        except ImportError as e:
+            if profiler == 'pyinstrument' and 'pyinstrument' in str(e):
+                raise click.UsageError(str(e))
+            raise
+        finally:
+            if metrics_format:
+                write_metrics(metrics_format, metrics_file)
+                metrics.disable()
+
+def write_metrics(format: str, path: Optional[str]):
+    """Reports the metrics to stderr or atomically to a file (a scraper never sees a half written file)."""
+    if not path:
+        metrics.report(format, sys.stderr)
+        return
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'w') as file:
+        metrics.report(format, file)
+    os.replace(temporary_path, path)
 
 def ensure_pydantic():
-    if not PYDANTIC_AVAILABLE:
+    try:
+        import pydantic
+    except ImportError:
         logging.error("Pydantic not available, please install it with 'pip install firebatch[validation]'")
         sys.exit(1)
 
-def load_validator(validator):
-    """Dynamically loads a Pydantic model class from a string."""
+def validation_options(command):
+    """Adds the options of the validation stage of write and update."""
+    command = click.option('--validation-processes', type=click.IntRange(min=1), default=1, help='Validate the batches of documents in this many processes, for expensive validators and large inputs.')(command)
+    command = click.option('--rejects', type=click.Path(dir_okay=False), default=None, help='Write the documents the validator rejects with their errors to this jsonl file (compressed by its extension) and continue, instead of stopping at the first one.')(command)
+    command = click.option('--validator', default=None, help='Validator module and class name (e.g., "my_validators:MyValidatorClass"), a pydantic model the data of every document is validated against.')(command)
+    return command
+
+@contextmanager
+def document_validator(validator: Optional[str], rejects: Optional[str], processes: int, verbose: bool = False):
+    """Opens the validation stage of write and update, yields None without a validator."""
+    if not validator:
+        if rejects or processes > 1:
+            raise click.UsageError("--rejects and --validation-processes can only be used with --validator.")
+        yield None
+        return
     ensure_pydantic()
-    if validator:
-        module_name, class_name = validator.rsplit(':', 1)
+    from firebatch.validation import DocumentValidator, InvalidDocument
+    try:
+        rejects_file = open_output(rejects, get_compression('auto', rejects)) if rejects else None
+    except OSError as e:
+        raise click.BadParameter(str(e), param_hint='--rejects')
+    try:
         try:
-            module = importlib.import_module(module_name)
-            return getattr(module, class_name)
-        except (ImportError, AttributeError) as e:
-            logging.error(f"Validator loading error: {e}")
-            sys.exit(1)
-    return None
-
-def validate_data(data, validator_class):
-    """Validates data using the provided Pydantic model class."""
-    ensure_pydantic()
-    if validator_class:
+            validate = DocumentValidator(validator, rejects_file, processes)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint='--validator')
+        with validate:
+            try:
+                yield validate
+            except InvalidDocument as e:
+                raise click.ClickException(f"{e} Earlier batches may already be committed, use --rejects to collect the rejected documents and continue.")
+        if validate.rejected:
+            logging.warning(f"{validate.rejected} documents were rejected by the validator, see '{rejects}'.")
+        elif verbose:
+            logging.info(validate.report())
+    finally:
+        if rejects_file:
+            rejects_file.close()
+
+def batch_options(callback):
+    """Adds the options of the concurrent batch commits to a mutating command, the rate control options
+    pace all batch commits of the command and are not passed to it."""
+    @functools.wraps(callback)
+    def command(*args: Any, ramp_up: bool, max_ops_per_sec: Optional[float], max_concurrency: Optional[int], **kwargs: Any) -> Any:
+        if kwargs.get('engine') == 'asyncio' and (ramp_up or max_ops_per_sec or max_concurrency):
+            raise click.UsageError("--ramp-up, --max-ops-per-sec and --max-concurrency can not be combined with --engine asyncio.")
+        with ratelimit.rate_controlled(ramp_up, max_ops_per_sec, max_concurrency):
+            return callback(*args, **kwargs)
+    command = click.option('--max-concurrency', type=click.IntRange(min=1), default=None, help='Maximum number of batches committed concurrently by the whole command (all files), halved on contention and grown back while the commits succeed.')(command)
+    command = click.option('--max-ops-per-sec', type=click.FloatRange(min=1), default=None, help='Maximum writes per second, halved on contention or quota errors and raised by 50% every 5 minutes back to the maximum.')(command)
+    command = click.option('--ramp-up', is_flag=True, default=False, help='Start at 500 writes per second and raise the rate by 50% every 5 minutes (the 500/50/5 rule), for new collections and sequential ids.')(command)
+    command = click.option('--max-in-flight', type=click.IntRange(min=1), default=4, help='Maximum number of batches that are committed concurrently.')(command)
+    command = click.option('--batch-size', type=click.IntRange(1, 500), default=500, help='Number of writes per batch (firestore allows at most 500).')(command)
+    return command
+
+def engine_option(command):
+    """Adds the options selecting the thread or the asyncio engine of a command."""
+    command = click.option('--concurrency', type=click.IntRange(min=1), default=16, help='With --engine asyncio, maximum number of concurrent partition streams and subcollection listings.')(command)
+    command = click.option('--engine', type=click.Choice(['threads', 'asyncio']), default='threads', help='threads uses the blocking client with worker threads, asyncio the AsyncClient with concurrent RPCs on one event loop.')(command)
+    return command
+
+def check_asyncio_engine(engine: str, **unsupported: Any):
+    """Rejects the options the asyncio engine does not implement."""
+    if engine != 'asyncio':
+        return
+    for name, value in unsupported.items():
+        if value:
+            raise click.UsageError(f"--{name.replace('_', '-')} can not be combined with --engine asyncio.")
+
+def query_options(command):
+    """Adds the options of delete and update that select the documents with a query instead of a file."""
+    command = click.option('--limit', type=click.IntRange(min=1), default=None, help='Only the first documents matching the query up to this number.')(command)
+    command = click.option('--where', '-w', multiple=True, callback=validate_queries, help='Select the documents with query conditions instead of a file (can specify multiple), formatted as "field operator value".')(command)
+    command = click.option('--collection-group', '-cg', is_flag=True, default=False, help='Query the collection group with the collection name instead of a file.')(command)
+    return command
+
+def split_fields(ctx, param, value: Optional[str]) -> Optional[List[str]]:
+    """Parses a comma separated list of (dotted) field paths."""
+    if not value:
+        return None
+    return [field.strip() for field in value.split(',') if field.strip()]
+
+def checkpoint_option(command):
+    """Adds the --checkpoint option that makes a command resumable."""
+    return click.option('--checkpoint', type=click.Path(dir_okay=False), default=None, help='Progress file, an interrupted run started with the same file continues where it stopped.')(command)
+
+def open_checkpoint(path: Optional[str], command: str, collection: str) -> Optional[Checkpoint]:
+    if not path:
+        return None
+    try:
+        return Checkpoint(path, command, collection)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+
+def load_columnar_schema(format: str, path: Optional[str]) -> Optional[dict]:
+    """Reads the --schema file of the parquet and arrow formats, None to infer the schema."""
+    if format not in ('parquet', 'arrow'):
+        if path:
+            raise click.UsageError("--schema can only be used with the parquet and arrow formats.")
+        return None
+    from firebatch.columnar import ensure_pyarrow, load_schema_spec
+    try:
+        ensure_pyarrow()
+        return load_schema_spec(path) if path else None
+    except (ImportError, ValueError) as e:
+        raise click.UsageError(str(e))
+
+def size_option(ctx, param, value: Optional[str]) -> Optional[int]:
+    """Parses a size like 100MB into bytes."""
+    if value is None:
+        return None
+    try:
+        return parse_size(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+def duration_option(ctx, param, value: Optional[str]) -> Optional[float]:
+    """Parses a duration like 15m into seconds."""
+    if value is None:
+        return None
+    try:
+        return parse_duration(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+def compression_option(command):
+    """Adds the --compression option of the commands reading or writing files."""
+    return click.option('--compression', type=click.Choice(['auto', 'none', 'gzip', 'zstd']), default='auto', help='Compression of the files, auto selects it by the file extension (.gz, .zst). zstd needs the zstandard package.')(command)
+
+def get_compression(compression: str, path: Optional[str]) -> Optional[str]:
+    try:
+        return resolve_compression(compression, path)
+    except (ImportError, ValueError) as e:
+        raise click.UsageError(str(e))
+
+CHECK_ONLY = 'firebatch.check_only'  # context meta key set while run parses the lines of a script
+
+class InputFile(click.ParamType):
+    """A file argument like click.File('r') that decompresses .gz and .zst files."""
+    name = "file"
+
+    def convert(self, value, param, ctx):
+        if not isinstance(value, str) or ctx.meta.get(CHECK_ONLY):
+            return value  # run checks the lines of a script before earlier lines wrote their files
         try:
-            # Validate using Pydantic model
-            return validator_class.parse_raw(data)
-        except ValidationError as e:
-            logging.error(f"Data validation error: {e}")
-            sys.exit(1)
-    else:
-        # Fallback to regular JSON parsing if no validator is provided
-        return json.loads(data)
+            file = open_input(value)
+        except (OSError, ImportError) as e:
+            self.fail(f"'{value}': {e}", param, ctx)
+        if file is not sys.stdin:
+            ctx.call_on_close(file.close)
+        return file
+
+def channel_options(ctx, param, values: Tuple[str, ...]) -> Dict[str, Any]:
+    """Parses gRPC channel options given as name=value, integer values are converted."""
+    options = {}
+    for value in values:
+        name, separator, option = value.partition('=')
+        if not separator or not name.strip():
+            raise click.BadParameter(f"'{value}' is not formatted as name=value, e.g. grpc.keepalive_time_ms=10000.")
+        option = option.strip()
+        options[name.strip()] = int(option) if option.lstrip('-').isdigit() else option
+    return options
 
 @click.group()
-def cli():
+@click.option('--channels', type=click.IntRange(min=1), default=1, help='Number of pooled Firestore clients, each with its own gRPC channel. Concurrent file uploads are spread over them.')
+@click.option('--grpc-option', 'grpc_options', multiple=True, callback=channel_options, help='gRPC channel option as name=value (can specify multiple), e.g. grpc.keepalive_time_ms=10000.')
+def cli(channels, grpc_options):
     """Overview:
 The Firebatch CLI is a command-line interface tool designed for batch operations on Google Firestore databases. It supports various operations such as reading, writing, updating, and deleting Firestore documents, with additional functionalities to handle Firestore specific data types like timestamps and geopoints. It's built to handle operations in bulk, making it ideal for migrations, backups, and batch modifications.
 
 Usage:
 firebatch [OPTIONS] COMMAND [ARGS]...
 """
-    pass
+    pool.configure(channels, grpc_options)
 
 @cli.command(cls=StdCommand)
 @click.option('--collection-group', '-cg', is_flag=True, default=False, help='Treat the collection name as a collection group name for a collection group query.')
-@click.option('--format', '-f', type=click.Choice(['json', 'jsonl']), default='jsonl', help='Output format for reading documents.')
+@click.option('--format', '-f', type=click.Choice(['json', 'jsonl', 'parquet', 'arrow']), default='jsonl', help='Output format for reading documents. parquet and arrow (IPC file) need pyarrow and are binary, redirect them to a file or use --output-dir.')
 @click.option('--timestamp-convert', '-t', is_flag=True, help='convert firestore timestamps to simple datetime string in isoformat, otherwise the value will be wrapped with the key __timestamp__ for converting it back when writing.')
 @click.option('--geopoint-convert', '-g', is_flag=True, help='convert geopoints to simple map with longitude and latitude, otherwise the values will be wrapped with the key __geopoint__ for converting it back when writing.')
 @click.option('--raw', is_flag=True, default=False, help='disable the document ids in the output json and only output the data.')
 @click.option('--where', '-w', multiple=True, callback=validate_queries, help='Query conditions (can specify multiple), formatted as "field operator value".')
 @click.option('--order-by', help='Field to order the results by.')
 @click.option('--limit', type=int, help='Limit the number of results.')
-def read(collection, collection_group, format, timestamp_convert, geopoint_convert, where, order_by, limit, verbose, raw, dry_run):
+@click.option('--select', callback=split_fields, default=None, help='Comma separated (dotted) field paths, only these fields are downloaded. The fields of --order-by and inequality filters are always included.')
+@click.option('--ids-only', is_flag=True, default=False, help='Only download the document ids (and paths for collection groups), e.g. for a later delete.')
+@click.option('--page-size', type=click.IntRange(min=1), default=None, help='Read the query in pages of this many documents, each continuing after the last document of the previous one, to bound the size of a single request.')
+@click.option('--parallel', '-p', type=click.IntRange(min=1), default=1, help='Split the query into this many partitions and download them concurrently.')
+@click.option('--ordered', is_flag=True, default=False, help='With --parallel, output the documents ordered by their path instead of as they arrive.')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), default=None, help='Write the documents to this file instead of printing them, compressed by its extension (.gz, .zst).')
+@click.option('--output-dir', type=click.Path(file_okay=False), default=None, help='Write one shard file per partition into this directory instead of printing the documents.')
+@click.option('--shard-docs', type=click.IntRange(min=1), default=None, help='With --output-dir, start a new shard file after this many documents.')
+@click.option('--shard-size', callback=size_option, default=None, help='With --output-dir, start a new shard file once it reaches this size on disk (e.g. 256MB, 1G).')
+@compression_option
+@click.option('--schema', type=click.Path(exists=True, dir_okay=False), default=None, help='With parquet or arrow, json file mapping the fields to their types (string, int64, float64, bool, bytes, timestamp, geopoint, reference, json, a map of fields or a list of one type). Inferred from the first row group by default.')
+@click.option('--row-group-size', type=click.IntRange(min=1), default=10000, help='With parquet or arrow, number of documents per row group, bounds the memory used.')
+@checkpoint_option
+@click.option('--incremental', type=click.Path(dir_okay=False), default=None, help='Watermark file, only the documents changed since the run that saved it are exported (all on the first run). Combine the outputs with "firebatch merge".')
+@click.option('--watermark-field', default=None, help='With --incremental, field holding the last change of a document (e.g. a server timestamp set by every write), filtered on the server. By default the update time of the documents is used, which needs every document to be read.')
+@click.option('--cache', is_flag=True, default=False, help='Answer the query from a local snapshot of the whole collection, downloaded on the first read and again once it is older than --max-staleness. The conditions, order and limit are evaluated locally.')
+@click.option('--max-staleness', callback=duration_option, default='1h', help='With --cache, the age (e.g. 90s, 15m, 2h, 1d) up to which a cached snapshot answers the query, 1h by default.')
+@click.option('--refresh', is_flag=True, default=False, help='With --cache, download the collection again even if the cached snapshot is recent enough.')
+@click.option('--cache-dir', type=click.Path(file_okay=False), default=None, help='Directory of the cache, $FIREBATCH_CACHE_DIR or ~/.cache/firebatch by default.')
+@click.option('--cache-size', callback=size_option, default='1G', help='With --cache, the least recently used snapshots are evicted beyond this size (e.g. 500MB, 2G), 1G by default.')
+@engine_option
+def read(collection, collection_group, format, timestamp_convert, geopoint_convert, where, order_by, limit, select, ids_only, page_size, parallel, ordered, output, output_dir, shard_docs, shard_size, compression, schema, row_group_size, checkpoint, incremental, watermark_field, cache, max_staleness, refresh, cache_dir, cache_size, engine, concurrency, verbose, raw, dry_run):
     """read documents from firestore and print them. By default it wraps every document with its id (needed by other commands). If the --raw flag is used then the documents are not wrapped."""
-    read_documents = download_collection_documents(collection_path=collection, 
-                                                   collection_group=collection_group,
-                                                   output_format=format,
-                                                   timestamp_convert=timestamp_convert,
-                                                   geopoint_convert=geopoint_convert,
-                                                   conditions=where,
-                                                   order_by=order_by,
-                                                   limit=limit, 
-                                                   raw=raw, 
-                                                   verbose=verbose)
-    print(read_documents, end='')
+    if parallel > 1 and order_by and not cache:
+        raise click.UsageError("--order-by can not be combined with --parallel, use --ordered to get the documents ordered by their path.")
+    if checkpoint and format != 'jsonl':
+        raise click.UsageError("--checkpoint can only be used with the jsonl format, append the output of a resumed run to the previous one.")
+    if output and output_dir:
+        raise click.UsageError("--output can not be combined with --output-dir.")
+    if ids_only and (select or raw):
+        raise click.UsageError("--ids-only can not be combined with --select or --raw.")
+    if (shard_docs or shard_size) and not output_dir:
+        raise click.UsageError("--shard-docs and --shard-size can only be used with --output-dir.")
+    # the shards of --output-dir are only compressed on request, their names get the extension
+    compression = get_compression(compression, output)
+    if compression and format in ('parquet', 'arrow'):
+        raise click.UsageError("parquet and arrow files can not be compressed.")
+    check_asyncio_engine(engine, ordered=ordered, output_dir=output_dir, page_size=page_size, checkpoint=checkpoint, incremental=incremental)
+    if watermark_field and not incremental:
+        raise click.UsageError("--watermark-field can only be used with --incremental.")
+    if incremental and (order_by or limit or raw or ids_only or checkpoint or output_dir):
+        raise click.UsageError("--incremental can not be combined with --order-by, --limit, --raw, --ids-only, --checkpoint or --output-dir.")
+    if (refresh or cache_dir) and not cache:
+        raise click.UsageError("--refresh and --cache-dir can only be used with --cache.")
+    if cache and (incremental or checkpoint or output_dir or engine == 'asyncio' or format in ('parquet', 'arrow')):
+        raise click.UsageError("--cache can not be combined with --incremental, --checkpoint, --output-dir, --engine asyncio or the parquet and arrow formats.")
+    schema = load_columnar_schema(format, schema)
+    checkpoint = open_checkpoint(checkpoint, 'read', collection)
+    if engine == 'asyncio':
+        from firebatch.aio import export_collection_documents
+    else:
+        from firebatch.operations import export_collection_documents, export_collection_shards
+    if output_dir:
+        if order_by or limit:
+            raise click.UsageError("--order-by and --limit can not be combined with --output-dir.")
+        export_collection_shards(output_dir,
+                                 collection_path=collection,
+                                 collection_group=collection_group,
+                                 output_format=format,
+                                 timestamp_convert=timestamp_convert,
+                                 geopoint_convert=geopoint_convert,
+                                 conditions=where,
+                                 parallel=parallel,
+                                 checkpoint=checkpoint,
+                                 schema=schema,
+                                 row_group_size=row_group_size,
+                                 compression=compression,
+                                 max_shard_documents=shard_docs,
+                                 max_shard_bytes=shard_size,
+                                 select=select,
+                                 ids_only=ids_only,
+                                 page_size=page_size,
+                                 raw=raw,
+                                 verbose=verbose)
+        return
+    if output or compression:
+        # a resumed read continues the file of the interrupted one
+        output_file = open_output(output, compression or 'none', append=bool(checkpoint and checkpoint.resumed))
+    else:
+        output_file = sys.stdout
+    try:
+        if cache:
+            from firebatch.cache import SnapshotCache
+            from firebatch.operations import export_cached_documents
+            with SnapshotCache(cache_dir, cache_size) as snapshots:
+                export_cached_documents(output_file,
+                                        collection_path=collection,
+                                        collection_group=collection_group,
+                                        cache=snapshots,
+                                        max_staleness=max_staleness,
+                                        refresh=refresh,
+                                        output_format=format,
+                                        timestamp_convert=timestamp_convert,
+                                        geopoint_convert=geopoint_convert,
+                                        conditions=where,
+                                        order_by=order_by,
+                                        limit=limit,
+                                        parallel=parallel,
+                                        select=select,
+                                        ids_only=ids_only,
+                                        page_size=page_size,
+                                        raw=raw,
+                                        verbose=verbose)
+            return
+        if incremental:
+            from firebatch.incremental import UPDATE_TIME, Watermark
+            from firebatch.operations import export_changed_documents
+            try:
+                watermark = Watermark(incremental, collection, watermark_field or UPDATE_TIME)
+            except ValueError as e:
+                raise click.UsageError(str(e))
+            export_changed_documents(output_file,
+                                     collection_path=collection,
+                                     collection_group=collection_group,
+                                     watermark=watermark,
+                                     output_format=format,
+                                     timestamp_convert=timestamp_convert,
+                                     geopoint_convert=geopoint_convert,
+                                     conditions=where,
+                                     parallel=parallel,
+                                     ordered=ordered,
+                                     schema=schema,
+                                     row_group_size=row_group_size,
+                                     select=select,
+                                     page_size=page_size,
+                                     verbose=verbose)
+            return
+        if engine == 'asyncio':
+            export_collection_documents(output_file,
+                                        collection_path=collection,
+                                        collection_group=collection_group,
+                                        output_format=format,
+                                        timestamp_convert=timestamp_convert,
+                                        geopoint_convert=geopoint_convert,
+                                        conditions=where,
+                                        order_by=order_by,
+                                        limit=limit,
+                                        parallel=parallel,
+                                        concurrency=concurrency,
+                                        schema=schema,
+                                        row_group_size=row_group_size,
+                                        select=select,
+                                        ids_only=ids_only,
+                                        raw=raw,
+                                        verbose=verbose)
+            return
+        export_collection_documents(output_file,
+                                    collection_path=collection, 
+                                    collection_group=collection_group,
+                                    output_format=format,
+                                    timestamp_convert=timestamp_convert,
+                                    geopoint_convert=geopoint_convert,
+                                    conditions=where,
+                                    order_by=order_by,
+                                    limit=limit, 
+                                    parallel=parallel,
+                                    ordered=ordered,
+                                    checkpoint=checkpoint,
+                                    schema=schema,
+                                    row_group_size=row_group_size,
+                                    select=select,
+                                    ids_only=ids_only,
+                                    page_size=page_size,
+                                    raw=raw, 
+                                    verbose=verbose)
+    finally:
+        if output_file is not sys.stdout:
+            output_file.close()
 
 @cli.command(cls=StdCommand)
 @click.option('--timestamp-field', default=None, help='name of the field to set a server timestamp of insertion.')
-@click.option('--format', type=click.Choice(['json', 'jsonl', 'auto']), default="auto", help='name of the field to set a server timestamp of insertion.')
+@click.option('--format', type=click.Choice(['json', 'jsonl', 'parquet', 'arrow', 'auto']), default="auto", help='Input format, auto detects json and jsonl by the content and parquet and arrow by the file extension (.parquet, .arrow, .feather).')
 @click.option('--timestamp-convert', '-t', is_flag=True, help='auto detect timestamps (datetime string in isoformat) and convert them to firebase Timestamp type.')
 @click.option('--geopoint-convert', '-g', is_flag=True, help='auto detect geopoints (map with only longitude and latitude) and convert them to firebase GeoPoint type.')
-@click.argument('file', type=click.File('r'), required=True)
-def write(collection, file, timestamp_field, timestamp_convert, geopoint_convert, format, verbose, dry_run):
-    """write the documents from the file to firestore. If the documents are in raw mode then they will be inserted with auto generated ids."""
-    write_documents(collection_path=collection, 
-                    file=file, 
-                    timestamp_field=timestamp_field, 
-                    timestamp_convert=timestamp_convert,
-                    geopoint_convert=geopoint_convert,
-                    format=format, 
-                    verbose=verbose, 
-                    dry_run=dry_run)
+@click.option('--convert-fields', callback=split_fields, default=None, help='Comma separated (dotted) field paths, only these fields are searched for timestamps, geopoints and document references. Speeds up the conversion of large documents.')
+@click.argument('files', nargs=-1, required=True)
+@compression_option
+@click.option('--parallel', '-p', type=click.IntRange(min=1), default=None, help='With several files, number of files uploaded concurrently (default: one worker per file). Every worker has its own --max-in-flight batches.')
+@click.option('--only-changed', is_flag=True, default=False, help='Fetch the stored documents in chunks and only write the documents the input changes, the unchanged ones are counted. Costs one read per document, saves the write and its triggers.')
+@validation_options
+@batch_options
+@checkpoint_option
+@engine_option
+def write(collection, files, timestamp_field, timestamp_convert, geopoint_convert, convert_fields, format, compression, parallel, only_changed, validator, rejects, validation_processes, batch_size, max_in_flight, checkpoint, engine, concurrency, verbose, dry_run):
+    """write the documents from the files to firestore. FILES are paths or (quoted) glob patterns like 'backup/part-*.jsonl.gz', several files are uploaded concurrently. If the documents are in raw mode then they will be inserted with auto generated ids."""
+    try:
+        paths = expand_paths(files)
+    except FileNotFoundError as e:
+        raise click.UsageError(str(e))
+    for path in paths:
+        get_compression(compression, path)
+    check_asyncio_engine(engine, checkpoint=checkpoint, parallel=parallel, only_changed=only_changed, validator=validator)
+    if engine == 'asyncio':
+        if format in ('parquet', 'arrow'):
+            raise click.UsageError("--engine asyncio only writes json and jsonl files.")
+        if '-' in paths and len(paths) > 1:
+            raise click.UsageError("stdin ('-') can not be combined with other files.")
+        from firebatch.aio import write_collection_documents
+        # the files are parsed one after the other into the same concurrent batch commits
+        def documents():
+            for path in paths:
+                file = open_input(path, compression)
+                try:
+                    yield from iter_documents(file, format)
+                finally:
+                    if file is not sys.stdin:
+                        file.close()
+        write_collection_documents(collection_path=collection,
+                                   documents=documents(),
+                                   timestamp_field=timestamp_field,
+                                   timestamp_convert=timestamp_convert,
+                                   geopoint_convert=geopoint_convert,
+                                   convert_fields=convert_fields,
+                                   batch_size=batch_size,
+                                   max_in_flight=max_in_flight,
+                                   verbose=verbose,
+                                   dry_run=dry_run)
+        return
+    from firebatch.operations import write_document_files, write_documents
+    if len(paths) > 1 and '-' in paths:
+        raise click.UsageError("stdin ('-') can not be combined with other files.")
+    with document_validator(validator, rejects, validation_processes, verbose) as validate:
+        if len(paths) > 1:
+            write_document_files(collection_path=collection,
+                                 paths=paths,
+                                 timestamp_field=timestamp_field,
+                                 timestamp_convert=timestamp_convert,
+                                 geopoint_convert=geopoint_convert,
+                                 format=format,
+                                 compression=compression,
+                                 convert_fields=convert_fields,
+                                 parallel=parallel,
+                                 batch_size=batch_size,
+                                 max_in_flight=max_in_flight,
+                                 checkpoint=open_checkpoint(checkpoint, 'write', collection),
+                                 only_changed=only_changed,
+                                 validate=validate,
+                                 verbose=verbose,
+                                 dry_run=dry_run)
+            return
+        try:
+            file = open_input(paths[0], compression)
+        except OSError as e:
+            raise click.BadParameter(f"'{paths[0]}': {e}", param_hint="FILES")
+        try:
+            write_documents(collection_path=collection, 
+                            file=file, 
+                            timestamp_field=timestamp_field, 
+                            timestamp_convert=timestamp_convert,
+                            geopoint_convert=geopoint_convert,
+                            format=format, 
+                            convert_fields=convert_fields,
+                            batch_size=batch_size,
+                            max_in_flight=max_in_flight,
+                            checkpoint=open_checkpoint(checkpoint, 'write', collection),
+                            only_changed=only_changed,
+                            validate=validate,
+                            verbose=verbose, 
+                            dry_run=dry_run)
+        finally:
+            if file is not sys.stdin:
+                file.close()
 
 @cli.command(cls=StdCommand)
-@click.option('--validator', help='Validator module and class name (e.g., "my_validators:MyValidatorClass").')
 @click.option('--upsert', is_flag=True, default=False, help='if true, inserts documents if they do not exist')
 @click.option('--timestamp-field', default=None, help='Name of the field to set a server timestamp of update.')
 @click.option('--timestamp-convert', '-t', is_flag=True, help='auto detect timestamps (datetime string in isoformat) and convert them to firebase Timestamp type.')
 @click.option('--geopoint-convert', '-g', is_flag=True, help='auto detect geopoints (map with only longitude and latitude) and convert them to firebase GeoPoint type.')
-@click.argument('file', type=click.File('r'), required=True)
-def update(collection, validator, file, timestamp_field, timestamp_convert, geopoint_convert, upsert, verbose, dry_run):
-    """update all documents with the data in the file. Requires the file NOT to be in raw mode (to contain the document ids)."""
-    updates = read_documents(file)
-
-    # Optional: Validate each update data using Pydantic if validator is provided
-    if validator:
-        validator_class = load_validator(validator)
-        updates = [validate_data(json.dumps(update), validator_class) for update in updates]
-
-    update_documents_in_firestore(collection_path=collection, 
-                                  updates=updates, 
-                                  timestamp_field=timestamp_field,
-                                  timestamp_convert=timestamp_convert,
-                                  geopoint_convert=geopoint_convert,
-                                  upsert=upsert, 
-                                  verbose=verbose, 
-                                  dry_run=dry_run)
+@click.option('--convert-fields', callback=split_fields, default=None, help='Comma separated (dotted) field paths, only these fields are searched for timestamps, geopoints and document references. Speeds up the conversion of large documents.')
+@click.option('--data', default=None, help='With a query, json object of the fields to set on every matching document, e.g. \'{"status": "archived", "stats.views": {"__increment__": 1}}\'. Keys are (dotted) field paths.')
+@click.argument('file', type=InputFile(), required=False)
+@click.option('--only-changed', is_flag=True, default=False, help='Fetch the stored documents in chunks and only write the documents the input changes, the unchanged ones are counted. Costs one read per document, saves the write and its triggers.')
+@query_options
+@validation_options
+@batch_options
+@checkpoint_option
+def update(collection, file, data, collection_group, where, limit, timestamp_field, timestamp_convert, geopoint_convert, convert_fields, upsert, only_changed, validator, rejects, validation_processes, batch_size, max_in_flight, checkpoint, verbose, dry_run):
+    """update all documents with the data in the file. Requires the file NOT to be in raw mode (to contain the document ids). With --where, --collection-group or --limit the documents matching the query are updated with --data instead, their ids are streamed from firestore without reading the documents. The file is streamed: a duplicate document id stops the update when it is reached, after the batches before it may have been committed; with --checkpoint the corrected file continues after them."""
+    if where or collection_group or limit:
+        if file or not data:
+            raise click.UsageError("Update the documents of a query with --data instead of a file.")
+        if checkpoint or upsert:
+            raise click.UsageError("--checkpoint and --upsert can not be combined with a query, an interrupted update by query can simply be run again.")
+        try:
+            update_data = json.loads(data)
+        except json.JSONDecodeError as e:
+            raise click.BadParameter(str(e), param_hint='--data')
+        if not isinstance(update_data, dict) or not update_data:
+            raise click.BadParameter("must be a non empty json object.", param_hint='--data')
+        if rejects or validation_processes > 1:
+            raise click.UsageError("--rejects and --validation-processes can not be combined with a query, --data is validated once before the update.")
+        if validator:
+            ensure_pydantic()
+            from firebatch.validation import validate_batch
+            try:
+                rejected = validate_batch(validator, [update_data])
+            except ValueError as e:
+                raise click.BadParameter(str(e), param_hint='--validator')
+            if rejected:
+                raise click.BadParameter(f"Data validation error: {rejected[0]}", param_hint='--data')
+        from firebatch.operations import update_query_documents
+        update_query_documents(collection_path=collection,
+                               data=update_data,
+                               collection_group=collection_group,
+                               conditions=where,
+                               limit=limit,
+                               timestamp_field=timestamp_field,
+                               timestamp_convert=timestamp_convert,
+                               geopoint_convert=geopoint_convert,
+                               convert_fields=convert_fields,
+                               batch_size=batch_size,
+                               max_in_flight=max_in_flight,
+                               only_changed=only_changed,
+                               verbose=verbose,
+                               dry_run=dry_run)
+        return
+    if not file or data:
+        raise click.UsageError("You must provide a file, or a query (--where, --collection-group or --limit) and --data.")
+
+    from firebatch.operations import update_documents_in_firestore
+    with document_validator(validator, rejects, validation_processes, verbose) as validate:
+        update_documents_in_firestore(collection_path=collection, 
+                                      updates=iter_documents(file), 
+                                      timestamp_field=timestamp_field,
+                                      timestamp_convert=timestamp_convert,
+                                      geopoint_convert=geopoint_convert,
+                                      upsert=upsert, 
+                                      convert_fields=convert_fields,
+                                      batch_size=batch_size,
+                                      max_in_flight=max_in_flight,
+                                      checkpoint=open_checkpoint(checkpoint, 'update', collection),
+                                      only_changed=only_changed,
+                                      validate=validate,
+                                      verbose=verbose, 
+                                      dry_run=dry_run)
 
 @cli.command(cls=StdCommand)
 @click.option('--doc-ids', default=None, help='whitespace separated document IDs to delete. If provided, file is ignored.')
-@click.argument('file', type=click.File('r'), required=False)
-def delete(collection: str, doc_ids: Optional[str], file: Optional[click.File], verbose: bool, dry_run: bool):
-    """delete all documents with the document ids of the documents in the file."""
+@click.option('--recursive/--no-recursive', default=True, help='Also delete the subcollections of the documents. Use --no-recursive to skip looking for subcollections when there are none.')
+@click.argument('file', type=InputFile(), required=False)
+@query_options
+@batch_options
+@checkpoint_option
+@engine_option
+def delete(collection: str, doc_ids: Optional[str], file: Optional[click.File], collection_group: bool, where: List[Tuple[str, str, Any]], limit: Optional[int], recursive: bool, batch_size: int, max_in_flight: int, checkpoint: Optional[str], engine: str, concurrency: int, verbose: bool, dry_run: bool):
+    """delete all documents with the document ids of the documents in the file. With --where, --collection-group or --limit the documents matching the query are deleted instead, their ids are streamed from firestore without reading the documents."""
+    from firebatch.operations import delete_documents_in_firestore, delete_query_documents, process_deletion_file
+    if where or collection_group or limit:
+        if doc_ids or file:
+            raise click.UsageError("A query can not be combined with --doc-ids or a file.")
+        if checkpoint:
+            raise click.UsageError("--checkpoint can not be combined with a query, an interrupted delete by query can simply be run again.")
+        if engine == 'asyncio':
+            from firebatch.aio import delete_collection_documents
+            delete_collection_documents(collection, None, collection_group, where, limit, recursive, batch_size, max_in_flight, concurrency, verbose, dry_run)
+            return
+        delete_query_documents(collection, collection_group, where, limit, verbose, dry_run, recursive=recursive, batch_size=batch_size, max_in_flight=max_in_flight)
+        return
+    check_asyncio_engine(engine, checkpoint=checkpoint)
+    if engine == 'asyncio':
+        if not (doc_ids or file):
+            raise click.UsageError("You must provide either document IDs or a file.")
+        from firebatch.aio import delete_collection_documents
+        id_list = doc_ids.split() if doc_ids else process_deletion_file(iter_documents(file))
+        delete_collection_documents(collection, id_list, recursive=recursive, batch_size=batch_size, max_in_flight=max_in_flight,
+                                    concurrency=concurrency, verbose=verbose, dry_run=dry_run)
+        return
+    checkpoint = open_checkpoint(checkpoint, 'delete', collection)
 
     if doc_ids:
         id_list = [doc_id.strip() for doc_id in doc_ids.split(' ') if doc_id.strip()]
-        delete_documents_in_firestore(collection, id_list, verbose, dry_run)
+        delete_documents_in_firestore(collection, id_list, verbose, dry_run, recursive=recursive, batch_size=batch_size, max_in_flight=max_in_flight, checkpoint=checkpoint)
     elif file:
-        documents = read_documents(file)
+        documents = iter_documents(file)
         doc_ids = process_deletion_file(documents)
-        delete_documents_in_firestore(collection, doc_ids, verbose, dry_run)
+        delete_documents_in_firestore(collection, doc_ids, verbose, dry_run, recursive=recursive, batch_size=batch_size, max_in_flight=max_in_flight, checkpoint=checkpoint)
     else:
         raise click.UsageError("You must provide either document IDs or a file.")
 
+@cli.command(cls=StdCommand)
+@click.option('--collection-group', '-cg', is_flag=True, default=False, help='Treat the collection name as a collection group name for a collection group query.')
+@click.option('--where', '-w', multiple=True, callback=validate_queries, help='Query conditions (can specify multiple), formatted as "field operator value".')
+@click.option('--sum', 'sum_fields', multiple=True, help='Also sum this numeric field (can specify multiple).')
+@click.option('--avg', 'avg_fields', multiple=True, help='Also average this numeric field (can specify multiple).')
+@click.option('--limit', type=int, help='Only aggregate the first documents up to this number.')
+def count(collection, collection_group, where, sum_fields, avg_fields, limit, verbose, dry_run):
+    """count the documents matching the query (and sum or average fields) with a firestore aggregation query. It is computed on the server and billed as one read per 1000 index entries instead of one read per document. Prints a json object like {"count": 42, "sum_price": 1234.5}."""
+    from firebatch.operations import aggregate_collection
+    aggregates = aggregate_collection(collection_path=collection,
+                                      collection_group=collection_group,
+                                      conditions=where,
+                                      sum_fields=sum_fields,
+                                      avg_fields=avg_fields,
+                                      limit=limit,
+                                      verbose=verbose)
+    click.echo(json.dumps(aggregates))
+
+class CopyCommand(StdCommand):
+    """A StdCommand whose --collection is the source of the copy, also named --src."""
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.params[3] = click.Option(['--src', '--collection', '-c', 'collection'], required=True, help='Source collection path (e.g., "users/user_id/orders").')
+
+@cli.command(cls=CopyCommand)
+@click.option('--dst', required=True, help='Destination collection path, the documents keep their ids.')
+@click.option('--src-project', default=None, help='Project of the source, the default project by default.')
+@click.option('--dst-project', default=None, help='Project of the destination, the default project by default.')
+@click.option('--src-database', default=None, help='Database of the source, "(default)" by default.')
+@click.option('--dst-database', default=None, help='Database of the destination, "(default)" by default.')
+@click.option('--src-credentials', type=click.Path(exists=True, dir_okay=False), default=None, help='Service account key file for the source, the default credentials by default.')
+@click.option('--dst-credentials', type=click.Path(exists=True, dir_okay=False), default=None, help='Service account key file for the destination, the default credentials by default.')
+@click.option('--where', '-w', multiple=True, callback=validate_queries, help='Only copy the documents matching the query conditions (can specify multiple), formatted as "field operator value".')
+@click.option('--limit', type=click.IntRange(min=1), default=None, help='Only copy the first documents up to this number.')
+@click.option('--page-size', type=click.IntRange(min=1), default=None, help='Read the source in pages of this many documents.')
+@click.option('--parallel', '-p', type=click.IntRange(min=1), default=1, help='Split the source into this many partitions and read them concurrently.')
+@click.option('--recursive', is_flag=True, default=False, help='Also copy the subcollections of the documents.')
+@click.option('--rewrite-references', is_flag=True, default=False, help='Point the document references into the source collection to the same documents of the destination collection. References always move to the destination database.')
+@batch_options
+def copy(collection, dst, src_project, dst_project, src_database, dst_database, src_credentials, dst_credentials, where, limit, page_size, parallel, recursive, rewrite_references, batch_size, max_in_flight, verbose, dry_run):
+    """copy the documents of the source collection (--src) into the destination collection (--dst), also to another project or database. The documents are passed from the (partitioned) read straight into the batch writes, without converting them to json or a local file."""
+    source = (src_project, src_database, src_credentials)
+    destination = (dst_project, dst_database, dst_credentials)
+    if collection.strip('/') == dst.strip('/') and source == destination:
+        raise click.UsageError("The source and the destination are the same collection.")
+    from firebatch.firestore_client import connect_firestore_client
+    from firebatch.operations import copy_collection_documents
+    copy_collection_documents(source_path=collection,
+                              destination_path=dst,
+                              source_db=connect_firestore_client(*source),
+                              destination_db=connect_firestore_client(*destination),
+                              conditions=where,
+                              limit=limit,
+                              parallel=parallel,
+                              page_size=page_size,
+                              recursive=recursive,
+                              rewrite_references=rewrite_references,
+                              batch_size=batch_size,
+                              max_in_flight=max_in_flight,
+                              verbose=verbose,
+                              dry_run=dry_run)
+
+class DatabaseCommand(StdCommand):
+    """A command on the whole database, --collection optionally restricts it to some top level collections."""
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.params[3] = click.Option(['--collection', '-c', 'collections'], multiple=True, help='Only this top level collection and its subcollections (can specify multiple), all collections by default.')
+
+def database_options(command):
+    """Adds the options selecting the project, database and credentials of backup and restore, and the worker pool."""
+    command = click.option('--workers', type=click.IntRange(min=1), default=None, help='Size of the worker pool shared by all collections, 4 per CPU core (at most 32) by default.')(command)
+    command = click.option('--credentials', type=click.Path(exists=True, dir_okay=False), default=None, help='Service account key file, the default credentials by default.')(command)
+    command = click.option('--database', default=None, help='Database, "(default)" by default.')(command)
+    command = click.option('--project', default=None, help='Project, the default project by default.')(command)
+    return command
+
+@cli.command(cls=DatabaseCommand)
+@click.argument('directory', type=click.Path(file_okay=False))
+@click.option('--compression', type=click.Choice(['gzip', 'zstd', 'none']), default='gzip', help='Compression of the collection files. zstd needs the zstandard package.')
+@click.option('--page-size', type=click.IntRange(min=1), default=None, help='Read every collection in pages of this many documents.')
+@database_options
+def backup(directory, collections, compression, page_size, project, database, credentials, workers, verbose, dry_run):
+    """back up the whole database, all collections and their subcollections, into DIRECTORY: one jsonl file per collection and a manifest.json with the document counts and checksums. The collections are discovered and exported concurrently. The manifest is written last, a directory without it is an incomplete backup."""
+    compression = get_compression(compression, None)
+    if os.path.exists(os.path.join(directory, 'manifest.json')):
+        raise click.UsageError(f"'{directory}' already contains a backup.")
+    from firebatch.firestore_client import connect_firestore_client
+    from firebatch.operations import backup_database
+    backup_database(directory,
+                    db=connect_firestore_client(project, database, credentials),
+                    collections=collections,
+                    compression=compression,
+                    page_size=page_size,
+                    workers=workers,
+                    verbose=verbose,
+                    dry_run=dry_run)
+
+@cli.command(cls=DatabaseCommand)
+@click.argument('directory', type=click.Path(file_okay=False))
+@click.option('--verify/--no-verify', default=True, help='Check all files against the checksums of the manifest before anything is written.')
+@database_options
+@batch_options
+def restore(directory, collections, verify, project, database, credentials, workers, batch_size, max_in_flight, verbose, dry_run):
+    """restore a backup DIRECTORY (see backup) into the database, the documents keep their ids and paths. The collections are loaded concurrently with batched writes. A dry run reads and verifies the backup without writing."""
+    from firebatch.firestore_client import connect_firestore_client
+    from firebatch.operations import restore_database
+    try:
+        restore_database(directory,
+                         db=connect_firestore_client(project, database, credentials),
+                         collections=collections,
+                         workers=workers,
+                         verify=verify,
+                         batch_size=batch_size,
+                         max_in_flight=max_in_flight,
+                         verbose=verbose,
+                         dry_run=dry_run)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+@cli.command()
+@click.argument('snapshot', type=InputFile())
+@click.argument('deltas', type=InputFile(), nargs=-1, required=True)
+@click.option('--output', '-o', type=click.Path(dir_okay=False), default=None, help='Write the merged documents to this file instead of printing them, compressed by its extension (.gz, .zst).')
+@compression_option
+def merge(snapshot, deltas, output, compression):
+    """merge the outputs of incremental reads (read --incremental) into the previous full export SNAPSHOT. A document of a delta replaces the one with the same id (or path for collection groups), new documents are added at the end, later DELTAS win. Deleted documents are kept, an incremental read can not see them. Only the deltas are held in memory."""
+    from firebatch.endcoding import write_json_stream
+    from firebatch.incremental import merge_documents
+    compression = get_compression(compression, output)
+    output_file = open_output(output, compression or 'none') if output or compression else sys.stdout
+    try:
+        documents = merge_documents(iter_documents(snapshot), [iter_documents(delta) for delta in deltas])
+        write_json_stream(output_file, documents)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    finally:
+        if output_file is not sys.stdout:
+            output_file.close()
+
 @cli.command()
 def list():
     """Lists all top level Firestore collections."""
+    from firebatch.operations import list_firestore_collections
 
     collections = list_firestore_collections()
     
@@ -174,5 +792,63 @@ def list():
         except Exception as e:
             logging.error(f"An error occurred while retrieving collection names: {e}")
 
+def parse_script(lines: Iterable[str]) -> Iterator[Tuple[int, List[str]]]:
+    """Yields the line number and arguments of every command of a script, skipping empty lines and # comments.
+    A leading 'firebatch' is optional, so lines can be copied from a shell script."""
+    for line_number, line in enumerate(lines, start=1):
+        try:
+            args = shlex.split(line, comments=True)
+        except ValueError as e:
+            raise click.UsageError(f"line {line_number}: {e}")
+        if args and args[0] == 'firebatch':
+            args = args[1:]
+        if args:
+            yield line_number, args
+
+@cli.command()
+@click.argument('script', type=click.File('r'), default='-')
+@click.option('--keep-going', is_flag=True, default=False, help='Continue with the next command after a failed one, and fail at the end.')
+@click.pass_context
+def run(ctx, script, keep_going):
+    """run many commands in one process over the same Firestore connections. SCRIPT (default: stdin) has one command per line, e.g. 'read -c users -o users.jsonl', # starts a comment. The client pool options (--channels, --grpc-option) of firebatch apply to all of them. The commands and options of all lines are checked before the first command runs (input files are opened when their command runs, so a line can read what an earlier line wrote), the first failing command stops the script unless --keep-going is set."""
+    commands = []
+    ctx.meta[CHECK_ONLY] = True
+    try:
+        for line_number, args in parse_script(script):
+            command = cli.get_command(ctx.parent, args[0])
+            if command is None or command is ctx.command:
+                raise click.UsageError(f"line {line_number}: '{args[0]}' is not a command that can be run.")
+            try:
+                with command.make_context(f"firebatch {args[0]}", args[1:], parent=ctx):
+                    pass
+            except click.ClickException as e:
+                raise click.UsageError(f"line {line_number}: '{shlex.join(args)}': {e.format_message()}")
+            except ValueError as e:  # raised by option callbacks like validate_queries
+                raise click.UsageError(f"line {line_number}: '{shlex.join(args)}': {e}")
+            except click.exceptions.Exit:
+                raise click.UsageError(f"line {line_number}: '{shlex.join(args)}' only prints the help.")
+            commands.append((line_number, command, args))
+    finally:
+        ctx.meta.pop(CHECK_ONLY, None)
+
+    failed = 0
+    for index, (line_number, command, args) in enumerate(commands):
+        try:
+            command.main(args[1:], prog_name=f"firebatch {args[0]}", standalone_mode=False)
+            continue
+        except click.ClickException as e:
+            message = e.format_message()
+        except SystemExit as e:
+            # the update path and the credential check exit with a status instead of raising
+            message = f"exited with status {e.code}"
+        except Exception as e:
+            message = str(e) or e.__class__.__name__
+        logging.error(f"line {line_number}: '{shlex.join(args)}' failed: {message}")
+        if not keep_going:
+            raise click.ClickException(f"Stopped at line {line_number}, the remaining {len(commands) - index - 1} commands were not run.")
+        failed += 1
+    if failed:
+        raise click.ClickException(f"{failed} of {len(commands)} commands failed.")
+
 if __name__ == '__main__':
     cli()
@@ -0,0 +1,397 @@
+import json
+from datetime import datetime
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from google.cloud.firestore_v1 import GeoPoint, DocumentReference
+from firebatch.endcoding import convert_to_firestore_types, to_json
+from firebatch.metrics import metrics
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    import pyarrow as pa
+    PYARROW_AVAILABLE = True
+except ImportError:
+    pa = None
+    PYARROW_AVAILABLE = False
+
+COLUMNAR_FORMATS = ('parquet', 'arrow')
+ROW_GROUP_SIZE = 10000
+ID_COLUMNS = ('__doc_id__', '__doc_path__')
+EXTRA_COLUMN = '__extra__'  # json of the fields that do not fit the schema, so no value is lost
+TYPE_METADATA = b'firebatch.type'  # marks the columns holding geopoints, document references and json
+
+# A schema spec is what --schema files contain: a type name, a dict of fields (map) or a one element list (array)
+SchemaSpec = Union[str, Dict[str, Any], List[Any]]
+SCALAR_TYPES = ('string', 'int64', 'float64', 'bool', 'bytes', 'timestamp', 'geopoint', 'reference', 'json')
+
+def ensure_pyarrow():
+    if not PYARROW_AVAILABLE:
+        raise ImportError("The parquet and arrow formats need pyarrow, please install it with 'pip install pyarrow'.")
+
+def detect_format(file_name: Optional[str]) -> Optional[str]:
+    """The columnar format of a file by its extension, None for anything else."""
+    if file_name:
+        if file_name.endswith('.parquet'):
+            return 'parquet'
+        if file_name.endswith(('.arrow', '.feather')):
+            return 'arrow'
+    return None
+
+# --- schema
+
+def _infer(value: Any) -> SchemaSpec:
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, int):
+        return 'int64'
+    if isinstance(value, float):
+        return 'float64'
+    if isinstance(value, str):
+        return 'string'
+    if isinstance(value, bytes):
+        return 'bytes'
+    if isinstance(value, datetime):
+        return 'timestamp'
+    if isinstance(value, GeoPoint):
+        return 'geopoint'
+    if isinstance(value, DocumentReference):
+        return 'reference'
+    if isinstance(value, dict):
+        return {key: _infer(item) for key, item in value.items()} or 'json'
+    if isinstance(value, list):
+        spec = 'null'
+        for item in value:
+            spec = _merge(spec, _infer(item))
+        return [spec]
+    return 'json'
+
+def _merge(a: SchemaSpec, b: SchemaSpec) -> SchemaSpec:
+    if a == b:
+        return a
+    if a == 'null':
+        return b
+    if b == 'null':
+        return a
+    if isinstance(a, str) and isinstance(b, str) and {a, b} == {'int64', 'float64'}:
+        return 'float64'
+    if isinstance(a, dict) and isinstance(b, dict):
+        merged = dict(a)
+        for key, spec in b.items():
+            merged[key] = _merge(merged[key], spec) if key in merged else spec
+        return merged
+    if isinstance(a, list) and isinstance(b, list):
+        return [_merge(a[0], b[0])]
+    return 'json'
+
+def infer_schema_spec(rows: Iterable[dict]) -> Dict[str, SchemaSpec]:
+    """Infers the schema spec of the rows, conflicting types become json columns."""
+    spec: Dict[str, SchemaSpec] = {}
+    for row in rows:
+        spec = _merge(spec, _infer(row)) if spec else _infer(row)
+    return spec if isinstance(spec, dict) else {}
+
+def _finalize(spec: SchemaSpec) -> SchemaSpec:
+    # a field that was only null in the sample may hold anything later
+    if spec == 'null':
+        return 'json'
+    if isinstance(spec, dict):
+        return {key: _finalize(item) for key, item in spec.items()}
+    if isinstance(spec, list):
+        return [_finalize(spec[0])]
+    return spec
+
+def _arrow_field(name: str, spec: SchemaSpec) -> "pa.Field":
+    if isinstance(spec, dict):
+        if not spec:
+            raise ValueError(f"Field '{name}' is an empty map, use 'json' for maps without fixed fields.")
+        return pa.field(name, pa.struct([_arrow_field(key, item) for key, item in spec.items()]))
+    if isinstance(spec, list):
+        if len(spec) != 1:
+            raise ValueError(f"Field '{name}' is an array, its spec must be a list with the type of the items.")
+        return pa.field(name, pa.list_(_arrow_field('item', spec[0])))
+    if spec == 'string':
+        return pa.field(name, pa.string())
+    if spec == 'int64':
+        return pa.field(name, pa.int64())
+    if spec == 'float64':
+        return pa.field(name, pa.float64())
+    if spec == 'bool':
+        return pa.field(name, pa.bool_())
+    if spec == 'bytes':
+        return pa.field(name, pa.binary())
+    if spec == 'timestamp':
+        return pa.field(name, pa.timestamp('us', tz='UTC'))  # firestore keeps microseconds
+    if spec == 'geopoint':
+        return pa.field(name, pa.struct([pa.field('latitude', pa.float64()), pa.field('longitude', pa.float64())]),
+                        metadata={TYPE_METADATA: b'geopoint'})
+    if spec == 'reference':
+        return pa.field(name, pa.string(), metadata={TYPE_METADATA: b'reference'})
+    if spec == 'json':
+        return pa.field(name, pa.string(), metadata={TYPE_METADATA: b'json'})
+    raise ValueError(f"Unknown type '{spec}' of field '{name}', use one of {', '.join(SCALAR_TYPES)}, a map or a list.")
+
+def arrow_schema(spec: Dict[str, SchemaSpec], id_columns: Iterable[str] = ()) -> "pa.Schema":
+    """The arrow schema of the document columns described by spec, after the id columns and before the extra column."""
+    ensure_pyarrow()
+    fields = [pa.field(name, pa.string()) for name in id_columns]
+    fields += [_arrow_field(name, _finalize(item)) for name, item in spec.items() if name not in ID_COLUMNS and name != EXTRA_COLUMN]
+    fields.append(pa.field(EXTRA_COLUMN, pa.string(), metadata={TYPE_METADATA: b'json'}))
+    return pa.schema(fields)
+
+def load_schema_spec(path: str) -> Dict[str, SchemaSpec]:
+    """Reads a --schema file and checks that it maps to an arrow schema."""
+    with open(path) as file:
+        spec = json.load(file)
+    if not isinstance(spec, dict):
+        raise ValueError(f"The schema '{path}' must be a json object mapping field names to types.")
+    arrow_schema(spec)
+    return spec
+
+# --- documents to columns
+
+class _Mismatch(Exception):
+    """The value does not fit the column type, it goes to the extra column instead."""
+
+def _normalizer(field: "pa.Field") -> Callable[[Any], Any]:
+    """Returns the function turning a document value into the python value pyarrow builds the column from."""
+    kind = (field.metadata or {}).get(TYPE_METADATA)
+    arrow_type = field.type
+    if kind == b'json':
+        return lambda value: to_json(value)
+    if kind == b'geopoint':
+        def geopoint(value):
+            if not isinstance(value, GeoPoint):
+                raise _Mismatch
+            return {'latitude': value.latitude, 'longitude': value.longitude}
+        return geopoint
+    if kind == b'reference':
+        def reference(value):
+            if not isinstance(value, DocumentReference):
+                raise _Mismatch
+            return value.path
+        return reference
+    if pa.types.is_struct(arrow_type):
+        children = [(arrow_type.field(i).name, _nullable(_normalizer(arrow_type.field(i)))) for i in range(arrow_type.num_fields)]
+        names = {name for name, _ in children}
+        def struct(value):
+            # a null child is a missing field, so maps with null values are kept as json
+            if not isinstance(value, dict) or not names.issuperset(value) or None in value.values():
+                raise _Mismatch
+            return {name: normalize(value.get(name)) for name, normalize in children}
+        return struct
+    if pa.types.is_list(arrow_type):
+        normalize_item = _nullable(_normalizer(arrow_type.value_field))
+        def array(value):
+            if not isinstance(value, list):
+                raise _Mismatch
+            return [normalize_item(item) for item in value]
+        return array
+    if pa.types.is_timestamp(arrow_type):
+        expected = (datetime,)
+    elif pa.types.is_string(arrow_type):
+        expected = (str,)
+    elif pa.types.is_boolean(arrow_type):
+        expected = (bool,)
+    elif pa.types.is_binary(arrow_type):
+        expected = (bytes,)
+    elif pa.types.is_integer(arrow_type):
+        def integer(value):
+            if isinstance(value, bool) or not isinstance(value, int):
+                raise _Mismatch
+            return value
+        return integer
+    elif pa.types.is_floating(arrow_type):
+        def floating(value):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise _Mismatch
+            return float(value)
+        return floating
+    else:
+        raise ValueError(f"Unsupported column type {arrow_type} of field '{field.name}'.")
+    def scalar(value):
+        if not isinstance(value, expected):
+            raise _Mismatch
+        return value
+    return scalar
+
+def _nullable(normalize: Callable[[Any], Any]) -> Callable[[Any], Any]:
+    def nullable(value):
+        return None if value is None else normalize(value)
+    return nullable
+
+def document_row(document: dict) -> dict:
+    """Flattens an exported document ({'__doc_id__', '__data__'}) into one row, raw documents are rows already."""
+    if '__data__' in document and '__doc_id__' in document:
+        row = {name: document[name] for name in ID_COLUMNS if name in document}
+        row.update(document['__data__'] or {})
+        return row
+    return document
+
+class ColumnarWriter:
+    """
+    Writes documents as parquet or arrow (IPC file) in row groups of row_group_size documents,
+    so memory is bounded by one row group no matter how many documents are written.
+
+    The schema is a spec as in --schema files, without one it is inferred from the first row group. Timestamps, geopoints and document references
+    become timestamp, struct<latitude, longitude> and string columns, the latter two are marked in the field
+    metadata so they are restored on import. Values that do not fit the schema (and fields missing from it)
+    are kept as json in the __extra__ column.
+    """
+    def __init__(self, sink: BinaryIO, format: str, spec: Optional[Dict[str, SchemaSpec]] = None, row_group_size: int = ROW_GROUP_SIZE):
+        ensure_pyarrow()
+        if format not in COLUMNAR_FORMATS:
+            raise ValueError(f"Unknown columnar format: '{format}'.")
+        self.sink = sink
+        self.format = format
+        self.spec = spec
+        self.schema: Optional["pa.Schema"] = None
+        self.row_group_size = row_group_size
+        self.count = 0
+        self._rows: List[dict] = []
+        self._writer = None
+        self._columns: List[Tuple[str, Callable[[Any], Any]]] = []
+
+    def __enter__(self) -> "ColumnarWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, document: dict):
+        self._rows.append(document_row(document))
+        if len(self._rows) >= self.row_group_size:
+            self.flush()
+
+    def _open(self):
+        if self.schema is None:
+            spec = self.spec if self.spec is not None else infer_schema_spec(self._rows)
+            self.schema = arrow_schema(spec, [name for name in ID_COLUMNS if any(name in row for row in self._rows)])
+        self._columns = [(field.name, _nullable(_normalizer(field))) for field in self.schema if field.name != EXTRA_COLUMN]
+        if self.format == 'parquet':
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(self.sink, self.schema)
+        else:
+            import pyarrow.ipc as ipc
+            self._writer = ipc.new_file(self.sink, self.schema)
+
+    def flush(self):
+        if not self._rows:
+            return
+        if self._writer is None:
+            self._open()
+        rows, self._rows = self._rows, []
+        with metrics.timer("encode"):
+            batch = self._record_batch(rows)
+        with metrics.timer("output"):
+            self._writer.write_batch(batch)
+        self.count += len(rows)
+
+    def _record_batch(self, rows: List[dict]) -> "pa.RecordBatch":
+        names = {name for name, _ in self._columns}
+        columns = {name: [] for name, _ in self._columns}
+        extras = []
+        for row in rows:
+            extra = {key: value for key, value in row.items() if key not in names}
+            for name, normalize in self._columns:
+                value = row.get(name)
+                if value is None and name in row:
+                    # a null column means the field is missing, a field that is null is kept as json
+                    extra[name] = None
+                try:
+                    columns[name].append(normalize(value))
+                except _Mismatch:
+                    columns[name].append(None)
+                    extra[name] = value
+            extras.append(to_json(extra) if extra else None)
+        arrays = [pa.array(columns[name], type=self.schema.field(name).type) for name, _ in self._columns]
+        arrays.append(pa.array(extras, type=pa.string()))
+        return pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+
+    def close(self):
+        """Writes the remaining rows and the file footer."""
+        self.flush()
+        if self._writer is None:
+            # an empty export still gets a valid file
+            self._open()
+        self._writer.close()
+        metrics.count("documents_written", self.count)
+
+def write_columnar_stream(sink: BinaryIO, documents: Iterable[dict], format: str,
+                          spec: Optional[Dict[str, SchemaSpec]] = None, row_group_size: int = ROW_GROUP_SIZE) -> int:
+    """Writes the documents as they arrive, returns the number of documents written."""
+    with ColumnarWriter(sink, format, spec, row_group_size) as writer:
+        for document in documents:
+            writer.write(document)
+    return writer.count
+
+# --- columns to documents
+
+def _restorer(db, field: "pa.Field") -> Optional[Callable[[Any], Any]]:
+    """Returns the function turning a column value back into a firestore value, None if it is already one."""
+    kind = (field.metadata or {}).get(TYPE_METADATA)
+    if kind == b'geopoint':
+        return lambda value: GeoPoint(value['latitude'], value['longitude'])
+    if kind == b'reference':
+        return lambda value: db.document(value)
+    if kind == b'json':
+        return lambda value: convert_to_firestore_types(db, json.loads(value), False, False)
+    arrow_type = field.type
+    if pa.types.is_struct(arrow_type):
+        children = {arrow_type.field(i).name: _restorer(db, arrow_type.field(i)) for i in range(arrow_type.num_fields)}
+        def struct(value):
+            # null children are the fields the map does not have
+            return {name: item if children[name] is None else children[name](item) for name, item in value.items() if item is not None}
+        return struct
+    if pa.types.is_list(arrow_type):
+        restore_item = _restorer(db, arrow_type.value_field)
+        if restore_item is None:
+            return None
+        return lambda value: [None if item is None else restore_item(item) for item in value]
+    return None
+
+def iter_columnar_documents(source: BinaryIO, format: str, db, batch_size: int = ROW_GROUP_SIZE) -> Iterator[dict]:
+    """
+    Yields the documents of a parquet or arrow file in the exported form ({'__doc_id__', '__data__'}, or the bare data
+    without an id column), with the values already converted to firestore types. The file is read one record batch
+    at a time and only the columns of geopoints, references and json are converted, all other values come from arrow as they are.
+    """
+    ensure_pyarrow()
+    if format == 'parquet':
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(source)
+        schema = parquet_file.schema_arrow
+        batches = parquet_file.iter_batches(batch_size=batch_size)
+    elif format == 'arrow':
+        import pyarrow.ipc as ipc
+        reader = ipc.open_file(source)
+        schema = reader.schema
+        batches = (reader.get_batch(index) for index in range(reader.num_record_batches))
+    else:
+        raise ValueError(f"Unknown columnar format: '{format}'.")
+
+    restorers = [(field.name, _restorer(db, field)) for field in schema if field.name != EXTRA_COLUMN]
+    restorers = [(name, restore) for name, restore in restorers if restore is not None]
+    has_id = '__doc_id__' in schema.names
+
+    for batch in batches:
+        with metrics.timer("parse"):
+            rows = batch.to_pylist()
+        documents = []
+        with metrics.timer("convert"):
+            for row in rows:
+                extra = row.pop(EXTRA_COLUMN, None)
+                doc_id = row.pop('__doc_id__', None)
+                row.pop('__doc_path__', None)
+                for name, restore in restorers:
+                    value = row.get(name)
+                    if value is not None:
+                        row[name] = restore(value)
+                # null columns are the fields a document does not have
+                data = {key: value for key, value in row.items() if value is not None}
+                if extra:
+                    data.update(convert_to_firestore_types(db, json.loads(extra), False, False))
+                documents.append({"__doc_id__": doc_id, "__data__": data} if has_id else data)
+        metrics.count("documents_parsed", len(documents))
+        yield from documents
@@ -0,0 +1,104 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from firebatch.batching import BatchCommitter
+from firebatch.deletion import _list_documents, _with_subcollections, bounded_map
+from firebatch.metrics import metrics
+import logging
+logger = logging.getLogger(__name__)
+
+def reference_rewriter(destination_db, source_path: Optional[str] = None, destination_path: Optional[str] = None) -> Callable[[Any], Any]:
+    """Returns the function that moves the document references of a copied document to the destination database,
+    with their paths unchanged. With source_path and destination_path, references into the source collection point
+    to the same document of the destination collection instead."""
+    from google.cloud.firestore_v1 import DocumentReference
+    prefix = source_path.strip('/') + '/' if source_path and destination_path else None
+
+    def rewrite(value: Any) -> Any:
+        if isinstance(value, DocumentReference):
+            path = value.path
+            if prefix and path.startswith(prefix):
+                path = f"{destination_path.strip('/')}/{path[len(prefix):]}"
+            return destination_db.document(path)
+        if isinstance(value, dict):
+            return {key: rewrite(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [rewrite(item) for item in value]
+        return value
+    return rewrite
+
+def _stream_collection(collection_ref) -> Iterator[Any]:
+    """Opens the stream of the documents of the collection. The first document is fetched before returning, so
+    several collections open their streams concurrently, the others arrive while the stream is iterated."""
+    metrics.count("rpcs", method="run_query")
+    snapshots = metrics.timed(collection_ref.stream(), "fetch", "documents_read")
+    first = next(snapshots, None)
+    return chain((first,), snapshots) if first is not None else iter(())
+
+def copy_documents_recursive(snapshots: Iterable[Any],
+                             destination_ref,
+                             committer: BatchCommitter,
+                             transform: Optional[Callable[[Any], Any]] = None,
+                             recursive: bool = False,
+                             workers: int = 8,
+                             source_ref=None) -> Dict[int, int]:
+    """
+    Writes the data of the document snapshots as they arrive into documents with the same ids in the destination
+    collection, through the committer. The data is passed on as the client decoded it, transform (e.g. a
+    reference_rewriter) is applied to it first.
+
+    With recursive the subcollections are copied breadth first, like delete_documents_recursive walks them:
+    the subcollections of the documents of one level are listed concurrently, then their documents are streamed,
+    a few collections at a time, and written as they arrive while the documents of the next level are listed.
+    The walk follows list_documents, so the subcollections of documents that only exist because they have
+    subcollections are copied too, the documents themselves have no data and are not. On level 0 that needs
+    source_ref, the collection of the snapshots, given when the snapshots are the whole collection.
+
+    Returns:
+        Dict[int, int]: The number of copied documents per level, level 0 are the given snapshots.
+    """
+    copied_per_level = {}
+
+    def write(snapshots: Iterable[Any], collection_ref, level: int) -> Iterator[Tuple[Any, Any]]:
+        copied_per_level.setdefault(level, 0)
+        for snapshot in snapshots:
+            data = snapshot.to_dict() or {}
+            doc_ref = collection_ref.document(snapshot.id)
+            committer.set(doc_ref, transform(data) if transform else data)
+            copied_per_level[level] += 1
+            yield snapshot.reference, doc_ref
+
+    def list_subcollections(refs: Tuple[Any, Any]) -> Tuple[Any, List[Any]]:
+        source_ref, doc_ref = refs
+        return doc_ref, _with_subcollections(source_ref)[1]
+
+    def open_collection(collections: Tuple[Any, Any]) -> Tuple[Iterator[Any], Any]:
+        source_collection, collection_ref = collections
+        return _stream_collection(source_collection), collection_ref
+
+    level = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="firebatch-copy") as executor:
+        written = write(snapshots, destination_ref, level)
+        if not recursive or source_ref is not None:
+            for _ in written:
+                pass
+        if not recursive:
+            return copied_per_level
+        # the subcollections of the written documents are listed while the level is written
+        parents = written if source_ref is None else ((ref, destination_ref.document(ref.id)) for ref in _list_documents(source_ref))
+        while True:
+            subcollections = []
+            for doc_ref, collections in bounded_map(executor, list_subcollections, parents, window=workers * 4):
+                subcollections.extend((collection, doc_ref.collection(collection.id)) for collection in collections)
+            logger.debug(f"copied {copied_per_level[level]} documents on level {level}, {len(subcollections)} subcollections below")
+            if not subcollections:
+                return copied_per_level
+
+            level += 1
+            listings = [executor.submit(_list_documents, source_collection) for source_collection, _ in subcollections]
+            for snapshots, collection_ref in bounded_map(executor, open_collection, subcollections, window=workers):
+                for _ in write(snapshots, collection_ref, level):
+                    pass
+            parents = ((ref, collection_ref.document(ref.id))
+                       for listing, (_, collection_ref) in zip(listings, subcollections) for ref in listing.result())
@@ -0,0 +1,90 @@
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+from tqdm import tqdm
+
+from firebatch.batching import BatchCommitter
+from firebatch.metrics import metrics
+import logging
+logger = logging.getLogger(__name__)
+
+LIST_PAGE_SIZE = 1000
+
+def bounded_map(executor: Executor, fn: Callable, items: Iterable, window: int) -> Iterator:
+    """Like executor.map, but keeps at most window calls pending instead of consuming the whole input at once."""
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def _with_subcollections(doc_ref) -> Tuple[Any, List[Any]]:
+    metrics.count("rpcs", method="list_collection_ids")
+    with metrics.timer("rpc", method="list_collection_ids"):
+        return doc_ref, list(doc_ref.collections())
+
+def _list_documents(collection_ref) -> List[Any]:
+    # list_documents also returns missing documents, which only exist because they have subcollections
+    with metrics.timer("rpc", method="list_documents"):
+        documents = list(collection_ref.list_documents(page_size=LIST_PAGE_SIZE))
+    metrics.count("rpcs", len(documents) // LIST_PAGE_SIZE + 1, method="list_documents")
+    return documents
+
+def delete_documents_recursive(doc_refs: Iterable[Any],
+                               committer: BatchCommitter,
+                               recursive: bool = True,
+                               workers: int = 8,
+                               skip: int = 0,
+                               verbose: bool = False) -> Dict[int, int]:
+    """
+    Deletes the documents and, if recursive, all documents in their subcollections.
+
+    The tree is walked breadth first: the subcollections of one level are listed concurrently while the
+    documents of that level are deleted through the committer, then the documents of all those subcollections
+    form the next level. Without recursive the collections() probe is skipped entirely.
+
+    The first skip documents were deleted by an interrupted run, they are only searched for remaining subcollections.
+    The committer is marked with the number of given documents handled so far.
+
+    Returns:
+        Dict[int, int]: The number of deleted documents per level, level 0 are the given documents.
+    """
+    deleted_per_level = {}
+    level = 0
+    documents: Iterable[Any] = doc_refs
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="firebatch-list") as executor:
+        while True:
+            subcollections = []
+            if recursive:
+                documents_with_children = bounded_map(executor, _with_subcollections, documents, workers * 4)
+            else:
+                documents_with_children = ((doc_ref, []) for doc_ref in documents)
+
+            deleted = 0
+            with tqdm(desc=f"Deleting documents (level {level})", disable=not verbose) as pbar:
+                for index, (doc_ref, children) in enumerate(documents_with_children, 1):
+                    subcollections.extend(children)
+                    if level == 0 and index <= skip:
+                        continue
+                    committer.delete(doc_ref)
+                    if level == 0:
+                        committer.mark(index)
+                    deleted += 1
+                    pbar.update(1)
+            deleted_per_level[level] = deleted
+            logger.debug(f"level {level}: deleting {deleted} documents, found {len(subcollections)} subcollections")
+
+            if not subcollections:
+                break
+            documents = (doc_ref for children in bounded_map(executor, _list_documents, subcollections, workers * 4)
+                         for doc_ref in children)
+            level += 1
+
+    return deleted_per_level
+
+def delete_collection_recursive(collection_ref, committer: BatchCommitter, recursive: bool = True, workers: int = 8, verbose: bool = False) -> Dict[int, int]:
+    """Delete all documents within a collection, including documents in subcollections."""
+    return delete_documents_recursive(collection_ref.list_documents(page_size=LIST_PAGE_SIZE), committer, recursive=recursive, workers=workers, verbose=verbose)
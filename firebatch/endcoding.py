@@ -1,13 +1,27 @@
 
 import json
+import math
 import re
+from typing import Any, Callable, Dict, Iterable, Optional, TextIO
 from google.api_core.datetime_helpers import DatetimeWithNanoseconds
 from google.cloud.firestore_v1 import GeoPoint, DocumentReference
+from google.cloud.firestore_v1 import ArrayRemove, ArrayUnion, DELETE_FIELD, Increment, SERVER_TIMESTAMP
 from datetime import datetime
+from firebatch.metrics import metrics
 import logging
 logger = logging.getLogger(__name__)
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    orjson = None
+    ORJSON_AVAILABLE = False
+
 ISO8601_REGEX = r'^(-?(?:[1-9][0-9]*)?[0-9]{4})-(1[0-2]|0[1-9])-(3[01]|0[1-9]|[12][0-9])T(2[0-3]|[01][0-9]):([0-5][0-9]):([0-5][0-9])(\.\d+)?(Z|[+-](?:2[0-3]|[01][0-9]):[0-5][0-9])?$'
+_ISO8601_PATTERN = re.compile(ISO8601_REGEX)
+_FRACTION_PATTERN = re.compile(r'\.(\d+)')
+_TIMESTAMP_FIRST_CHARS = frozenset('-0123456789')
 
 class FirestoreEncoder(json.JSONEncoder):
     def __init__(self, *args, timestamp_convert=False, geopoint_convert=False, **kwargs):
@@ -53,21 +67,217 @@ def to_json(documents: list, indent=None, timestamp_convert=False, geopoint_conv
     return json.dumps(documents, cls=encoder_callable, indent=indent)
 
 
-def convert_to_firestore_types(db, data, timestamp_convert, geopoint_convert):
-    """Recursively convert known structures from JSON data to Firestore data types."""
-    if isinstance(data, dict):
-        if geopoint_convert and 'latitude' in data and 'longitude' in data and len(data) == 2:
+def document_encoder(indent=None, timestamp_convert=False, geopoint_convert=False) -> Callable[[Any], str]:
+    """
+    Returns a function encoding a single document like to_json. It uses orjson when it is installed
+    (compact separators and unescaped unicode), falling back to the json module for anything orjson rejects.
+    """
+    encoder = FirestoreEncoder(timestamp_convert=timestamp_convert, geopoint_convert=geopoint_convert, indent=indent)
+    if not ORJSON_AVAILABLE or indent not in (None, 2):
+        return encoder.encode
+
+    # datetimes are passed through so DatetimeWithNanoseconds is encoded by the FirestoreEncoder rules
+    option = orjson.OPT_PASSTHROUGH_DATETIME | (orjson.OPT_INDENT_2 if indent else 0)
+    def encode(document) -> str:
+        try:
+            encoded = orjson.dumps(document, default=encoder.default, option=option)
+        except orjson.JSONEncodeError:
+            return encoder.encode(document)  # e.g. integers with more than 64 bit
+        if b'null' in encoded and _has_non_finite(document):
+            return encoder.encode(document)  # orjson writes NaN and Infinity as null, json keeps them
+        return encoded.decode()
+    return encode
+
+
+def _has_non_finite(value) -> bool:
+    if isinstance(value, float):
+        return not math.isfinite(value)
+    if isinstance(value, dict):
+        return any(_has_non_finite(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return any(_has_non_finite(item) for item in value)
+    return False
+
+
+def write_json_stream(output: TextIO, documents: Iterable, output_format='jsonl', timestamp_convert=False, geopoint_convert=False) -> int:
+    """
+    Encodes the documents one at a time and writes them to the output as they arrive,
+    so memory stays constant and the first document is written before the last one is fetched.
+
+    The 'json' format writes an array indented like to_json(list(documents), indent=2), the 'jsonl' format
+    writes one document per line. The values are the same as with to_json, the text can differ: with orjson
+    unicode is not escaped and the separators of jsonl lines are compact (see document_encoder).
+
+    Returns:
+        int: The number of documents written.
+    """
+    if output_format not in ('json', 'jsonl'):
+        raise ValueError(f"Unknown output format: '{output_format}'.")
+    encode = metrics.wrap(document_encoder(2 if output_format == 'json' else None, timestamp_convert, geopoint_convert), "encode")
+    write = metrics.wrap(output.write, "output", counter="bytes_written")
+    count = 0
+    if output_format == 'json':
+        for document in documents:
+            write('[\n  ' if count == 0 else ',\n  ')
+            # nested lines are indented one level deeper because they live inside the array
+            write(encode(document).replace('\n', '\n  '))
+            count += 1
+        write('\n]' if count else '[]')
+    else:
+        for document in documents:
+            write(encode(document))
+            write('\n')
+            count += 1
+    metrics.count("documents_written", count)
+    return count
+
+
+def is_iso_timestamp(value: str) -> bool:
+    """Checks for an ISO 8601 timestamp, cheap length and first character checks reject most strings before the regex."""
+    return 19 <= len(value) <= 40 and value[0] in _TIMESTAMP_FIRST_CHARS and _ISO8601_PATTERN.match(value) is not None
+
+
+def parse_timestamp(value: str) -> datetime:
+    """datetime.fromisoformat that accepts the 'Z' suffix and any number of fractional digits on every python version."""
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    fraction = _FRACTION_PATTERN.search(value)
+    if fraction and len(fraction.group(1)) != 6:
+        digits = fraction.group(1)[:6].ljust(6, '0')  # firestore keeps microseconds
+        value = f"{value[:fraction.start(1)]}{digits}{value[fraction.end(1):]}"
+    return datetime.fromisoformat(value)
+
+
+def field_path_tree(field_paths: Iterable[str]) -> Dict[str, Any]:
+    """
+    Turns dotted field paths into a nested dict, e.g. ['created', 'address.location'] into
+    {'created': None, 'address': {'location': None}}. None marks a field that is converted as a whole.
+    """
+    tree = {}
+    for field_path in field_paths:
+        parts = field_path.split('.')
+        node = tree
+        for part in parts[:-1]:
+            child = node.get(part, {})
+            if child is None:
+                break  # a parent field is already converted as a whole
+            node[part] = child
+            node = child
+        else:
+            node[parts[-1]] = None
+    return tree
+
+
+def expand_field_paths(data: dict) -> dict:
+    """
+    Turns the dotted field path keys of an update into nested maps, e.g. {'address.city': 'Berlin'} into
+    {'address': {'city': 'Berlin'}}, so a set with merge writes the same fields as the update would.
+    Backticks quote field names containing dots, like in the field paths of firestore.
+    """
+    from google.cloud.firestore_v1.field_path import FieldPath
+    expanded = {}
+    for key, value in data.items():
+        parts = FieldPath.from_string(key).parts if '.' in key or '`' in key else (key,)
+        node = expanded
+        for part in parts[:-1]:
+            child = node.get(part, {})
+            if not isinstance(child, dict):
+                raise ValueError(f"Field path '{key}' conflicts with the value of '{part}'.")
+            node[part] = dict(child)
+            node = node[part]
+        if parts[-1] in node and not (isinstance(value, dict) and isinstance(node[parts[-1]], dict)):
+            raise ValueError(f"Field path '{key}' is given twice.")
+        node[parts[-1]] = {**node[parts[-1]], **value} if parts[-1] in node else value
+    return expanded
+
+
+# maps of a single key that turn into server side transforms in updates
+TRANSFORM_MARKERS = frozenset(('__increment__', '__array_union__', '__array_remove__', '__server_timestamp__', '__delete_field__'))
+
+def _convert(db, data, timestamp_convert, geopoint_convert, transforms=False):
+    # ordered by how common the types are in documents
+    if isinstance(data, str):
+        if timestamp_convert and is_iso_timestamp(data): # auto convert isotimestamps to firestore Timestamp
+            return parse_timestamp(data)
+        return data
+    elif isinstance(data, dict):
+        size = len(data)
+        if size == 1:
+            if '__geopoint__' in data:
+                geodata = data['__geopoint__']
+                return GeoPoint(geodata['latitude'], geodata['longitude'])
+            elif '__timestamp__' in data:
+                return parse_timestamp(data['__timestamp__'])
+            elif '__doc_ref__' in data:
+                return db.document(data['__doc_ref__'])
+            elif transforms and next(iter(data)) in TRANSFORM_MARKERS:
+                return _convert_transform(db, data, timestamp_convert, geopoint_convert)
+        elif size == 2 and geopoint_convert and 'latitude' in data and 'longitude' in data:
             return GeoPoint(data['latitude'], data['longitude'])
-        elif '__geopoint__' in data and len(data) == 1:
-            geodata = data['__geopoint__']
-            return GeoPoint(geodata['latitude'], geodata['longitude'])
-        elif '__timestamp__' in data and len(data) == 1:
-            return datetime.fromisoformat(data['__timestamp__'])
-        elif '__doc_ref__' in data and len(data) == 1:
-            return db.document(data['__doc_ref__'])
-        return {key: convert_to_firestore_types(db, value, timestamp_convert, geopoint_convert) for key, value in data.items()}
-    elif timestamp_convert and isinstance(data, str) and re.match(ISO8601_REGEX, data): # auto convert isotimestamps to firestore Timestamp
-        return datetime.fromisoformat(data)
+        return {key: _convert(db, value, timestamp_convert, geopoint_convert, transforms) for key, value in data.items()}
     elif isinstance(data, list):
-        return [convert_to_firestore_types(db, item, timestamp_convert, geopoint_convert) for item in data]
-    return data
\ No newline at end of file
+        return [_convert(db, item, timestamp_convert, geopoint_convert, transforms) for item in data]
+    return data
+
+
+def _convert_transform(db, data: dict, timestamp_convert, geopoint_convert):
+    """The server side transform of a marker map, firestore applies it to the stored value without a read."""
+    if '__increment__' in data:
+        return Increment(data['__increment__'])
+    elif '__array_union__' in data:
+        return ArrayUnion(_convert_transform_values(db, data, '__array_union__', timestamp_convert, geopoint_convert))
+    elif '__array_remove__' in data:
+        return ArrayRemove(_convert_transform_values(db, data, '__array_remove__', timestamp_convert, geopoint_convert))
+    elif '__server_timestamp__' in data:
+        return SERVER_TIMESTAMP
+    return DELETE_FIELD
+
+
+def _convert_transform_values(db, data: dict, marker: str, timestamp_convert, geopoint_convert) -> list:
+    values = data[marker]
+    if not isinstance(values, list):
+        raise ValueError(f"{marker} takes a list of values, not {values!r}.")
+    return _convert(db, values, timestamp_convert, geopoint_convert)
+
+
+def _convert_transforms_only(db, data):
+    """Converts the transform markers of a value outside the field paths to convert, nothing else."""
+    if not isinstance(data, dict):
+        return data
+    if len(data) == 1 and next(iter(data)) in TRANSFORM_MARKERS:
+        return _convert_transform(db, data, False, False)
+    return {key: _convert_transforms_only(db, value) for key, value in data.items()}
+
+
+def _convert_field_paths(db, data, tree: Dict[str, Any], timestamp_convert, geopoint_convert, transforms=False):
+    if isinstance(data, list):
+        return [_convert_field_paths(db, item, tree, timestamp_convert, geopoint_convert, transforms) for item in data]
+    if not isinstance(data, dict):
+        return data
+    if transforms:
+        converted = {key: value if key in tree else _convert_transforms_only(db, value) for key, value in data.items()}
+    else:
+        converted = dict(data)
+    for key, subtree in tree.items():
+        if key in converted:
+            value = converted[key]
+            if subtree is None:
+                converted[key] = _convert(db, value, timestamp_convert, geopoint_convert, transforms)
+            else:
+                converted[key] = _convert_field_paths(db, value, subtree, timestamp_convert, geopoint_convert, transforms)
+    return converted
+
+
+def convert_to_firestore_types(db, data, timestamp_convert, geopoint_convert, field_paths: Optional[Dict[str, Any]] = None,
+                               transforms: bool = False):
+    """
+    Recursively convert known structures from JSON data to Firestore data types.
+
+    If a field_path_tree is given, only the values at those field paths are visited and converted,
+    all other values are passed through unchanged. With transforms (updates only) the marker maps such as
+    {'__increment__': 1} anywhere in the data become server side transforms, otherwise they stay literal maps.
+    """
+    with metrics.timer("convert"):
+        if field_paths is not None:
+            return _convert_field_paths(db, data, field_paths, timestamp_convert, geopoint_convert, transforms)
+        return _convert(db, data, timestamp_convert, geopoint_convert, transforms)
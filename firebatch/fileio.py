@@ -0,0 +1,175 @@
+import glob
+import gzip
+import io
+import os
+import re
+import sys
+from typing import BinaryIO, Callable, Iterable, Iterator, List, Optional, TextIO
+import logging
+logger = logging.getLogger(__name__)
+
+COMPRESSIONS = ('gzip', 'zstd')
+EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+GZIP_LEVEL = 6  # the default of 9 is several times slower for a few percent smaller files
+ZSTD_LEVEL = 3
+_GLOB_CHARACTERS = re.compile(r'[*?[]')
+_END = object()
+
+def ensure_zstandard():
+    """Imports zstandard on first use, the CLI imports this module on every start."""
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("The zstd compression needs zstandard, please install it with 'pip install zstandard'.")
+    return zstandard
+
+def detect_compression(file_name: Optional[str]) -> Optional[str]:
+    """The compression of a file by its extension (.gz, .zst), None for anything else."""
+    if file_name:
+        if file_name.endswith(('.gz', '.gzip')):
+            return 'gzip'
+        if file_name.endswith(('.zst', '.zstd')):
+            return 'zstd'
+    return None
+
+def resolve_compression(compression: Optional[str], file_name: Optional[str]) -> Optional[str]:
+    """'auto' (or None) selects the compression by the extension of the file, 'none' disables it."""
+    if compression in (None, 'auto'):
+        return detect_compression(file_name)
+    if compression == 'none':
+        return None
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression: '{compression}'.")
+    if compression == 'zstd':
+        ensure_zstandard()
+    return compression
+
+def _compressing_writer(sink: BinaryIO, compression: Optional[str]) -> BinaryIO:
+    if compression == 'gzip':
+        # every file opened for appending gets a new gzip member, concatenated members are a valid gzip file
+        return gzip.GzipFile(fileobj=sink, mode='wb', compresslevel=GZIP_LEVEL)
+    if compression == 'zstd':
+        return ensure_zstandard().ZstdCompressor(level=ZSTD_LEVEL).stream_writer(sink, closefd=False)
+    return sink
+
+def _decompressing_reader(source: BinaryIO, compression: Optional[str]) -> BinaryIO:
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=source, mode='rb')
+    if compression == 'zstd':
+        # appended (resumed) files consist of several frames
+        return io.BufferedReader(ensure_zstandard().ZstdDecompressor().stream_reader(source, read_across_frames=True, closefd=False))
+    return source
+
+class CompressedFile(io.TextIOWrapper):
+    """
+    A text file read or written through an optional compression. The binary stream (for parquet and arrow)
+    is its buffer. Closing it finishes the compression and closes the underlying file unless it is stdin or stdout.
+    """
+    def __init__(self, raw: BinaryIO, stream: BinaryIO, close_raw: bool):
+        super().__init__(stream, encoding='utf-8')
+        self._raw = raw
+        self._close_raw = close_raw
+
+    @property
+    def size(self) -> int:
+        """Number of bytes in the file on disk so far, text and compressed data that is still buffered is not counted yet."""
+        return self._raw.tell()
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            if self._close_raw:
+                self._raw.close()
+
+def open_output(path: Optional[str], compression: Optional[str] = 'auto', append: bool = False) -> CompressedFile:
+    """Opens a file for writing, None or '-' writes to stdout. The compression is resolved by resolve_compression."""
+    compression = resolve_compression(compression, path)
+    if path in (None, '-'):
+        sys.stdout.flush()
+        raw, close_raw = sys.stdout.buffer, False
+        if compression is None:
+            raise ValueError("Write uncompressed output to sys.stdout directly.")
+    else:
+        raw, close_raw = open(path, 'ab' if append else 'wb'), True
+    return CompressedFile(raw, _compressing_writer(raw, compression), close_raw)
+
+def open_input(path: str, compression: Optional[str] = 'auto') -> TextIO:
+    """Opens a file for reading, '-' reads from stdin. The compression is resolved by resolve_compression."""
+    compression = resolve_compression(compression, path)
+    if path == '-':
+        if compression is None:
+            return sys.stdin
+        raw, close_raw = sys.stdin.buffer, False
+    else:
+        raw, close_raw = open(path, 'rb'), True
+    return CompressedFile(raw, _decompressing_reader(raw, compression), close_raw)
+
+def expand_paths(patterns: Iterable[str]) -> List[str]:
+    """Expands glob patterns (quoted, so the shell did not expand them) into the matching files in sorted order.
+    '-' and paths without wildcards are kept as they are."""
+    paths = []
+    for pattern in patterns:
+        if pattern == '-' or not _GLOB_CHARACTERS.search(pattern):
+            paths.append(pattern)
+            continue
+        matches = sorted(path for path in glob.glob(pattern) if os.path.isfile(path))
+        if not matches:
+            raise FileNotFoundError(f"No files match '{pattern}'.")
+        paths.extend(matches)
+    return paths
+
+def parse_size(value: str) -> int:
+    """Parses a number of bytes with an optional unit, e.g. '512', '64k', '100MB' or '1.5G' (powers of 1024)."""
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?\s*', value, re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid size: '{value}', use e.g. 512, 64k, 100MB or 1G.")
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** ' kmgt'.index(unit.lower() or ' '))
+
+def parse_duration(value: str) -> float:
+    """Parses a number of seconds with an optional unit, e.g. '90', '90s', '15m', '2h' or '1d'."""
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*', value, re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid duration: '{value}', use e.g. 90s, 15m, 2h or 1d.")
+    number, unit = match.groups()
+    return float(number) * {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[unit.lower() or 's']
+
+def shard_name(index: int, extension: str, sequence: Optional[int] = None) -> str:
+    """'part-00000.<extension>' for the shard of a partition, 'part-00000-00000.<extension>' when a partition is split into several."""
+    if sequence is None:
+        return f"part-{index:05d}.{extension}"
+    return f"part-{index:05d}-{sequence:05d}.{extension}"
+
+def write_shards(documents: Iterable,
+                 open_shard: Callable[[int], CompressedFile],
+                 write: Callable[[CompressedFile, Iterator], int],
+                 max_documents: Optional[int] = None,
+                 max_bytes: Optional[int] = None,
+                 first_sequence: int = 0) -> int:
+    """
+    Writes the documents with write(shard, documents) into consecutive shards opened by open_shard(sequence).
+    A new shard is started when the current one holds max_documents documents or at least max_bytes bytes
+    on disk, the size is checked between documents. At least one shard is written, even without documents.
+    Returns the number of documents written.
+    """
+    documents = iter(documents)
+    pending = next(documents, _END)
+    sequence = first_sequence
+    count = 0
+    while True:
+        with open_shard(sequence) as shard:
+            def shard_documents():
+                nonlocal pending
+                written = 0
+                while pending is not _END:
+                    if written and ((max_documents and written >= max_documents) or (max_bytes and shard.size >= max_bytes)):
+                        return
+                    yield pending
+                    written += 1
+                    # the next document is only requested after this one was written
+                    pending = next(documents, _END)
+            count += write(shard, shard_documents())
+        sequence += 1
+        if pending is _END:
+            return count
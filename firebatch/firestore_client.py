@@ -1,20 +1,183 @@
-from google.cloud import firestore
+import os
 import sys
+import threading
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
 
-def initialize_firestore_client():
-    """Initializes and returns a Firestore client."""
+if TYPE_CHECKING:
+    from google.cloud.firestore import AsyncClient, Client
+
+def create_firestore_client() -> "Client":
+    """Creates a Firestore client, exits with instructions when there are no credentials."""
+    return pool.get()
+
+def create_async_firestore_client() -> "AsyncClient":
+    """Creates a Firestore AsyncClient for the asyncio engine, exits with instructions when there are no credentials.
+    It reuses the credentials of the pool, but not its channels: an asyncio channel belongs to one event loop."""
+    from google.cloud import firestore
+    try:
+        credentials, project = pool.credentials()
+        return firestore.AsyncClient(project=project, credentials=credentials)
+    except Exception as e:
+        _exit_without_credentials(e)
+
+def _exit_without_credentials(e: Exception):
+    error_message = (
+        f"Failed to initialize Firestore client: {str(e)}\n"
+        "Please ensure you are authenticated. You can do this by running:\n"
+        "'gcloud auth login --no-launch-browser' (if you are not logged in already)\n"
+        "and then:\n"
+        "'gcloud auth application-default login --no-launch-browser',\n"
+        "or by setting the GOOGLE_APPLICATION_CREDENTIALS environment variable.\n"
+        "More info: https://cloud.google.com/docs/authentication/application-default-credentials\n"
+    )
+    sys.stderr.write(error_message)
+    sys.exit(1)
+
+class ClientPool:
+    """
+    The Firestore clients shared by all commands of a process, so the credentials are discovered and the
+    gRPC channels are connected once, e.g. for the many commands of 'firebatch run'. There are size clients,
+    each with its own channel (an HTTP/2 connection multiplexes about 100 concurrent streams), and every
+    get() returns the next one round robin. channel_options are added to (or override) the gRPC channel
+    options of the client library, e.g. {"grpc.keepalive_time_ms": 10000}.
+    """
+    def __init__(self, size: int = 1, channel_options: Optional[Dict[str, Any]] = None):
+        self.size = size
+        self.channel_options = dict(channel_options or {})
+        self._clients: List["Client"] = []
+        self._next = 0
+        self._credentials: Optional[Tuple[Any, Optional[str]]] = None
+        self._lock = threading.Lock()
+
+    def configure(self, size: int = 1, channel_options: Optional[Dict[str, Any]] = None):
+        """Changes the pool size and channel options, clients created with the previous settings are closed."""
+        if not 0 < size:
+            raise ValueError("The pool needs at least one client.")
+        with self._lock:
+            self.size = size
+            self.channel_options = dict(channel_options or {})
+            self._close_clients()
+
+    def credentials(self) -> Tuple[Any, Optional[str]]:
+        """The default credentials and project, discovered on first use. The emulator needs none."""
+        with self._lock:
+            if self._credentials is None:
+                if os.getenv("FIRESTORE_EMULATOR_HOST"):
+                    self._credentials = (None, None)
+                else:
+                    import google.auth
+                    from google.cloud.firestore import Client
+                    self._credentials = google.auth.default(scopes=Client.SCOPE)
+            return self._credentials
+
+    def get(self) -> "Client":
+        """The next client of the pool, created on first use. Exits with instructions when there are no credentials."""
+        try:
+            credentials, project = self.credentials()
+            with self._lock:
+                if len(self._clients) < self.size:
+                    self._clients.append(self._create(credentials, project))
+                    return self._clients[-1]
+                client = self._clients[self._next % len(self._clients)]
+                self._next += 1
+                return client
+        except Exception as e:
+            _exit_without_credentials(e)
+
+    def _create(self, credentials, project) -> "Client":
+        # imported here, the client library takes most of the startup time of the CLI
+        from google.cloud import firestore
+        client = firestore.Client(project=project, credentials=credentials)
+        if self.channel_options and not os.getenv("FIRESTORE_EMULATOR_HOST"):
+            _connect(client, credentials, self.channel_options)
+        return client
+
+    def close(self):
+        """Closes the channels of all clients, the next get() connects again."""
+        with self._lock:
+            self._close_clients()
+
+    def _close_clients(self):
+        for client in self._clients:
+            # Client.close only closes an http session, the grpc channel belongs to the transport
+            transport = getattr(client, "_transport", None)
+            if transport is not None:
+                transport.close()
+        self._clients = []
+        self._next = 0
+
+# the channel options the client library connects with (keepalive, unlimited message sizes), channel_options are added to them
+DEFAULT_CHANNEL_OPTIONS = {"grpc.keepalive_time_ms": 30000, "grpc.max_send_message_length": -1, "grpc.max_receive_message_length": -1}
+
+def _connect(client: "Client", credentials, channel_options: Dict[str, Any]):
+    """Connects the client on a channel with DEFAULT_CHANNEL_OPTIONS updated by channel_options. The channel, the
+    transport and the GAPIC client are built with their public constructors, only handing them to the client uses its
+    _firestore_api_internal attribute. A client version without it fails here instead of silently using its own channel
+    (tests/test_firestore_client.py checks that the installed version uses the channel)."""
+    from google.cloud.firestore_v1.services.firestore import FirestoreClient
+    from google.cloud.firestore_v1.services.firestore.transports.grpc import FirestoreGrpcTransport
+    if getattr(client, "_firestore_api_internal", False) is not None:
+        from google.cloud.firestore import __version__
+        raise RuntimeError(f"--channels and --grpc-option are not supported by google-cloud-firestore {__version__}.")
+    options = {**DEFAULT_CHANNEL_OPTIONS, **channel_options}
+    endpoint = FirestoreClient.DEFAULT_ENDPOINT
+    channel = FirestoreGrpcTransport.create_channel(endpoint, credentials=credentials, options=list(options.items()))
+    transport = FirestoreGrpcTransport(host=endpoint, channel=channel)
+    client._firestore_api_internal = FirestoreClient(transport=transport)
+    client._transport = transport
+
+pool = ClientPool()
+
+class LazyClient:
+    """
+    Stands in for the Firestore client and creates it on first use, so a command that fails early
+    or never reaches Firestore (e.g. a dry run) does not look up credentials.
+    All attributes are forwarded to the real client.
+    """
+    def __init__(self, factory: Callable[[], Any] = create_firestore_client):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self) -> "Client":
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return self._client
+
+    @property
+    def initialized(self) -> bool:
+        return self._client is not None
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.client, name)
+
+def initialize_firestore_client() -> LazyClient:
+    """Returns the next client of the shared pool, which is created (or taken) when it is first used."""
+    return LazyClient()
+
+def connect_firestore_client(project: Optional[str] = None, database: Optional[str] = None, credentials_file: Optional[str] = None) -> LazyClient:
+    """Returns a client of another project, database or service account, e.g. the source or the destination of a copy.
+    Without any of them it is the next client of the shared pool. The client is created when it is first used."""
+    if not (project or database or credentials_file):
+        return initialize_firestore_client()
+    return LazyClient(lambda: _create_client(project, database, credentials_file))
+
+def _create_client(project: Optional[str], database: Optional[str], credentials_file: Optional[str]) -> "Client":
+    from google.cloud import firestore
     try:
-        db = firestore.Client()
-        return db
+        if credentials_file:
+            from google.oauth2 import service_account
+            credentials = service_account.Credentials.from_service_account_file(credentials_file, scopes=firestore.Client.SCOPE)
+            project = project or credentials.project_id
+        else:
+            credentials, default_project = pool.credentials()
+            project = project or default_project
+        client = firestore.Client(project=project, credentials=credentials, database=database)
     except Exception as e:
-        error_message = (
-            f"Failed to initialize Firestore client: {str(e)}\n"
-            "Please ensure you are authenticated. You can do this by running:\n"
-            "'gcloud auth login --no-launch-browser' (if you are not logged in already)\n"
-            "and then:\n"
-            "'gcloud auth application-default login --no-launch-browser',\n"
-            "or by setting the GOOGLE_APPLICATION_CREDENTIALS environment variable.\n"
-            "More info: https://cloud.google.com/docs/authentication/application-default-credentials\n"
-        )
-        sys.stderr.write(error_message)
-        sys.exit(1)
\ No newline at end of file
+        _exit_without_credentials(e)
+    if pool.channel_options and not os.getenv("FIRESTORE_EMULATOR_HOST"):
+        _connect(client, credentials, pool.channel_options)
+    return client
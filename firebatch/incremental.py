@@ -0,0 +1,108 @@
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from firebatch.endcoding import convert_to_firestore_types, to_json
+import logging
+logger = logging.getLogger(__name__)
+
+UPDATE_TIME = '__update_time__'
+
+class Watermark:
+    """
+    The position of an incremental read: the largest value of the watermark field (or, by default, of the
+    update time of the documents) that was exported so far, persisted in a small json file.
+
+    A named field is filtered on the server (field >= watermark), so only the changed documents are read.
+    Firestore can not filter on the update time, there every document is read and only the changed ones are
+    exported. The comparison includes the watermark itself, so a document committed with the same value as the
+    last exported one is not missed; it is exported again and merge keeps one copy.
+    """
+    def __init__(self, path: str, collection: str, field: str = UPDATE_TIME):
+        self.path = path
+        self.collection = collection
+        self.field = field
+        self.value: Any = None
+        self._encoded: Any = None
+        self._observed: Any = None
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as file:
+                state = json.load(file)
+            if state.get("collection") != collection or state.get("field") != field:
+                raise ValueError(f"Watermark '{path}' belongs to the field '{state.get('field')}' of '{state.get('collection')}', not to '{field}' of '{collection}'.")
+            self._encoded = state.get("value")
+            self.value = convert_to_firestore_types(None, self._encoded, False, False)
+            logger.info(f"Reading the documents of '{collection}' changed since {self._encoded}.")
+
+    @property
+    def server_side(self) -> bool:
+        return self.field != UPDATE_TIME
+
+    def conditions(self) -> List[Tuple[str, str, Any]]:
+        """The query conditions selecting the documents changed since the watermark."""
+        if self.server_side and self.value is not None:
+            return [(self.field, '>=', self.value)]
+        return []
+
+    def changed(self, doc) -> bool:
+        """Whether the snapshot changed since the watermark, the largest value seen becomes the next watermark.
+        Called from the partition threads."""
+        if self.server_side:
+            try:
+                value = doc.get(self.field)
+            except KeyError:
+                return True  # only a first, unfiltered read returns documents without the field
+        else:
+            value = doc.update_time
+        if value is None:
+            return True
+        with self._lock:
+            try:
+                if self._observed is None or value > self._observed:
+                    self._observed = value
+            except TypeError:
+                logger.debug(f"'{doc.reference.path}': {self.field} of another type is ignored for the watermark.")
+        if self.server_side or self.value is None:
+            return True
+        return value >= self.value
+
+    def save(self):
+        """Advances the watermark to the largest value seen, after all documents were written."""
+        if self._observed is None:
+            return  # nothing changed, the watermark stays
+        if isinstance(self._observed, datetime):
+            # update times are proto datetimes, which the firestore encoder does not know
+            self._encoded = {"__timestamp__": self._observed.isoformat()}
+        else:
+            self._encoded = json.loads(to_json(self._observed))
+        self.value = self._observed
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w") as file:
+            json.dump({"collection": self.collection, "field": self.field, "value": self._encoded}, file)
+        os.replace(temporary_path, self.path)
+
+def document_key(document: dict) -> str:
+    """Identifies an exported document, by its path for collection groups."""
+    key = document.get("__doc_path__") or document.get("__doc_id__")
+    if key is None:
+        raise ValueError("document does not contain document ids, please export the documents without the '--raw' option.")
+    return key
+
+def merge_documents(snapshot: Iterable[dict], deltas: Iterable[Iterable[dict]]) -> Iterator[dict]:
+    """
+    Merges delta exports into a previous export: a document of a delta replaces the one with the same id
+    (or path) in place, new documents follow at the end. Later deltas win over earlier ones.
+    Only the deltas are held in memory, the snapshot is streamed.
+    """
+    changes: Dict[str, dict] = {}
+    for delta in deltas:
+        for document in delta:
+            key = document_key(document)
+            changes.pop(key, None)  # a document changed again moves to the position of its latest change
+            changes[key] = document
+    for document in snapshot:
+        yield changes.pop(document_key(document), document)
+    yield from changes.values()
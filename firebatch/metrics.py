@@ -0,0 +1,260 @@
+import contextlib
+import json
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, TextIO, Tuple
+import logging
+logger = logging.getLogger(__name__)
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+class _PhaseStats:
+    __slots__ = ("count", "total", "cpu", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.cpu = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float, cpu_seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.cpu += cpu_seconds
+        if seconds > self.max:
+            self.max = seconds
+
+class _Timer:
+    __slots__ = ("metrics", "key", "start", "cpu_start")
+
+    def __init__(self, metrics: "Metrics", key: Key):
+        self.metrics = metrics
+        self.key = key
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.cpu_start = time.thread_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics._record(self.key, time.perf_counter() - self.start, time.thread_time() - self.cpu_start)
+
+def _key(name: str, labels: Dict[str, Any]) -> Key:
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+def _label_text(labels: Tuple[Tuple[str, str], ...]) -> str:
+    return " ".join(value for _, value in labels)
+
+class Metrics:
+    """
+    Timings per phase (parse, convert, encode, output, fetch, build_batch, rpc, backoff) and counters
+    (documents, bytes, rpcs, retries) of a command. Recording is a no-op until enable() is called, so the
+    instrumentation stays in the hot loops.
+
+    Every phase records wall time and the cpu time of its thread. Phases running in different threads
+    overlap, so their wall times can add up to more than the run took; a wall time far above the cpu time
+    of a cpu bound phase (parse, convert, encode) means it was waiting for the GIL.
+
+    Usage:
+        with metrics.timer("rpc", method="commit"):
+            batch.commit()
+        metrics.count("rpcs", method="commit")
+    """
+    def __init__(self):
+        self.enabled = False
+        self.labels: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.phases: Dict[Key, _PhaseStats] = {}
+            self.counters: Dict[Key, int] = {}
+            self.started = time.perf_counter()
+
+    def enable(self, **labels: str):
+        """Starts recording, the labels (e.g. command and collection) are added to the prometheus export."""
+        self.labels = labels
+        self.enabled = True
+        self.reset()
+
+    def disable(self):
+        self.enabled = False
+
+    def timer(self, phase: str, **labels: Any):
+        """Context manager recording the duration of the block."""
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return _Timer(self, _key(phase, labels))
+
+    def record(self, phase: str, seconds: float, cpu_seconds: float = 0.0, **labels: Any):
+        if self.enabled:
+            self._record(_key(phase, labels), seconds, cpu_seconds)
+
+    def _record(self, key: Key, seconds: float, cpu_seconds: float):
+        with self._lock:
+            stats = self.phases.get(key)
+            if stats is None:
+                stats = self.phases[key] = _PhaseStats()
+            stats.add(seconds, cpu_seconds)
+
+    def count(self, name: str, value: int = 1, **labels: Any):
+        if self.enabled and value:
+            key = _key(name, labels)
+            with self._lock:
+                self.counters[key] = self.counters.get(key, 0) + value
+
+    def timed(self, iterable: Iterable, phase: str, counter: Optional[str] = None, **labels: Any) -> Iterator:
+        """Yields the items of the iterable, recording the time spent producing each one as the phase."""
+        if not self.enabled:
+            return iter(iterable)
+        return self._timed(iterable, _key(phase, labels), counter)
+
+    def _timed(self, iterable: Iterable, key: Key, counter: Optional[str]) -> Iterator:
+        iterator = iter(iterable)
+        count = 0
+        try:
+            while True:
+                start, cpu_start = time.perf_counter(), time.thread_time()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                self._record(key, time.perf_counter() - start, time.thread_time() - cpu_start)
+                count += 1
+                yield item
+        finally:
+            if counter:
+                self.count(counter, count)
+
+    def wrap(self, fn: Callable, phase: str, counter: Optional[str] = None, **labels: Any) -> Callable:
+        """Returns fn recording the duration of every call as the phase. With counter, the len() of the
+        first argument is counted, e.g. the characters passed to a write function."""
+        if not self.enabled:
+            return fn
+        key = _key(phase, labels)
+        counter_key = _key(counter, {}) if counter else None
+        def wrapper(*args, **kwargs):
+            start, cpu_start = time.perf_counter(), time.thread_time()
+            result = fn(*args, **kwargs)
+            self._record(key, time.perf_counter() - start, time.thread_time() - cpu_start)
+            if counter_key:
+                with self._lock:
+                    self.counters[counter_key] = self.counters.get(counter_key, 0) + len(args[0])
+            return result
+        return wrapper
+
+    def snapshot(self) -> dict:
+        """The recorded metrics as a json serializable dict."""
+        with self._lock:
+            return {
+                "labels": dict(self.labels),
+                "wall_seconds": round(time.perf_counter() - self.started, 6),
+                "phases": [{"phase": name, **dict(labels), "count": stats.count, "seconds": round(stats.total, 6),
+                            "cpu_seconds": round(stats.cpu, 6), "max_seconds": round(stats.max, 6)} for (name, labels), stats in sorted(self.phases.items())],
+                "counters": [{"name": name, **dict(labels), "value": value} for (name, labels), value in sorted(self.counters.items())],
+            }
+
+    def summary(self) -> str:
+        """A human readable table of the phases, ordered by their total time, and the counters."""
+        with self._lock:
+            wall = time.perf_counter() - self.started
+            lines = [f"Metrics ({wall:.2f}s wall time, phases in different threads overlap):"]
+            for (name, labels), stats in sorted(self.phases.items(), key=lambda item: -item[1].total):
+                label = f"{name} {_label_text(labels)}".strip()
+                lines.append(f"  {label:<28} {stats.total:>9.3f}s {100 * stats.total / wall if wall else 0:>6.1f}%  cpu {stats.cpu:>8.3f}s  "
+                             f"{stats.count:>9} calls  mean {1000 * stats.total / stats.count:>8.3f}ms  max {1000 * stats.max:>8.1f}ms")
+            for (name, labels), value in sorted(self.counters.items()):
+                label = f"{name} {_label_text(labels)}".strip()
+                lines.append(f"  {label:<28} {value:>10}")
+            return "\n".join(lines)
+
+    def to_prometheus(self, prefix: str = "firebatch") -> str:
+        """The metrics in the prometheus text exposition format, e.g. for the node exporter textfile collector."""
+        def labels_text(labels: Tuple[Tuple[str, str], ...]) -> str:
+            pairs = sorted(self.labels.items()) + list(labels)
+            if not pairs:
+                return ""
+            escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+            return "{" + ",".join(f'{label}="{value}"' for (label, _), value in zip(pairs, escaped)) + "}"
+
+        with self._lock:
+            lines = [f"# TYPE {prefix}_wall_seconds gauge",
+                     f"{prefix}_wall_seconds{labels_text(())} {time.perf_counter() - self.started:.6f}",
+                     f"# TYPE {prefix}_phase_seconds summary"]
+            for (name, labels), stats in sorted(self.phases.items()):
+                phase_labels = (("phase", name),) + labels
+                lines.append(f"{prefix}_phase_seconds_sum{labels_text(phase_labels)} {stats.total:.6f}")
+                lines.append(f"{prefix}_phase_seconds_count{labels_text(phase_labels)} {stats.count}")
+            lines.append(f"# TYPE {prefix}_phase_cpu_seconds_total counter")
+            for (name, labels), stats in sorted(self.phases.items()):
+                lines.append(f"{prefix}_phase_cpu_seconds_total{labels_text((('phase', name),) + labels)} {stats.cpu:.6f}")
+            lines.append(f"# TYPE {prefix}_phase_seconds_max gauge")
+            for (name, labels), stats in sorted(self.phases.items()):
+                lines.append(f"{prefix}_phase_seconds_max{labels_text((('phase', name),) + labels)} {stats.max:.6f}")
+            names = sorted({name for name, _ in self.counters})
+            for counter in names:
+                lines.append(f"# TYPE {prefix}_{counter}_total counter")
+                for (name, labels), value in sorted(self.counters.items()):
+                    if name == counter:
+                        lines.append(f"{prefix}_{name}_total{labels_text(labels)} {value}")
+            return "\n".join(lines) + "\n"
+
+    def report(self, format: str, output: TextIO):
+        """Writes the metrics as 'summary', 'json' or 'prometheus' text."""
+        if format == "summary":
+            output.write(self.summary() + "\n")
+        elif format == "json":
+            output.write(json.dumps(self.snapshot(), indent=2) + "\n")
+        elif format == "prometheus":
+            output.write(self.to_prometheus())
+        else:
+            raise ValueError(f"Unknown metrics format: '{format}'.")
+
+metrics = Metrics()
+
+@contextlib.contextmanager
+def profiled(profiler: Optional[str], output_path: Optional[str] = None, top: int = 30):
+    """
+    Profiles the block (the calling thread, which runs the hot loop of every command) with 'cprofile'
+    or 'pyinstrument'. The result goes to output_path (pstats file, or html/text for pyinstrument)
+    or, without a path, as text to stderr.
+    """
+    if not profiler:
+        yield
+        return
+
+    if profiler == "cprofile":
+        import cProfile
+        import pstats
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            if output_path:
+                profile.dump_stats(output_path)
+                logger.info(f"Wrote cProfile stats to '{output_path}', inspect them with 'python -m pstats {output_path}'.")
+            else:
+                pstats.Stats(profile, stream=sys.stderr).sort_stats("cumulative").print_stats(top)
+    elif profiler == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise ImportError("pyinstrument is not installed, install it with 'pip install pyinstrument' or use --profile cprofile.")
+        profile = Profiler()
+        profile.start()
+        try:
+            yield
+        finally:
+            profile.stop()
+            if output_path:
+                with open(output_path, "w") as file:
+                    file.write(profile.output_html() if output_path.endswith(".html") else profile.output_text())
+                logger.info(f"Wrote pyinstrument profile to '{output_path}'.")
+            else:
+                sys.stderr.write(profile.output_text())
+    else:
+        raise ValueError(f"Unknown profiler: '{profiler}', use 'cprofile' or 'pyinstrument'.")
@@ -1,21 +1,414 @@
+import glob
+import io
 import json
+import os
+import re
 import sys
-from typing import Any, Dict, List, Optional, TextIO, Tuple
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from itertools import islice
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple, Union
 from tqdm import tqdm
 
-from firebatch.endcoding import convert_to_firestore_types, to_json
-from firebatch.utils import get_query_reference, read_documents
+from firebatch.endcoding import convert_to_firestore_types, document_encoder, expand_field_paths, field_path_tree, to_json, write_json_stream
+from firebatch.utils import apply_query_options, get_query_reference, iter_documents, prefetch, projection_fields
+from firebatch.batching import MAX_BATCH_SIZE, BatchCommitter
+from firebatch.deletion import delete_documents_recursive
+from firebatch.copying import copy_documents_recursive, reference_rewriter
+from firebatch.backup import backup_collections, collection_path, default_workers, discover_collections, read_manifest, restore_collection, select_collections, verify_collection
+from firebatch.changes import ChangedWritesFilter
+from firebatch.checkpoint import Checkpoint
+from firebatch.incremental import Watermark
+from firebatch.cache import SnapshotCache, cached_documents, snapshot_name
+from firebatch.fileio import EXTENSIONS, open_input, open_output, shard_name, write_shards
+from firebatch.columnar import COLUMNAR_FORMATS, ROW_GROUP_SIZE, detect_format, iter_columnar_documents, write_columnar_stream
+from firebatch.partitions import partition_cursors, partition_group, partition_query, stream_partition, stream_partitions
 from firebatch.firestore_client import initialize_firestore_client
+from firebatch.metrics import metrics
 from google.api_core.exceptions import NotFound
 from google.cloud.firestore import SERVER_TIMESTAMP
+from google.cloud.firestore_v1.document import DocumentSnapshot
 import logging
 logger = logging.getLogger(__name__)
 
+CHECKPOINT_INTERVAL = 1000  # documents between two checkpoint saves of a read
+QUERY_PAGE_SIZE = 1000  # a delete or update by query reads the ids in short pages instead of one long running stream
+
 def print_verbose(message: str, verbose: bool):
     """Prints message if verbose mode is enabled."""
     if verbose:
         logger.info(message)
 
+def document_serializer(raw: bool, collection_group: bool, ids_only: bool = False) -> Callable[[Any], dict]:
+    """Returns the function that turns a document snapshot into the exported document."""
+    if ids_only:
+        if collection_group:
+            def doc_to_document(doc):
+                return {"__doc_id__": doc.id, "__doc_path__": doc.reference.path}
+        else:
+            def doc_to_document(doc):
+                return {"__doc_id__": doc.id}
+    elif raw:
+        def doc_to_document(doc):
+            return doc.to_dict()
+    elif collection_group:
+        def doc_to_document(doc):
+            return {"__doc_id__": doc.id, "__doc_path__": doc.reference.path, "__data__": doc.to_dict()}
+    else:
+        def doc_to_document(doc):
+            return {"__doc_id__": doc.id, "__data__": doc.to_dict()}
+    return doc_to_document
+
+def _cursor_values(doc, fields: List[str]) -> dict:
+    """The values of the ordered and filtered fields of a snapshot, encoded so they can be stored in a checkpoint."""
+    values = {}
+    for field in fields:
+        try:
+            values[field] = doc.get(field)
+        except KeyError:
+            continue
+    return json.loads(to_json(values))
+
+def _resume_query(db, query, position: Optional[dict]):
+    """Continues the query after the document recorded in a checkpoint position."""
+    if not position:
+        return query
+    doc_ref = db.document(position["path"])
+    if position["cursor"] is None:
+        # partitions are ordered by the document name only
+        return query.start_after([doc_ref])
+    # a snapshot cursor lets the client add the implicit orderings of --order-by and inequality filters
+    cursor = convert_to_firestore_types(db, position["cursor"], False, False)
+    return query.start_after(DocumentSnapshot(doc_ref, cursor, exists=True, read_time=None, create_time=None, update_time=None))
+
+def _query_partitions(db, 
+                      collection_path: str, 
+                      collection_group: bool, 
+                      conditions: List[Tuple[str, str, Any]], 
+                      order_by: Optional[str], 
+                      limit: Optional[int], 
+                      parallel: int, 
+                      checkpoint: Optional[Checkpoint],
+                      select: Optional[List[str]] = None) -> List[Any]:
+    """Builds the queries to download, one per partition, continuing after the positions of the checkpoint."""
+    if parallel > 1:
+        if order_by:
+            raise ValueError("--order-by can not be combined with --parallel, use --ordered to get the documents ordered by their path.")
+        group, collection_ref = partition_group(db, collection_path, collection_group)
+        # partition points are not stable, a resumed read has to use the same ones
+        cursors = checkpoint.get("partitions") if checkpoint else None
+        if cursors is None:
+            cursors = partition_cursors(group, parallel)
+            if checkpoint:
+                checkpoint.save(partitions=cursors)
+        queries = [partition_query(db, group, start, end, conditions, select, collection_ref) for start, end in cursors]
+        # partitions that only span other collections with the same name are dropped, the same for the saved cursors
+        queries = [query for query in queries if query is not None]
+        logger.debug(f"split '{collection_path}' into {len(queries)} partitions")
+    else:
+        query_ref = get_query_reference(db, collection_path, collection_group)
+        queries = [apply_query_options(query_ref, conditions, order_by, limit, select)]
+
+    positions = checkpoint.get("positions", {}) if checkpoint else {}
+    return [_resume_query(db, query, positions.get(str(index))) for index, query in enumerate(queries)]
+
+def _stream_tracked_documents(db,
+                              collection_path: str, 
+                              collection_group: bool,
+                              raw : bool = False, 
+                              conditions: List[Tuple[str, str, Any]] = [], 
+                              order_by: Optional[str] = None, 
+                              limit: Optional[int] = None, 
+                              parallel: int = 1,
+                              ordered: bool = False,
+                              checkpoint: Optional[Checkpoint] = None,
+                              select: Optional[List[str]] = None,
+                              ids_only: bool = False,
+                              page_size: Optional[int] = None,
+                              verbose: bool = False,
+                              changed: Optional[Callable[[Any], bool]] = None) -> Iterator[Tuple[int, Tuple[str, Optional[dict], dict]]]:
+    """Yields (partition, (document path, cursor values, document)) for every document of the query.
+    Documents changed returns False for are skipped after they were read."""
+    doc_to_document = document_serializer(raw, collection_group, ids_only)
+    count = checkpoint.get("count", 0) if checkpoint else 0
+    if limit and count >= limit:
+        return
+    queries = _query_partitions(db, collection_path, collection_group, conditions, order_by,
+                                limit - count if limit else None, parallel, checkpoint,
+                                projection_fields(select, ids_only, conditions, order_by))
+
+    cursor_fields = ([order_by] if order_by else []) + [field for field, _, _ in conditions]
+    def track(doc) -> Tuple[str, Optional[dict], dict]:
+        cursor = _cursor_values(doc, cursor_fields) if checkpoint and parallel <= 1 else None
+        if changed is not None and not changed(doc):
+            return doc.reference.path, cursor, None
+        return doc.reference.path, cursor, doc_to_document(doc)
+
+    if parallel > 1:
+        documents = stream_partitions(queries, track, ordered=ordered, indexed=True, page_size=page_size)
+    else:
+        documents = ((0, track(doc)) for doc in stream_partition(queries[0], page_size=page_size, limit=limit - count if limit else None))
+
+    retrieved = 0
+    with closing(documents):
+        for document in tqdm(documents, desc="Downloading documents", disable=not verbose):
+            if document[1][2] is None:
+                continue
+            yield document
+            retrieved += 1
+            if limit and count + retrieved >= limit:
+                break  # partitions can not be limited individually
+
+    print_verbose(f"Retrieved {retrieved} documents from '{collection_path}'.", verbose)
+
+def _checkpointed(documents: Iterator[Tuple[int, Tuple[str, Optional[dict], dict]]], 
+                  checkpoint: Checkpoint, 
+                  output: TextIO) -> Iterator[dict]:
+    """Yields the documents and saves the positions of the written ones every CHECKPOINT_INTERVAL documents."""
+    count = checkpoint.get("count", 0)
+    pending = {}
+    try:
+        for partition, (path, cursor, document) in documents:
+            yield document
+            # the consumer asks for the next document only after this one was written
+            count += 1
+            pending[partition] = (path, cursor)
+            if count % CHECKPOINT_INTERVAL == 0:
+                output.flush()
+                checkpoint.save_positions(pending, count)
+                pending = {}
+    finally:
+        # also record the written documents when the download fails
+        output.flush()
+        checkpoint.save_positions(pending, count)
+
+def stream_collection_documents(collection_path: str, 
+                                collection_group: bool,
+                                raw : bool = False, 
+                                conditions: List[Tuple[str, str, Any]] = [], 
+                                order_by: Optional[str] = None, 
+                                limit: Optional[int] = None, 
+                                parallel: int = 1,
+                                ordered: bool = False,
+                                select: Optional[List[str]] = None,
+                                ids_only: bool = False,
+                                page_size: Optional[int] = None,
+                                verbose: bool = False) -> Iterator[dict]:
+    """Yields the documents of the query one by one as they arrive from firestore.
+    With parallel > 1 the query is split into partitions that are downloaded concurrently.
+    select only fetches the given fields, ids_only only the document ids, page_size reads the query in pages."""
+    db = initialize_firestore_client()
+    for _, (_, _, document) in _stream_tracked_documents(db, collection_path, collection_group, raw, conditions, order_by, limit, parallel, 
+                                                         ordered, select=select, ids_only=ids_only, page_size=page_size, verbose=verbose):
+        yield document
+
+def export_collection_documents(output: TextIO,
+                                collection_path: str, 
+                                collection_group: bool,
+                                output_format: str = 'jsonl', 
+                                timestamp_convert: bool = False, 
+                                geopoint_convert: bool = False,
+                                raw : bool = False, 
+                                conditions: List[Tuple[str, str, Any]] = [], 
+                                order_by: Optional[str] = None, 
+                                limit: Optional[int] = None, 
+                                parallel: int = 1,
+                                ordered: bool = False,
+                                checkpoint: Optional[Checkpoint] = None,
+                                schema: Optional[dict] = None,
+                                row_group_size: int = ROW_GROUP_SIZE,
+                                select: Optional[List[str]] = None,
+                                ids_only: bool = False,
+                                page_size: Optional[int] = None,
+                                verbose: bool = False) -> int:
+    """Streams the documents of the query into the output, encoding each one as soon as it arrives.
+    The parquet and arrow formats are written in row groups of row_group_size documents to the binary buffer of the output.
+    With a checkpoint, an interrupted export continues after the last document that was written.
+    select only fetches the given fields, ids_only only the document ids, page_size reads the query in pages."""
+    if checkpoint and output_format != 'jsonl':
+        raise ValueError("Checkpoints can only be used with the jsonl format.")
+    db = initialize_firestore_client()
+    tracked_documents = _stream_tracked_documents(db, collection_path, collection_group, raw, conditions, order_by, limit, parallel, 
+                                                  ordered, checkpoint, select, ids_only, page_size, verbose)
+    if checkpoint:
+        documents = _checkpointed(tracked_documents, checkpoint, output)
+    else:
+        documents = (document for _, (_, _, document) in tracked_documents)
+    count = write_document_stream(output, documents, output_format, timestamp_convert, geopoint_convert, schema, row_group_size)
+    if checkpoint:
+        checkpoint.complete()
+    return count
+
+def export_changed_documents(output: TextIO,
+                             collection_path: str,
+                             collection_group: bool,
+                             watermark: Watermark,
+                             output_format: str = 'jsonl',
+                             timestamp_convert: bool = False,
+                             geopoint_convert: bool = False,
+                             conditions: List[Tuple[str, str, Any]] = [],
+                             parallel: int = 1,
+                             ordered: bool = False,
+                             schema: Optional[dict] = None,
+                             row_group_size: int = ROW_GROUP_SIZE,
+                             select: Optional[List[str]] = None,
+                             page_size: Optional[int] = None,
+                             verbose: bool = False) -> int:
+    """Exports the documents changed since the watermark (all of them on the first run) and advances the watermark
+    once they are written, so a failed export is repeated by the next run. merge_documents applies the output to the
+    previous export. Deleted documents are not part of the output."""
+    if select and watermark.server_side and watermark.field not in select:
+        select = select + [watermark.field]
+    db = initialize_firestore_client()
+    tracked_documents = _stream_tracked_documents(db, collection_path, collection_group, False, conditions + watermark.conditions(),
+                                                  parallel=parallel, ordered=ordered, select=select, page_size=page_size,
+                                                  verbose=verbose, changed=watermark.changed)
+    documents = (document for _, (_, _, document) in tracked_documents)
+    count = write_document_stream(output, documents, output_format, timestamp_convert, geopoint_convert, schema, row_group_size)
+    output.flush()
+    watermark.save()
+    print_verbose(f"Exported {count} documents of '{collection_path}' changed since the last run.", verbose)
+    return count
+
+def export_cached_documents(output: TextIO,
+                            collection_path: str,
+                            collection_group: bool,
+                            cache: SnapshotCache,
+                            max_staleness: float,
+                            refresh: bool = False,
+                            output_format: str = 'jsonl',
+                            timestamp_convert: bool = False,
+                            geopoint_convert: bool = False,
+                            raw: bool = False,
+                            conditions: List[Tuple[str, str, Any]] = [],
+                            order_by: Optional[str] = None,
+                            limit: Optional[int] = None,
+                            parallel: int = 1,
+                            select: Optional[List[str]] = None,
+                            ids_only: bool = False,
+                            page_size: Optional[int] = None,
+                            verbose: bool = False) -> int:
+    """Answers the query from the cached snapshot of the collection. A missing snapshot, one older than
+    max_staleness seconds or refresh downloads the whole collection into the cache first."""
+    db = initialize_firestore_client()
+    name = snapshot_name(db.project, collection_path, collection_group)
+    age = cache.age(name)
+    if refresh or age is None or age > max_staleness:
+        read_time = time.time()
+        encode = document_encoder()
+        tracked_documents = _stream_tracked_documents(db, collection_path, collection_group, False, parallel=parallel,
+                                                      page_size=page_size, verbose=verbose)
+        documents = ((path, document["__doc_id__"], encode(document["__data__"])) for _, (path, _, document) in tracked_documents)
+        stored = cache.store(name, documents, read_time)
+        print_verbose(f"Cached {stored} documents of '{collection_path}'.", verbose)
+    else:
+        metrics.count("cache_hits")
+        print_verbose(f"Reading '{collection_path}' from the cache, read {age:.0f} seconds ago.", verbose)
+    documents = cached_documents(cache, name, collection_group, raw, conditions, order_by, limit, select, ids_only,
+                                 timestamp_convert, geopoint_convert)
+    count = write_json_stream(output, documents, output_format)
+    print_verbose(f"Exported {count} documents of '{collection_path}'.", verbose)
+    return count
+
+def write_document_stream(output, documents: Iterable[dict], output_format: str, timestamp_convert: bool, geopoint_convert: bool,
+                          schema: Optional[dict] = None, row_group_size: int = ROW_GROUP_SIZE) -> int:
+    """Writes the documents as json text or, for the columnar formats, as parquet or arrow to the binary buffer of the output."""
+    if output_format in COLUMNAR_FORMATS:
+        output.flush()
+        return write_columnar_stream(getattr(output, 'buffer', output), documents, output_format, schema, row_group_size)
+    return write_json_stream(output, documents, output_format, timestamp_convert, geopoint_convert)
+
+def export_collection_shards(output_dir: str,
+                             collection_path: str, 
+                             collection_group: bool,
+                             output_format: str = 'jsonl', 
+                             timestamp_convert: bool = False, 
+                             geopoint_convert: bool = False,
+                             raw : bool = False, 
+                             conditions: List[Tuple[str, str, Any]] = [], 
+                             parallel: int = 1,
+                             checkpoint: Optional[Checkpoint] = None,
+                             schema: Optional[dict] = None,
+                             row_group_size: int = ROW_GROUP_SIZE,
+                             compression: Optional[str] = None,
+                             max_shard_documents: Optional[int] = None,
+                             max_shard_bytes: Optional[int] = None,
+                             select: Optional[List[str]] = None,
+                             ids_only: bool = False,
+                             page_size: Optional[int] = None,
+                             verbose: bool = False) -> List[str]:
+    """Downloads the partitions of the query concurrently and writes each one into its own shard file
+    'part-00000.<format>' in the output directory, compressed with gzip or zstd. With max_shard_documents or
+    max_shard_bytes a partition is split into several shards 'part-00000-00000.<format>' of at most that size.
+    Returns the paths of the shard files in document name order.
+    With a checkpoint, the shards of an interrupted export are continued."""
+    if checkpoint and output_format != 'jsonl':
+        raise ValueError("Checkpoints can only be used with the jsonl format.")
+    if compression and output_format in COLUMNAR_FORMATS:
+        raise ValueError("parquet and arrow files can not be compressed.")
+    db = initialize_firestore_client()
+    doc_to_document = document_serializer(raw, collection_group, ids_only)
+    queries = _query_partitions(db, collection_path, collection_group, conditions, None, None, parallel, checkpoint,
+                                projection_fields(select, ids_only, conditions))
+    positions = checkpoint.get("positions", {}) if checkpoint else {}
+    cursor_fields = [field for field, _, _ in conditions]
+    extension = output_format + (EXTENSIONS[compression] if compression else '')
+    split = bool(max_shard_documents or max_shard_bytes)
+    os.makedirs(output_dir, exist_ok=True)
+
+    with tqdm(desc="Downloading documents", disable=not verbose) as pbar:
+        def export_shard(index: int, query) -> List[str]:
+            resumed = str(index) in positions
+            paths = []
+            output = None
+            def save_position(doc):
+                if output is not None and not output.closed:
+                    output.flush()
+                # a single shard is a plain query which needs the cursor values, partitions are ordered by name only
+                cursor = _cursor_values(doc, cursor_fields) if parallel <= 1 else None
+                checkpoint.save_positions({index: (doc.reference.path, cursor)})
+
+            def documents():
+                last_doc = None
+                count = 0
+                try:
+                    for doc in stream_partition(query, page_size):
+                        yield doc_to_document(doc)
+                        last_doc = doc
+                        count += 1
+                        pbar.update(1)
+                        if checkpoint and count % CHECKPOINT_INTERVAL == 0:
+                            save_position(doc)
+                finally:
+                    if checkpoint and last_doc is not None:
+                        save_position(last_doc)
+
+            def open_shard(sequence: int):
+                nonlocal output
+                path = os.path.join(output_dir, shard_name(index, extension, sequence if split else None))
+                # a resumed partition appends to its shard, or continues with new shards after the existing ones
+                output = open_output(path, compression or 'none', append=resumed and not split)
+                paths.append(path)
+                return output
+
+            first_sequence = 0
+            if split and resumed:
+                first_sequence = len(glob.glob(os.path.join(glob.escape(output_dir), f"part-{index:05d}-*.{extension}")))
+            def write(shard, shard_documents) -> int:
+                return write_document_stream(shard, shard_documents, output_format, timestamp_convert, geopoint_convert, schema, row_group_size)
+            counts.append(write_shards(documents(), open_shard, write, max_shard_documents, max_shard_bytes, first_sequence))
+            return paths
+
+        counts = []
+        with ThreadPoolExecutor(max_workers=len(queries), thread_name_prefix="firebatch-shard") as executor:
+            paths = [path for shard_paths in executor.map(export_shard, range(len(queries)), queries) for path in shard_paths]
+
+    if checkpoint:
+        checkpoint.complete()
+    print_verbose(f"Retrieved {sum(counts)} documents from '{collection_path}' into {len(paths)} shards in '{output_dir}'.", verbose)
+    return paths
+
 def download_collection_documents(collection_path: str, 
                                   collection_group: bool,
                                   output_format: str = 'jsonl', 
@@ -25,39 +418,112 @@ def download_collection_documents(collection_path: str,
                                   conditions: List[Tuple[str, str, Any]] = [], 
                                   order_by: Optional[str] = None, 
                                   limit: Optional[int] = None, 
-                                  verbose: bool = False):
-
-    db = initialize_firestore_client()
-    query_ref = get_query_reference(db, collection_path, collection_group)
-    
-    for field, operator, value in conditions:
-        logger.debug(f"apply conditions: {conditions}")
-        if value.lower() == "null" or value.lower() == "none":
-            value = None
-        query_ref = query_ref.where(field, operator, value)
-
-    if order_by:
-        query_ref = query_ref.order_by(order_by)
-    if limit:
-        query_ref = query_ref.limit(limit)
-
-    if raw:
-        documents = [doc.to_dict() for doc in tqdm(query_ref.stream(), desc="Downloading documents", disable=not verbose)]
-    else:
-        if collection_group:
-            def doc_to_document(doc):
-                return {"__doc_id__": doc.id, "__doc_path__": doc.reference.path, "__data__": doc.to_dict()}
+                                  select: Optional[List[str]] = None,
+                                  ids_only: bool = False,
+                                  page_size: Optional[int] = None,
+                                  verbose: bool = False) -> str:
+    """Downloads the documents of the query and returns them encoded as a single string."""
+    output = io.StringIO()
+    export_collection_documents(output,
+                                collection_path=collection_path,
+                                collection_group=collection_group,
+                                output_format=output_format,
+                                timestamp_convert=timestamp_convert,
+                                geopoint_convert=geopoint_convert,
+                                raw=raw,
+                                conditions=conditions,
+                                order_by=order_by,
+                                limit=limit,
+                                select=select,
+                                ids_only=ids_only,
+                                page_size=page_size,
+                                verbose=verbose)
+    return output.getvalue()
+
+def _resume_position(checkpoint: Optional[Checkpoint], dry_run: bool) -> Tuple[int, Optional[Callable[[int], None]]]:
+    """The number of input documents a previous run already committed and the callback recording the progress."""
+    if checkpoint is None or dry_run:
+        return 0, None
+    skip = checkpoint.get("position", 0)
+    if skip:
+        logger.info(f"Skipping {skip} input documents that were committed by a previous run.")
+    return skip, lambda position: checkpoint.save(position=position)
+
+def _binary_source(file) -> BinaryIO:
+    """The binary stream of a file opened as text, read into memory when it can not seek (stdin), parquet and arrow files need to."""
+    source = getattr(file, 'buffer', file)
+    if not source.seekable():
+        return io.BytesIO(source.read())
+    return source
+
+def document_preparer(db,
+                      collection_ref,
+                      timestamp_field: Optional[str] = None,
+                      timestamp_convert: bool = False,
+                      geopoint_convert: bool = False,
+                      field_paths: Optional[Dict[str, Any]] = None,
+                      converted: bool = False) -> Callable[[dict], Tuple[Any, dict]]:
+    """Returns the function turning an imported document into its document reference and firestore data.
+    converted documents (read from parquet or arrow) hold the firestore types already."""
+    def prepare(data: dict) -> Tuple[Any, dict]:
+        if converted:
+            doc_id = data.get("__doc_id__") if "__data__" in data else None
+            data = data["__data__"] if "__data__" in data else data
+        elif "__doc_id__" in data and "__data__" in data:
+            doc_id = data["__doc_id__"]
+            data = convert_to_firestore_types(db, data["__data__"], timestamp_convert, geopoint_convert, field_paths)
         else:
-            def doc_to_document(doc):
-                return {"__doc_id__": doc.id, "__data__": doc.to_dict()}
-        documents = [doc_to_document(doc) for doc in tqdm(query_ref.stream(), desc="Downloading documents", disable=not verbose)]
-
-    print_verbose(f"Retrieved {len(documents)} documents from '{collection_path}'.", verbose)
-    
-    if output_format == 'json':
-        return to_json(documents, 2, timestamp_convert, geopoint_convert)
-    elif output_format == 'jsonl':
-        return '\n'.join(to_json(doc, None, timestamp_convert, geopoint_convert) for doc in documents)  # One JSON document per line
+            doc_id = None
+            data = convert_to_firestore_types(db, data, timestamp_convert, geopoint_convert, field_paths)
+        if timestamp_field:
+            data[timestamp_field] = SERVER_TIMESTAMP
+        return collection_ref.document(doc_id), data  # Auto-generate document ID if None
+    return prepare
+
+@contextmanager
+def _changed_writes(db, committer: BatchCommitter, only_changed: bool, timestamp_field: Optional[str], verbose: bool):
+    """The committer, or with only_changed a ChangedWritesFilter in front of it that drops the writes not changing the stored documents."""
+    if not only_changed:
+        yield committer
+        return
+    with ChangedWritesFilter(db, committer, max_in_flight=committer.max_in_flight, ignore_fields=[timestamp_field] if timestamp_field else []) as writes:
+        yield writes
+    print_verbose(f"{writes.changed} documents changed, {writes.unchanged} unchanged documents were not written.", verbose)
+
+def _upload_file(db,
+                 collection_ref,
+                 file: TextIO,
+                 committer: Union[BatchCommitter, ChangedWritesFilter],
+                 pbar: tqdm,
+                 format: str = "auto",
+                 timestamp_field: Optional[str] = None,
+                 timestamp_convert: bool = False,
+                 geopoint_convert: bool = False,
+                 field_paths: Optional[Dict[str, Any]] = None,
+                 skip: int = 0,
+                 validate: Optional[Callable[[Iterable[dict]], Iterator[Optional[dict]]]] = None) -> int:
+    """Parses and converts the documents of the file after the first skip ones and adds them to the committer.
+    validate replaces the rejected documents by None, they are skipped. Returns the number of documents added."""
+    columnar_format = format if format in COLUMNAR_FORMATS else detect_format(getattr(file, 'name', None)) if format == 'auto' else None
+    prepare = document_preparer(db, collection_ref, timestamp_field, timestamp_convert, geopoint_convert, field_paths, converted=bool(columnar_format))
+
+    if columnar_format:
+        records = iter_columnar_documents(_binary_source(file), columnar_format, db)
+    else:
+        records = iter_documents(file, format)
+    records = islice(records, skip, None)
+    if validate:
+        records = validate(records)
+    # parsing, validating and converting runs ahead in a background thread while the batches are committed
+    documents = prefetch(None if data is None else prepare(data) for data in records)
+    total_documents = 0
+    for position, prepared in enumerate(documents, skip + 1):
+        if prepared is not None:
+            committer.set(*prepared)
+            total_documents += 1
+        committer.mark(position)
+        pbar.update(1)
+    return total_documents
 
 def write_documents(collection_path: str, 
                     file: TextIO, 
@@ -65,79 +531,257 @@ def write_documents(collection_path: str,
                     timestamp_convert: bool = False, 
                     geopoint_convert: bool = False,
                     format: str="auto",
+                    convert_fields: Optional[List[str]] = None,
+                    batch_size: int = MAX_BATCH_SIZE,
+                    max_in_flight: int = 4,
+                    checkpoint: Optional[Checkpoint] = None,
+                    only_changed: bool = False,
+                    validate: Optional[Callable[[Iterable[dict]], Iterator[Optional[dict]]]] = None,
                     verbose: bool = False, 
                     dry_run: bool = False):
     db = initialize_firestore_client()
     collection_ref = get_query_reference(db, collection_path)
-    batch = db.batch()
-
-    documents = read_documents(file)
-    total_documents = len(documents)
-
-    with tqdm(total=total_documents, desc=f"Uploading documents to {collection_path}", disable=not verbose) as pbar:
-        for data in documents:
-            if "__doc_id__" in data and "__data__" in data:
-                doc_id = data["__doc_id__"]
-                data = convert_to_firestore_types(db, data["__data__"], timestamp_convert, geopoint_convert)
-            else:
-                doc_id = None
-                data = convert_to_firestore_types(db, data, timestamp_convert, geopoint_convert)
-            if timestamp_field:
-                data[timestamp_field] = SERVER_TIMESTAMP
-            doc_ref = collection_ref.document(doc_id)  # Auto-generate document ID if None
-            batch.set(doc_ref, data)
-
-            pbar.update(1)
+    skip, on_progress = _resume_position(checkpoint, dry_run)
+    field_paths = field_path_tree(convert_fields) if convert_fields else None
 
-            # Commit in batches to avoid exceeding Firestore batch size limits
-            if pbar.n % 500 == 0 and not dry_run:
-                batch.commit()
-                batch = db.batch()  # Start a new batch after committing
-
-        if not dry_run and total_documents > 0:
-            batch.commit()  # Commit any remaining documents in the batch
+    with BatchCommitter(db, batch_size=batch_size, max_in_flight=max_in_flight, dry_run=dry_run, on_progress=on_progress) as committer, \
+         tqdm(desc=f"Uploading documents to {collection_path}", disable=not verbose) as pbar:
+        with _changed_writes(db, committer, only_changed, timestamp_field, verbose) as writes:
+            total_documents = _upload_file(db, collection_ref, file, writes, pbar, format, timestamp_field,
+                                           timestamp_convert, geopoint_convert, field_paths, skip, validate)
 
+    if on_progress:
+        checkpoint.complete()
     print_verbose(f"Uploaded {total_documents} documents to '{collection_path}'.", verbose)
+    print_verbose(committer.report(), verbose)
+
+def write_document_files(collection_path: str, 
+                         paths: List[str], 
+                         timestamp_field: str = None, 
+                         timestamp_convert: bool = False, 
+                         geopoint_convert: bool = False,
+                         format: str="auto",
+                         compression: Optional[str] = 'auto',
+                         convert_fields: Optional[List[str]] = None,
+                         parallel: Optional[int] = None,
+                         batch_size: int = MAX_BATCH_SIZE,
+                         max_in_flight: int = 4,
+                         checkpoint: Optional[Checkpoint] = None,
+                         only_changed: bool = False,
+                         validate: Optional[Callable[[Iterable[dict]], Iterator[Optional[dict]]]] = None,
+                         verbose: bool = False, 
+                         dry_run: bool = False):
+    """Uploads several (shard) files concurrently with one worker per file, at most parallel at the same time.
+    Every worker parses its file and commits it with its own BatchCommitter, so up to parallel * max_in_flight
+    batches are in flight. The compression of every file is detected by its extension unless one is given.
+    With a checkpoint, every file continues after its committed documents and completed files are skipped.
+    Every file takes the next client of the pool, so with several pooled channels the uploads are spread over them."""
+    field_paths = field_path_tree(convert_fields) if convert_fields else None
+    resume = checkpoint is not None and not dry_run
+    shards = checkpoint.get("shards", {}) if resume else {}
+
+    with tqdm(desc=f"Uploading documents to {collection_path}", disable=not verbose) as pbar:
+        def upload_file(path: str) -> int:
+            state = shards.get(path, {})
+            if state.get("done"):
+                logger.info(f"Skipping '{path}', it was committed by a previous run.")
+                return 0
+            skip = state.get("position", 0)
+            on_progress = (lambda position: checkpoint.save_shard(path, position)) if resume else None
+            db = initialize_firestore_client()
+            collection_ref = get_query_reference(db, collection_path)
+            with open_input(path, compression) as file, \
+                 BatchCommitter(db, batch_size=batch_size, max_in_flight=max_in_flight, dry_run=dry_run, on_progress=on_progress) as committer, \
+                 _changed_writes(db, committer, only_changed, timestamp_field, verbose) as writes:
+                uploaded = _upload_file(db, collection_ref, file, writes, pbar, format, timestamp_field,
+                                        timestamp_convert, geopoint_convert, field_paths, skip, validate)
+            if resume:
+                checkpoint.save_shard(path, skip + uploaded, done=True)
+            print_verbose(f"'{path}': {committer.report()}", verbose)
+            return uploaded
+
+        with ThreadPoolExecutor(max_workers=min(parallel or len(paths), len(paths)), thread_name_prefix="firebatch-shard") as executor:
+            total_documents = sum(executor.map(upload_file, paths))
+
+    if resume:
+        checkpoint.complete()
+    print_verbose(f"Uploaded {total_documents} documents from {len(paths)} files to '{collection_path}'.", verbose)
+
+def copy_collection_documents(source_path: str,
+                              destination_path: str,
+                              source_db=None,
+                              destination_db=None,
+                              conditions: List[Tuple[str, str, Any]] = [],
+                              limit: Optional[int] = None,
+                              parallel: int = 1,
+                              page_size: Optional[int] = None,
+                              recursive: bool = False,
+                              rewrite_references: bool = False,
+                              batch_size: int = MAX_BATCH_SIZE,
+                              max_in_flight: int = 4,
+                              verbose: bool = False,
+                              dry_run: bool = False) -> Dict[int, int]:
+    """Copies the documents of the query on the source collection into the destination collection, which can be in
+    another project or database (source_db and destination_db, the shared clients by default). The snapshots of the
+    (partitioned) read are written straight into the concurrent batches, without json or an intermediate file.
+    With recursive the subcollections are copied as well. Document references are moved to the destination database,
+    with rewrite_references the ones into the source collection also to the destination collection.
+    Returns the number of copied documents per level."""
+    source_db = source_db or initialize_firestore_client()
+    destination_db = destination_db or initialize_firestore_client()
+    queries = _query_partitions(source_db, source_path, False, conditions, None, limit, parallel, None)
+    if parallel > 1:
+        snapshots = stream_partitions(queries, lambda doc: doc, page_size=page_size)
+    else:
+        snapshots = stream_partition(queries[0], page_size=page_size, limit=limit)
+    if rewrite_references:
+        transform = reference_rewriter(destination_db, source_path, destination_path)
+    elif source_db._database_string != destination_db._database_string:
+        # a client only decodes the references of its own database
+        transform = reference_rewriter(destination_db)
+    else:
+        transform = None
+
+    with closing(snapshots), \
+         BatchCommitter(destination_db, batch_size=batch_size, max_in_flight=max_in_flight, dry_run=dry_run) as committer:
+        # partitions can not be limited individually
+        documents = tqdm(islice(snapshots, limit), desc=f"Copying documents to {destination_path}", disable=not verbose)
+        # the subcollections of documents without data are found by listing the whole source collection
+        source_ref = None if conditions or limit else get_query_reference(source_db, source_path)
+        copied_per_level = copy_documents_recursive(prefetch(documents), get_query_reference(destination_db, destination_path),
+                                                    committer, transform, recursive, source_ref=source_ref)
+
+    for level, copied in copied_per_level.items():
+        print_verbose(f"Copied {copied} documents on level {level} of '{source_path}' to '{destination_path}'.", verbose)
+    print_verbose(committer.report(), verbose)
+    return copied_per_level
+
+def backup_database(directory: str,
+                    db=None,
+                    collections: Optional[List[str]] = None,
+                    compression: Optional[str] = 'gzip',
+                    page_size: Optional[int] = None,
+                    workers: Optional[int] = None,
+                    verbose: bool = False,
+                    dry_run: bool = False) -> Optional[Dict[str, Any]]:
+    """Backs up all collections of the database (or the given top level collections) with all their subcollections
+    into directory, one file per collection and a manifest with the document counts and checksums. The collections
+    are discovered and exported concurrently on one worker pool. A dry run only lists the collections.
+    Returns the manifest."""
+    db = db or initialize_firestore_client()
+    workers = workers or default_workers()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="firebatch-backup") as executor:
+        if dry_run:
+            paths = [collection_path(collection_ref) for collection_ref in discover_collections(db, executor, collections, workers)]
+            print_verbose(f"Dry run: would back up {len(paths)} collections: {', '.join(paths)}.", verbose)
+            return None
+        manifest = backup_collections(db, directory, executor, collections, compression, page_size, workers)
+    print_verbose(f"Backed up {manifest['documents']} documents of {len(manifest['collections'])} collections to '{directory}'.", verbose)
+    return manifest
+
+def restore_database(directory: str,
+                     db=None,
+                     collections: Optional[List[str]] = None,
+                     workers: Optional[int] = None,
+                     verify: bool = True,
+                     batch_size: int = MAX_BATCH_SIZE,
+                     max_in_flight: int = 4,
+                     verbose: bool = False,
+                     dry_run: bool = False) -> Dict[str, int]:
+    """Writes the collections of a backup directory (or the given top level collections and their subcollections)
+    back to the database, concurrently on one worker pool with a BatchCommitter per collection. With verify all
+    files are checked against the checksums of the manifest first, so a damaged backup writes nothing.
+    Returns the number of restored documents per collection path."""
+    manifest = read_manifest(directory)
+    entries = select_collections(manifest, collections)
+    db = db or initialize_firestore_client()
+    workers = workers or default_workers()
+
+    def restore(entry: Dict[str, Any]) -> Tuple[str, int]:
+        with BatchCommitter(db, batch_size=batch_size, max_in_flight=max_in_flight, dry_run=dry_run) as committer:
+            count = restore_collection(db, directory, entry, committer)
+        return entry["path"], count
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="firebatch-restore") as executor:
+        if verify:
+            list(executor.map(lambda entry: verify_collection(directory, entry), entries))
+        with tqdm(total=len(entries), desc=f"Restoring collections from {directory}", disable=not verbose) as pbar:
+            restored = {}
+            for path, count in executor.map(restore, entries):
+                restored[path] = count
+                pbar.update(1)
 
-def delete_collection_recursive(collection_ref, batch_size=10):
-    """Delete all documents within a collection, including documents in subcollections."""
-    while True:
-        # Retrieve a small batch of documents to avoid consuming too much memory
-        docs = collection_ref.limit(batch_size).stream()
-        deleted = 0
-
-        for doc in docs:
-            # Recursively delete subcollections
-            for subcollection in doc.reference.collections():
-                delete_collection_recursive(subcollection, batch_size=batch_size)
-
-            doc.reference.delete()  # Delete the document itself
-            deleted += 1
+    action = "Dry run: would restore" if dry_run else "Restored"
+    print_verbose(f"{action} {sum(restored.values())} documents of {len(restored)} collections from '{directory}'.", verbose)
+    return restored
 
-        if deleted == 0:
-            break  # All documents have been deleted
+def delete_documents_in_firestore(collection_path: str, 
+                                  doc_ids: List[str], 
+                                  verbose: bool = False, 
+                                  dry_run: bool = False,
+                                  recursive: bool = True,
+                                  batch_size: int = MAX_BATCH_SIZE,
+                                  max_in_flight: int = 4,
+                                  checkpoint: Optional[Checkpoint] = None):
+    if dry_run:
+        # nothing is deleted, so the client is never created and no subcollections are listed
+        print_verbose(f"Dry run: would delete {len(doc_ids)} documents of '{collection_path}'.", verbose)
+        return
 
-def delete_documents_in_firestore(collection_path: str, doc_ids: List[str], verbose: bool = False, dry_run: bool = False):
     db = initialize_firestore_client()
     collection_ref = get_query_reference(db, collection_path)
+    doc_refs = (collection_ref.document(doc_id) for doc_id in doc_ids)
+    skip, on_progress = _resume_position(checkpoint, dry_run)
+
+    with BatchCommitter(db, batch_size=batch_size, max_in_flight=max_in_flight, on_progress=on_progress) as committer:
+        deleted_per_level = delete_documents_recursive(doc_refs, committer, recursive=recursive, skip=skip, verbose=verbose)
+
+    if on_progress:
+        checkpoint.complete()
+
+    for level, deleted in deleted_per_level.items():
+        print_verbose(f"Deleted {deleted} documents on level {level} of '{collection_path}'.", verbose)
+    print_verbose(committer.report(), verbose)
+
+def query_document_references(db,
+                              collection_path: str,
+                              collection_group: bool = False,
+                              conditions: List[Tuple[str, str, Any]] = [],
+                              limit: Optional[int] = None,
+                              page_size: int = QUERY_PAGE_SIZE) -> Iterator[Any]:
+    """Yields the references of the documents matching the query. Only the ids are projected, no field data is read."""
+    query_ref = apply_query_options(get_query_reference(db, collection_path, collection_group), conditions,
+                                    select=projection_fields(None, True, conditions))
+    for doc in stream_partition(query_ref, page_size=page_size, limit=limit):
+        yield doc.reference
+
+def delete_query_documents(collection_path: str,
+                           collection_group: bool = False,
+                           conditions: List[Tuple[str, str, Any]] = [],
+                           limit: Optional[int] = None,
+                           verbose: bool = False,
+                           dry_run: bool = False,
+                           recursive: bool = True,
+                           batch_size: int = MAX_BATCH_SIZE,
+                           max_in_flight: int = 4,
+                           page_size: int = QUERY_PAGE_SIZE):
+    """Deletes the documents matching the query (and their subcollections), the ids are streamed straight into the batches.
+    A dry run only counts the matching documents with an aggregation query."""
+    if dry_run:
+        count = aggregate_collection(collection_path, collection_group, conditions, limit=limit)["count"]
+        print_verbose(f"Dry run: would delete {count} documents matching the query on '{collection_path}'.", verbose)
+        return
 
-    with tqdm(total=len(doc_ids), disable=not verbose, desc="Deleting documents") as pbar:
-        for doc_id in doc_ids:
-            doc_ref = collection_ref.document(doc_id)
-
-            # First, delete subcollections recursively
-            if not dry_run:
-                for subcollection in doc_ref.collections():
-                    delete_collection_recursive(subcollection)
-
-                # Then delete the document itself
-                doc_ref.delete()
+    db = initialize_firestore_client()
+    doc_refs = query_document_references(db, collection_path, collection_group, conditions, limit, page_size)
+    with BatchCommitter(db, batch_size=batch_size, max_in_flight=max_in_flight) as committer:
+        deleted_per_level = delete_documents_recursive(doc_refs, committer, recursive=recursive, verbose=verbose)
 
-            if verbose:
-                print(f"Deleted document with ID '{doc_id}' from '{collection_path}', including its subcollections.")
-            pbar.update(1)
+    for level, deleted in deleted_per_level.items():
+        print_verbose(f"Deleted {deleted} documents on level {level} of '{collection_path}'.", verbose)
+    print_verbose(committer.report(), verbose)
 
-def process_deletion_file(documents) -> List[str]:
+def process_deletion_file(documents: Iterable[dict]) -> List[str]:
     try:
         doc_ids = [doc["__doc_id__"] for doc in documents if "__doc_id__" in doc]
     except KeyError as _:
@@ -148,66 +792,146 @@ def process_deletion_file(documents) -> List[str]:
 
 
 def update_documents_in_firestore(collection_path: str, 
-                                  updates: List[dict], 
+                                  updates: Iterable[dict], 
                                   timestamp_field: Optional[str] = None, 
                                   timestamp_convert: bool = False, 
                                   geopoint_convert: bool = False,
                                   upsert: bool = False,
+                                  convert_fields: Optional[List[str]] = None,
+                                  batch_size: int = MAX_BATCH_SIZE,
+                                  max_in_flight: int = 4,
+                                  checkpoint: Optional[Checkpoint] = None,
+                                  only_changed: bool = False,
+                                  validate: Optional[Callable[[Iterable[dict]], Iterator[Optional[dict]]]] = None,
                                   verbose: bool = False, 
                                   dry_run: bool = False):
     db = initialize_firestore_client()
-    batch = db.batch()
     collection_ref = get_query_reference(db, collection_path)
+    skip, on_progress = _resume_position(checkpoint, dry_run)
+    field_paths = field_path_tree(convert_fields) if convert_fields else None
 
-    # First, check for duplicate keys in the updates
-    seen_doc_ids = set()
-    duplicates = set()
-    for update in updates:
+    def prepare(update: Optional[dict]) -> Optional[Tuple[str, dict]]:
+        if update is None:
+            return None  # rejected by the validator
         doc_id = update.get("__doc_id__")
-        if doc_id:
-            if doc_id in seen_doc_ids:
-                duplicates.add(doc_id)
-            else:
-                seen_doc_ids.add(doc_id)
-
-    if duplicates:
-        sys.stderr.write(f"Error duplicate keys: {duplicates}")
-        sys.exit(1)
+        data = update.get("__data__")
+        if not doc_id or not data:
+            return None  # Skip if no document ID or data
 
-    try:
+        data = convert_to_firestore_types(db, data, timestamp_convert, geopoint_convert, field_paths, transforms=True)
 
-        with tqdm(total=len(updates), desc="Updating documents", disable=not verbose) as pbar:
-            for update in updates:
-                doc_id = update.get("__doc_id__")
-                data = update.get("__data__")
-                if not doc_id or not data:
-                    continue  # Skip if no document ID or data
+        if timestamp_field:
+            data[timestamp_field] = SERVER_TIMESTAMP
+        return doc_id, data
 
-                data = convert_to_firestore_types(db, data, timestamp_convert, geopoint_convert) 
-
-                if timestamp_field:
-                    data[timestamp_field] = SERVER_TIMESTAMP
-
-                doc_ref = collection_ref.document(doc_id)
-                if upsert:
-                    batch.set(doc_ref, data, merge=True) 
-                else:
-                    batch.update(doc_ref, data)
-
-                if pbar.n % 500 == 0 and not dry_run:  # Firestore batch limit
-                    batch.commit()
-                    batch = db.batch()  # Start a new batch after committing
-                
-                pbar.update(1)
-
-            if not dry_run and pbar.n % 500 != 0:  # Commit any remaining documents
-                batch.commit()
-
-            if verbose:
-                logging.info(f"Batch updated {pbar.n} documents in '{collection_path}'.")
+    updates = islice(updates, skip, None)
+    if validate:
+        updates = validate(updates)
+    # The updates are streamed, so duplicate keys are detected when they are reached
+    seen_doc_ids = set()
+    updated = 0
+    try:
+        with BatchCommitter(db, batch_size=batch_size, max_in_flight=max_in_flight, dry_run=dry_run, on_progress=on_progress) as committer, \
+             tqdm(desc="Updating documents", disable=not verbose) as pbar, \
+             _changed_writes(db, committer, only_changed, timestamp_field, verbose) as writes:
+            for position, prepared in enumerate(prefetch(prepare(update) for update in updates), skip + 1):
+                if prepared is not None:
+                    doc_id, data = prepared
+                    if doc_id in seen_doc_ids:
+                        # the batches before it are committed, the checkpoint records them (marked after their operations)
+                        resume = "rerun the corrected file with the same --checkpoint to continue after them" if on_progress \
+                            else "use --checkpoint to be able to continue after them"
+                        sys.stderr.write(f"Error duplicate keys: {{'{doc_id}'}} at input document {position}, "
+                                         f"the batches of the {updated} updates before it may already be committed, {resume}.\n")
+                        sys.exit(1)
+                    seen_doc_ids.add(doc_id)
+
+                    doc_ref = collection_ref.document(doc_id)
+                    if upsert:
+                        # a set with merge takes the dotted keys as field names, not as field paths like update
+                        writes.set(doc_ref, expand_field_paths(data), merge=True)
+                    else:
+                        writes.update(doc_ref, data)
+
+                    updated += 1
+                    pbar.update(1)
+                writes.mark(position)
+
+        if on_progress:
+            checkpoint.complete()
+        if verbose:
+            logging.info(f"Batch updated {updated} documents in '{collection_path}'.")
+            logging.info(committer.report())
     except NotFound as ex:
         raise Exception(f"{str(ex)} ... you can resolve this by using the --upsert flag to insert missing keys.")
 
+def update_query_documents(collection_path: str,
+                           data: dict,
+                           collection_group: bool = False,
+                           conditions: List[Tuple[str, str, Any]] = [],
+                           limit: Optional[int] = None,
+                           timestamp_field: Optional[str] = None,
+                           timestamp_convert: bool = False,
+                           geopoint_convert: bool = False,
+                           convert_fields: Optional[List[str]] = None,
+                           batch_size: int = MAX_BATCH_SIZE,
+                           max_in_flight: int = 4,
+                           page_size: int = QUERY_PAGE_SIZE,
+                           only_changed: bool = False,
+                           verbose: bool = False,
+                           dry_run: bool = False) -> int:
+    """Updates every document matching the query with the same data, the ids are streamed straight into the batches.
+    Returns the number of matching documents."""
+    db = initialize_firestore_client()
+    field_paths = field_path_tree(convert_fields) if convert_fields else None
+    data = convert_to_firestore_types(db, data, timestamp_convert, geopoint_convert, field_paths, transforms=True)
+    if timestamp_field:
+        data[timestamp_field] = SERVER_TIMESTAMP
+
+    updated = 0
+    with BatchCommitter(db, batch_size=batch_size, max_in_flight=max_in_flight, dry_run=dry_run) as committer, \
+         tqdm(desc="Updating documents", disable=not verbose) as pbar, \
+         _changed_writes(db, committer, only_changed, timestamp_field, verbose) as writes:
+        for doc_ref in query_document_references(db, collection_path, collection_group, conditions, limit, page_size):
+            writes.update(doc_ref, data)
+            updated += 1
+            pbar.update(1)
+
+    print_verbose(f"Batch updated {updated} documents matching the query on '{collection_path}'.", verbose)
+    print_verbose(committer.report(), verbose)
+    return updated
+
+def aggregation_alias(kind: str, field: str) -> str:
+    """The name of a sum or average in the result, e.g. 'sum_price' or 'avg_address_zip'."""
+    return f"{kind}_" + re.sub(r'\W', '_', field)
+
+def aggregate_collection(collection_path: str,
+                         collection_group: bool,
+                         conditions: List[Tuple[str, str, Any]] = [],
+                         sum_fields: List[str] = [],
+                         avg_fields: List[str] = [],
+                         limit: Optional[int] = None,
+                         verbose: bool = False) -> Dict[str, Any]:
+    """Counts the documents of the query and sums and averages the given fields with a single aggregation query.
+    Firestore computes them from the index, which is billed as one read per 1000 index entries instead of one per document.
+    Returns {'count': ..., 'sum_<field>': ..., 'avg_<field>': ...}, the average of a field without numbers is None."""
+    db = initialize_firestore_client()
+    query_ref = apply_query_options(get_query_reference(db, collection_path, collection_group), conditions, limit=limit)
+    aliases = ["count"] + [aggregation_alias("sum", field) for field in sum_fields] + [aggregation_alias("avg", field) for field in avg_fields]
+    aggregation_query = query_ref.count(alias="count")
+    for field in sum_fields:
+        aggregation_query = aggregation_query.sum(field, alias=aggregation_alias("sum", field))
+    for field in avg_fields:
+        aggregation_query = aggregation_query.avg(field, alias=aggregation_alias("avg", field))
+
+    metrics.count("rpcs", method="run_aggregation_query")
+    with metrics.timer("rpc", method="run_aggregation_query"):
+        results = aggregation_query.get()
+    values = {result.alias: result.value for result in results[0]}
+    aggregates = {alias: values[alias] for alias in aliases}
+    print_verbose(f"Counted {aggregates['count']} documents in '{collection_path}'.", verbose)
+    return aggregates
+
 def list_firestore_collections():
     db = initialize_firestore_client()  # Make sure this function returns a Firestore client instance.
     collections = db.collections()
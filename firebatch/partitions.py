@@ -0,0 +1,177 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+from google.cloud.firestore_v1.base_query import QueryPartition
+from google.cloud.firestore_v1.query import CollectionGroup
+from firebatch.utils import apply_query_options, get_query_reference
+from firebatch.metrics import metrics
+import logging
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+class _Failed:
+    """Carries an exception of a download thread to the consuming thread."""
+    def __init__(self, error: BaseException):
+        self.error = error
+
+def partition_group(db, collection_path: str, collection_group: bool) -> Tuple[Any, Optional[Any]]:
+    """
+    Returns the collection group query to split into partitions and, for a plain collection, the collection.
+
+    Partition cursors only exist for collection group queries, so a plain collection is split as a collection
+    group scoped to its parent document. That group also contains deeper subcollections with the same name,
+    so the partitions are read from the collection itself (see partition_query), never from the group.
+    """
+    if collection_group:
+        return db.collection_group(collection_path), None
+    collection_ref = get_query_reference(db, collection_path)
+    return CollectionGroup(collection_ref), collection_ref
+
+def _collection_position(collection_ref, path: str) -> Tuple[str, Optional[str]]:
+    """Where the document path of a partition cursor of the group lies among the documents of the collection:
+    ('at', id) is a document of the collection, ('below', id) is in a subcollection of that document, and
+    'before' or 'after' all of them for the same-named collections elsewhere. Names are ordered by their segments."""
+    parts, prefix = tuple(path.split('/')), tuple(collection_ref._path)
+    if parts[:len(prefix)] != prefix:
+        return ('before' if parts < prefix else 'after'), None
+    return ('at' if len(parts) == len(prefix) + 1 else 'below'), parts[len(prefix)]
+
+def _collection_range(collection_ref, start: Optional[str], end: Optional[str]):
+    """The query of the documents of the collection in the key range [start, end) of its group, None if it has none."""
+    query = collection_ref.order_by("__name__")
+    if start:
+        position, doc_id = _collection_position(collection_ref, start)
+        if position == 'after':
+            return None
+        if position == 'at':
+            query = query.start_at([collection_ref.document(doc_id)])
+        elif position == 'below':
+            query = query.start_after([collection_ref.document(doc_id)])
+    if end:
+        position, doc_id = _collection_position(collection_ref, end)
+        if position == 'before':
+            return None
+        if position == 'at':
+            query = query.end_before([collection_ref.document(doc_id)])
+        elif position == 'below':
+            query = query.end_at([collection_ref.document(doc_id)])
+    return query
+
+def partition_cursors(group, partition_count: int) -> List[Tuple[Optional[str], Optional[str]]]:
+    """Splits the group into at most partition_count key ranges, returned as (start, end) document paths.
+    None stands for the start respectively the end of the collection."""
+    metrics.count("rpcs", method="partition_query")
+    with metrics.timer("rpc", method="partition_query"):
+        return [(partition.start_at.path if partition.start_at else None, partition.end_at.path if partition.end_at else None)
+                for partition in group.get_partitions(partition_count)]
+
+def partition_query(db, group, start: Optional[str], end: Optional[str], conditions: List[Tuple[str, str, Any]] = [],
+                    select: Optional[List[str]] = None, collection_ref=None):
+    """Builds the query of the key range [start, end) of the group, or with collection_ref (see partition_group)
+    of the documents of the collection in that range. Returns None if the collection has no documents in it."""
+    if collection_ref is not None:
+        query = _collection_range(collection_ref, start, end)
+        if query is None:
+            return None
+    else:
+        query = QueryPartition(group, db.document(start) if start else None, db.document(end) if end else None).query()
+    return apply_query_options(query, conditions, select=select)
+
+def stream_pages(query, page_size: int, limit: Optional[int] = None) -> Iterator[Any]:
+    """
+    Yields the document snapshots of the query page by page. Every page is a query of at most page_size
+    documents continuing after the last document of the previous page, which bounds the payload of one RPC.
+    The limit replaces the limit of the query, which the page size overrides.
+    """
+    last_doc = None
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = page_size if remaining is None else min(page_size, remaining)
+        page = query.limit(size)
+        if last_doc is not None:
+            page = page.start_after(last_doc)
+        count = 0
+        metrics.count("rpcs", method="run_query")
+        for doc in metrics.timed(page.stream(), "fetch", "documents_read"):
+            yield doc
+            last_doc = doc
+            count += 1
+        if count < size:
+            return
+        if remaining is not None:
+            remaining -= count
+
+def stream_partition(query, page_size: Optional[int] = None, limit: Optional[int] = None) -> Iterator[Any]:
+    """Yields the document snapshots of a single partition query, in pages of page_size documents if given (see stream_pages)."""
+    if page_size:
+        yield from stream_pages(query, page_size, limit)
+    else:
+        metrics.count("rpcs", method="run_query")
+        # fetch is the time spent waiting for the next document of the stream, including decoding it
+        yield from metrics.timed(query.stream(), "fetch", "documents_read")
+
+def stream_partitions(queries: List[Any],
+                      doc_to_document: Callable[[Any], dict],
+                      ordered: bool = False,
+                      indexed: bool = False,
+                      buffer_size: int = 1000,
+                      page_size: Optional[int] = None) -> Iterator[Any]:
+    """
+    Downloads all partition queries concurrently and merges their documents into one stream.
+
+    Without ordered the documents are yielded as soon as any partition delivers them. With ordered
+    the partitions are yielded one after another, which gives a deterministic document name order;
+    later partitions keep downloading into a buffer of at most buffer_size documents each.
+    With indexed, (partition index, document) pairs are yielded. With page_size, every partition is read in pages.
+    """
+    stop = threading.Event()
+    if ordered:
+        queues = [queue.Queue(buffer_size) for _ in queries]
+    else:
+        queues = [queue.Queue(buffer_size)] * len(queries)
+
+    def put(q: queue.Queue, item) -> bool:
+        # never block forever, the consumer may have stopped reading
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def download(index: int, query, q: queue.Queue):
+        try:
+            for doc in stream_partition(query, page_size):
+                document = doc_to_document(doc)
+                if not put(q, (index, document) if indexed else document):
+                    return
+        except Exception as e:
+            put(q, _Failed(e))
+        finally:
+            put(q, _DONE)
+
+    def drain(q: queue.Queue, producers: int) -> Iterator[dict]:
+        while producers:
+            item = q.get()
+            if item is _DONE:
+                producers -= 1
+            elif isinstance(item, _Failed):
+                raise item.error
+            else:
+                yield item
+
+    with ThreadPoolExecutor(max_workers=max(len(queries), 1), thread_name_prefix="firebatch-partition") as executor:
+        for index, (query, q) in enumerate(zip(queries, queues)):
+            executor.submit(download, index, query, q)
+        try:
+            if ordered:
+                for q in queues:
+                    yield from drain(q, 1)
+            elif queries:
+                yield from drain(queues[0], len(queries))
+        finally:
+            stop.set()
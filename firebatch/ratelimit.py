@@ -0,0 +1,133 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+from firebatch.metrics import metrics
+import logging
+logger = logging.getLogger(__name__)
+
+INITIAL_RATE = 500  # operations per second firestore sustains on a new collection
+RAMP_INTERVAL = 300  # the rate grows by RAMP_FACTOR every 5 minutes
+RAMP_FACTOR = 1.5
+MIN_RATE = 10
+
+class RateController:
+    """
+    Paces the batch commits of a command, shared by all its BatchCommitters (e.g. one per file of a write).
+
+    With ramp_up it follows the 500/50/5 rule of firestore: start at 500 operations per second and raise the
+    rate by 50% every 5 minutes, so firestore can split the key ranges of a new collection (or of sequential ids)
+    before they become hot. max_ops_per_sec caps the rate, without ramp_up the writes start right at the cap.
+    A contention or quota error (ABORTED, RESOURCE_EXHAUSTED, DEADLINE_EXCEEDED) halves the rate and the number
+    of concurrent batches and restarts the ramp from the lower rate. The concurrency grows back by one batch
+    after as many successful commits as batches are allowed in flight, up to max_concurrency.
+
+    Usage:
+        rate.acquire(len(operations))  # blocks until the batch may be sent
+        try:
+            batch.commit()
+        except RETRYABLE_ERRORS:
+            rate.release(contention=True)
+        else:
+            rate.release()
+    """
+    def __init__(self,
+                 ramp_up: bool = False,
+                 max_ops_per_sec: Optional[float] = None,
+                 max_concurrency: Optional[int] = None,
+                 initial_rate: float = INITIAL_RATE,
+                 ramp_interval: float = RAMP_INTERVAL,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.max_ops_per_sec = max_ops_per_sec
+        self.max_concurrency = max_concurrency
+        self.ramp_interval = ramp_interval
+        self._clock = clock
+        self._sleep = sleep
+        self._base_rate = min(initial_rate, max_ops_per_sec or initial_rate) if ramp_up else max_ops_per_sec
+        self._ramp = ramp_up
+        self._ramp_start = clock()
+        self._next_start = 0.0
+        self._concurrency = max_concurrency
+        self._in_flight = 0
+        self._successes = 0
+        self.backoffs = 0
+        self._condition = threading.Condition()
+
+    @property
+    def rate(self) -> Optional[float]:
+        """The operations per second allowed now, None without a rate limit."""
+        if self._base_rate is None:
+            return None
+        rate = self._base_rate
+        if self._ramp or (self.max_ops_per_sec and rate < self.max_ops_per_sec):
+            rate *= RAMP_FACTOR ** int((self._clock() - self._ramp_start) / self.ramp_interval)
+        return min(rate, self.max_ops_per_sec) if self.max_ops_per_sec else rate
+
+    @property
+    def concurrency(self) -> Optional[int]:
+        return self._concurrency
+
+    def acquire(self, operations: int):
+        """Waits for a free concurrency slot and for the time slot of the operations at the current rate."""
+        with self._condition:
+            while self._concurrency is not None and self._in_flight >= self._concurrency:
+                self._condition.wait()
+            self._in_flight += 1
+            rate = self.rate
+            if rate is None:
+                return
+            # every batch reserves the time its operations take at the rate, batches are spaced accordingly
+            now = self._clock()
+            start = max(now, self._next_start)
+            self._next_start = start + operations / rate
+        if start > now:
+            metrics.record("throttle", start - now)
+            self._sleep(start - now)
+
+    def release(self, contention: bool = False):
+        """Frees the slot of a finished commit, a contention or quota error backs off."""
+        with self._condition:
+            self._in_flight -= 1
+            if contention:
+                self._back_off()
+            elif self._concurrency is not None and self._concurrency < self.max_concurrency:
+                self._successes += 1
+                if self._successes >= self._concurrency:
+                    self._concurrency += 1
+                    self._successes = 0
+            self._condition.notify_all()
+
+    def _back_off(self):
+        self.backoffs += 1
+        self._successes = 0
+        metrics.count("rate_backoffs")
+        rate = self.rate
+        if rate is not None:
+            self._base_rate = max(MIN_RATE, rate / 2)
+            self._ramp_start = self._clock()
+        if self._concurrency is not None:
+            self._concurrency = max(1, self._concurrency // 2)
+        logger.warning(f"Contention, backing off to {self._base_rate or 'unlimited'} operations per second "
+                       f"and {self._concurrency or 'unlimited'} concurrent batches.")
+
+    def report(self) -> str:
+        rate = self.rate
+        return (f"Rate control: {f'{rate:.0f} operations per second' if rate else 'no rate limit'}, "
+                f"{self._concurrency or 'unlimited'} concurrent batches, {self.backoffs} backoffs.")
+
+rate_control: Optional[RateController] = None  # the controller of the running command, used by new BatchCommitters
+
+@contextmanager
+def rate_controlled(ramp_up: bool = False, max_ops_per_sec: Optional[float] = None, max_concurrency: Optional[int] = None) -> Iterator[Optional[RateController]]:
+    """Paces the batch commits of the block with a RateController, if any of the limits is given."""
+    global rate_control
+    if not (ramp_up or max_ops_per_sec or max_concurrency):
+        yield None
+        return
+    previous, rate_control = rate_control, RateController(ramp_up, max_ops_per_sec, max_concurrency)
+    try:
+        yield rate_control
+    finally:
+        rate_control = previous
@@ -1,45 +1,219 @@
+import io
+import itertools
 import json
+import queue
 import re
-from typing import Any, List, TextIO, Tuple
-from google.cloud.firestore import Client
+import threading
+from typing import TYPE_CHECKING, Any, Iterable, Iterator, List, Optional, TextIO, Tuple
+from firebatch.metrics import metrics
 import logging
 logger = logging.getLogger(__name__)
 
-def read_documents(file: TextIO, format="auto"):
-    """ Reads the firestore documents from either a json or a jsonl file. 
-        The json file may be formatted as a list of firestore documents or as a single firestore document."""
-    # Try to parse the entire file as JSON
-    def read_json(file: TextIO):
-        file.seek(0)  # Ensure we start at the beginning
-        data = json.load(file)
-        if isinstance(data, list):
-            return data
-        return [data] # if it is just one object, wrap it as a list
-    
-    def read_jsonl(file: TextIO):
-        file.seek(0)  # Reset the file position to the beginning
-        data = []
-        for line in file:
-            sripped_line = line.strip()
-            if sripped_line:  # Only consider non-empty lines
-                data.append(json.loads(sripped_line))  # Attempt to parse line as JSON
-        return data  # Assume JSONL if no exceptions were raised for non-empty lines
-
-    if format == "auto":
-        try:
-            return read_json(file)
-        except json.JSONDecodeError:
-            # If JSON parsing fails, proceed to check for JSONL
+if TYPE_CHECKING:
+    from google.cloud.firestore import Client
+
+try:
+    from orjson import loads as fast_loads
+except ImportError:
+    fast_loads = json.loads
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = re.compile(r'\s*')
+_DONE = object()
+CHUNK_SIZE = 1 << 16
+INEQUALITY_OPERATORS = ('<', '<=', '>', '>=', '!=', 'not-in')  # firestore orders the results by these fields
+
+class _Failed:
+    """Carries an exception of the prefetch thread to the consuming thread."""
+    def __init__(self, error: BaseException):
+        self.error = error
+
+def _iter_json_values(file: TextIO, buffer: str, array: bool, chunk_size: int = CHUNK_SIZE) -> Iterator[Any]:
+    """
+    Incrementally decodes the file chunk by chunk. Yields the items of a top level array if array is set,
+    otherwise every top level value of a stream of whitespace separated values (a jsonl file or a single object).
+    """
+    pos = 0
+    eof = False
+    state = None  # position inside the top level array: 'first', 'value', 'separator' or 'closed'
+    if array:
+        pos = buffer.index('[') + 1
+        state = 'first'
+    metrics.count("bytes_read", len(buffer))
+
+    while True:
+        pos = _WHITESPACE.match(buffer, pos).end()
+        if pos < len(buffer) and array:
+            char = buffer[pos]
+            if state == 'closed':
+                raise json.JSONDecodeError("Extra data", buffer, pos)
+            if char == ']' and state in ('first', 'separator'):
+                pos += 1
+                state = 'closed'
+                continue
+            if state == 'separator':
+                if char != ',':
+                    raise json.JSONDecodeError("Expecting ',' delimiter", buffer, pos)
+                pos += 1
+                state = 'value'
+                continue
+
+        end = None
+        if pos < len(buffer):
             try:
-                return read_jsonl(file)
+                value, end = _decoder.raw_decode(buffer, pos)
             except json.JSONDecodeError:
-                raise Exception("Unknown file format, could not detect either JSON or JSONL.")
-    elif format == "json":
-        return read_json(file)
-    elif format == "jsonl":
-        return read_jsonl(file)
-    
-def get_query_reference(db: Client, collection_path: str, collection_group=False):
+                if eof:
+                    raise
+        elif eof:
+            break
+        if end is None or (end == len(buffer) and not eof):
+            # the value is incomplete, or a number at the end of the buffer may continue in the next chunk.
+            # Read at least as much as is buffered, so huge documents are still parsed in linear time.
+            chunk = file.read(max(chunk_size, len(buffer) - pos))
+            metrics.count("bytes_read", len(chunk))
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+
+        yield value
+        pos = end
+        if array:
+            state = 'separator'
+
+    if array and state != 'closed':
+        raise json.JSONDecodeError("Unterminated array", buffer, pos)
+
+def _loads(text: str) -> Any:
+    try:
+        return fast_loads(text)
+    except json.JSONDecodeError:
+        if fast_loads is json.loads:
+            raise
+    # NaN and Infinity, which json writes for non-finite doubles, are only accepted by the json module
+    return json.loads(text)
+
+def _iter_json_lines(lines: Iterable[str]) -> Iterator[Any]:
+    size = 0
+    try:
+        for line in lines:
+            size += len(line)
+            stripped_line = line.strip()
+            if stripped_line:  # Only consider non-empty lines
+                yield _loads(stripped_line)
+    finally:
+        metrics.count("bytes_read", size)
+
+def _iter_json_lines_or_values(file: TextIO, buffer: str, chunk_size: int = CHUNK_SIZE) -> Iterator[Any]:
+    """
+    Parses the buffer and the file that follows it line by line while every line is a whole json value, and
+    continues with the incremental parser from the first line that is not, e.g. a pretty-printed value.
+    """
+    head = io.StringIO(buffer)
+    size = 0
+    try:
+        for line in itertools.chain(head, file):
+            stripped_line = line.strip()
+            if not stripped_line:
+                continue
+            try:
+                value = fast_loads(stripped_line)
+            except json.JSONDecodeError:
+                yield from _iter_json_values(file, line + head.read(), False, chunk_size)
+                return
+            size += len(line)
+            yield value
+    finally:
+        metrics.count("bytes_read", size)
+
+def _is_json_line(line: str) -> bool:
+    try:
+        fast_loads(line)
+        return True
+    except json.JSONDecodeError:
+        return False
+
+def iter_documents(file: TextIO, format="auto", chunk_size: int = CHUNK_SIZE) -> Iterator[Any]:
+    """ Lazily yields the firestore documents from either a json or a jsonl file.
+        The json file may be formatted as a list of firestore documents or as a single firestore document.
+        The format is detected by peeking at the first non-whitespace character, nothing is read twice."""
+    return metrics.timed(_iter_documents(file, format, chunk_size), "parse", "documents_parsed")
+
+def _iter_documents(file: TextIO, format: str, chunk_size: int) -> Iterator[Any]:
+    if format == "jsonl":
+        yield from _iter_json_lines(file)
+        return
+
+    buffer = ""
+    while not buffer.strip():
+        chunk = file.read(chunk_size)
+        if not chunk:
+            if format == "json":
+                raise json.JSONDecodeError("Expecting value", buffer, len(buffer))
+            return  # an empty file contains no documents
+        buffer += chunk
+
+    array = buffer.lstrip().startswith('[')
+    try:
+        if not array and fast_loads is not json.loads:
+            # with orjson, a file whose first line is a whole json value is parsed line by line
+            if not buffer.endswith('\n'):
+                buffer += file.readline()
+            if _is_json_line(buffer.lstrip().split('\n', 1)[0]):
+                # the buffer ends with a complete line, the rest of the file follows it
+                yield from _iter_json_lines_or_values(file, buffer, chunk_size)
+                return
+        yield from _iter_json_values(file, buffer, array, chunk_size)
+    except json.JSONDecodeError as e:
+        if format == "auto":
+            raise Exception(f"Unknown file format, could not detect either JSON or JSONL: {e}")
+        raise
+
+def read_documents(file: TextIO, format="auto"):
+    """ Reads the firestore documents from either a json or a jsonl file into a list.
+        Prefer iter_documents for large files, it does not keep all documents in memory."""
+    return list(iter_documents(file, format))
+
+def prefetch(iterable: Iterable, size: int = 1000) -> Iterator:
+    """Consumes the iterable in a background thread, so producing the next items (e.g. parsing and converting
+    documents) overlaps with the work the consumer does with the current ones. At most size items are buffered."""
+    items = queue.Queue(size)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except BaseException as e:
+            put(_Failed(e))
+        finally:
+            put(_DONE)
+
+    thread = threading.Thread(target=produce, name="firebatch-prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                break
+            if isinstance(item, _Failed):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+def get_query_reference(db: "Client", collection_path: str, collection_group=False):
     if collection_group:
         return db.collection_group(collection_path)
     else:
@@ -53,6 +227,46 @@ def get_query_reference(db: Client, collection_path: str, collection_group=False
                 ref = ref.document(part)
         return ref
 
+def projection_fields(select: Optional[List[str]], 
+                      ids_only: bool = False, 
+                      conditions: List[Tuple[str, str, Any]] = [], 
+                      order_by: Optional[str] = None) -> Optional[List[str]]:
+    """
+    The field paths of the --select or --ids-only projection, None to fetch whole documents.
+    The fields of --order-by and of inequality filters are always included: a cursor continuing the query
+    after a document (the next page or a resumed read) needs their values.
+    """
+    if ids_only:
+        fields = ['__name__']
+    elif select:
+        fields = [field for field in select]
+    else:
+        return None
+    for field in ([order_by] if order_by else []) + [field for field, operator, _ in conditions if operator in INEQUALITY_OPERATORS]:
+        if field not in fields:
+            fields.append(field)
+    return fields
+
+def apply_query_options(query_ref, 
+                        conditions: List[Tuple[str, str, Any]] = [], 
+                        order_by: Optional[str] = None, 
+                        limit: Optional[int] = None, 
+                        select: Optional[List[str]] = None):
+    """Applies the --where conditions, ordering, limit and projection (see projection_fields) of the CLI to a query reference."""
+    for field, operator, value in conditions:
+        logger.debug(f"apply conditions: {conditions}")
+        if isinstance(value, str) and value.lower() in ("null", "none"):
+            value = None
+        query_ref = query_ref.where(field, operator, value)
+
+    if order_by:
+        query_ref = query_ref.order_by(order_by)
+    if limit:
+        query_ref = query_ref.limit(limit)
+    if select is not None:
+        query_ref = query_ref.select(select)
+    return query_ref
+
 def parse_query_condition(condition: str) -> Tuple[str, str, Any]:
     """Parses a query condition, allowing spaces around operators and handling quoted strings as values."""
     logger.debug(f"Evaluating condition: {condition}")
@@ -0,0 +1,139 @@
+import importlib
+import json
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO
+
+from firebatch.metrics import metrics
+import logging
+logger = logging.getLogger(__name__)
+
+VALIDATION_BATCH_SIZE = 1000  # documents validated by one call of the type adapter
+
+class InvalidDocument(ValueError):
+    """A document was rejected by the validator and there is no file to collect the rejects in."""
+
+@lru_cache(maxsize=None)
+def load_model(validator: str):
+    """Imports the validator 'module:Class', a pydantic model or any type a pydantic TypeAdapter accepts
+    (a dataclass, a TypedDict, ...), and returns the adapter validating a list of its documents."""
+    from pydantic import TypeAdapter
+    module_name, separator, class_name = validator.rpartition(':')
+    if not separator or not module_name or not class_name:
+        raise ValueError(f"Invalid validator '{validator}', use 'module:Class'.")
+    try:
+        model = getattr(importlib.import_module(module_name), class_name)
+    except (ImportError, AttributeError) as e:
+        raise ValueError(f"Validator loading error: {e}") from e
+    return TypeAdapter(List[model])
+
+def validate_batch(validator: str, batch: List[dict]) -> Dict[int, List[dict]]:
+    """Validates the data of the documents with one call of the adapter and returns the errors of the
+    rejected ones by their index in the batch. Runs in the validation processes."""
+    from pydantic import ValidationError
+    try:
+        load_model(validator).validate_python([_data(document) for document in batch])
+        return {}
+    except ValidationError as e:
+        rejected: Dict[int, List[dict]] = {}
+        for error in e.errors(include_url=False):
+            index, *location = error['loc']
+            rejected.setdefault(index, []).append({"loc": location, "msg": error['msg'], "type": error['type']})
+        return rejected
+
+def _data(document: dict) -> Any:
+    """The data of a wrapped document, a raw document as it is."""
+    return document["__data__"] if isinstance(document, dict) and "__data__" in document else document
+
+class DocumentValidator:
+    """
+    Validates the data of the documents streamed to write or update against a pydantic model.
+
+    The documents are validated in batches of batch_size by one TypeAdapter call each (no round trip through
+    json), in the calling thread or, with processes > 1, in a process pool that validates up to two batches per
+    process ahead of the upload. Rejected documents are written with their errors as one json line each to the
+    rejects file and replaced by None in the stream, so the positions of checkpoints keep counting the input.
+    Without a rejects file the first rejected document raises InvalidDocument.
+    Several threads can validate their files with the same validator, they share its process pool.
+
+    Usage:
+        with DocumentValidator("my_validators:User", rejects=file) as validate:
+            for document in validate(documents):
+                if document is not None:
+                    ...
+        print(validate.rejected)
+    """
+    def __init__(self, validator: str,
+                 rejects: Optional[TextIO] = None,
+                 processes: int = 1,
+                 batch_size: int = VALIDATION_BATCH_SIZE):
+        load_model(validator)  # a wrong validator fails before the upload starts
+        self.validator = validator
+        self.rejects = rejects
+        self.processes = processes
+        self.batch_size = batch_size
+        self.valid = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        if processes > 1:
+            # forking a process that already runs threads is unsafe, the workers import the validator themselves
+            self._executor = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"))
+
+    def __enter__(self) -> "DocumentValidator":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._executor:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def __call__(self, documents: Iterable[dict]) -> Iterator[Optional[dict]]:
+        """Yields the valid documents in their order and None in place of the rejected ones."""
+        documents = iter(documents)
+        batches = iter(lambda: list(islice(documents, self.batch_size)), [])
+        if self._executor is None:
+            validated = ((batch, validate_batch(self.validator, batch)) for batch in batches)
+        else:
+            validated = self._validate_in_processes(batches)
+        for batch, rejected in validated:
+            for index, document in enumerate(batch):
+                if index in rejected:
+                    self._reject(document, rejected[index])
+                    yield None
+                else:
+                    yield document
+            with self._lock:
+                self.valid += len(batch) - len(rejected)
+
+    def _validate_in_processes(self, batches: Iterator[List[dict]]) -> Iterator[tuple]:
+        pending = deque()
+        for batch in batches:
+            pending.append((batch, self._executor.submit(validate_batch, self.validator, batch)))
+            while len(pending) >= 2 * self.processes:
+                batch, future = pending.popleft()
+                yield batch, future.result()
+        while pending:
+            batch, future = pending.popleft()
+            yield batch, future.result()
+
+    def _reject(self, document: dict, errors: List[dict]):
+        metrics.count("documents_rejected")
+        with self._lock:
+            self.rejected += 1
+            if self.rejects is None:
+                raise InvalidDocument(f"Data validation error of {_describe(document)}: {errors}")
+            self.rejects.write(json.dumps({"document": document, "errors": errors}, default=str) + "\n")
+
+    def report(self) -> str:
+        return f"{self.valid} valid documents, {self.rejected} rejected."
+
+def _describe(document: dict) -> str:
+    doc_id = document.get("__doc_id__") if isinstance(document, dict) else None
+    return f"document '{doc_id}'" if doc_id else "a document"
@@ -0,0 +1,43 @@
+"""
+Shared fixtures, the tests run the operations against the in-process fake of the Firestore API.
+
+A test module seeds the db fixture by defining a function seed(db) that writes the documents its tests start with.
+"""
+from datetime import datetime, timezone
+from unittest import mock
+
+import pytest
+from google.cloud.firestore import GeoPoint
+from tests.fake_firestore import fake_client
+from firebatch import operations
+
+@pytest.fixture
+def db(request):
+    """A fake client seeded by the seed function of the test module, with its RPC counters reset, that the operations use."""
+    db = fake_client()
+    seed = getattr(request.module, "seed", None)
+    if seed:
+        seed(db)
+    db._firestore_api.reset()
+    with mock.patch.object(operations, "initialize_firestore_client", return_value=db):
+        yield db
+
+@pytest.fixture
+def source():
+    """A second project with native values, references and nested subcollections, the source of copies and backups."""
+    db = fake_client(project="source")
+    for index in range(20):
+        db.collection("users").document(f"u{index}").set({"age": index, "created": datetime(2024, 1, 1, tzinfo=timezone.utc),
+                                                            "location": GeoPoint(52.5, 13.4), "friend": db.document(f"users/u{(index + 1) % 20}"),
+                                                            "group": db.document("groups/admins")})
+    db.collection("groups").document("admins").set({"size": 2})
+    db.collection("users").document("u1").collection("orders").document("o1").set({"total": 10})
+    db.collection("users").document("u1").collection("orders").document("o1").collection("items").document("i1").set({"sku": "a"})
+    # a document that only exists because of its subcollection
+    db.collection("users").document("ghost").collection("orders").document("o2").collection("items").document("i2").set({"sku": "b"})
+    db._firestore_api.reset()
+    return db
+
+@pytest.fixture
+def destination():
+    return fake_client(project="destination")
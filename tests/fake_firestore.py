@@ -0,0 +1,474 @@
+"""
+An in-process stand-in for the Firestore RPC API, used by the tests and the benchmarks to run firebatch without a network.
+
+The fake replaces only the GAPIC layer below a real firestore.Client, so queries, batches, cursors and
+partitions are built by the real client library and every RPC firebatch sends can be counted. It keeps
+all documents in memory and implements the subset of the Firestore semantics the commands rely on
+(filters, ordering, cursors, limits, partitions, field masks and the common transforms).
+
+    client = fake_client(latency=0.02)
+    client.collection("users").document("a").set({"name": "A"})
+    async_client = fake_async_client(api=client._firestore_api.api)
+"""
+import asyncio
+import collections
+import itertools
+import math
+import threading
+import time
+from datetime import datetime, timezone
+from functools import cmp_to_key
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from google.api_core.exceptions import NotFound, AlreadyExists, FailedPrecondition
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import firestore
+from google.cloud.firestore_v1.types import document, firestore as firestore_types, query as query_types, write
+
+PROJECT = "firebatch-bench"
+
+_Operator = query_types.StructuredQuery.FieldFilter.Operator
+_UnaryOperator = query_types.StructuredQuery.UnaryFilter.Operator
+_Direction = query_types.StructuredQuery.Direction
+
+
+class InstrumentedApi:
+    """
+    Wraps a Firestore API object (the fake or the real GAPIC client of the emulator), counts the RPCs
+    per method and delays every RPC by latency seconds.
+    """
+    def __init__(self, api, latency: float = 0.0):
+        self.api = api
+        self.latency = latency
+        self.rpcs = collections.Counter()
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self.api, name)
+        if name.startswith("_") or not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            with self._lock:
+                self.rpcs[name] += 1
+            if self.latency:
+                time.sleep(self.latency)
+            return attribute(*args, **kwargs)
+        return call
+
+    def reset(self):
+        with self._lock:
+            self.rpcs.clear()
+
+
+def fake_client(latency: float = 0.0, project: str = PROJECT) -> firestore.Client:
+    """A firestore.Client backed by a new, empty in-memory FakeFirestoreApi wrapped in an InstrumentedApi."""
+    client = firestore.Client(project=project, credentials=AnonymousCredentials())
+    client._firestore_api_internal = InstrumentedApi(FakeFirestoreApi(), latency)
+    return client
+
+
+class AsyncApi:
+    """
+    Exposes a synchronous (fake or instrumented) API with the coroutine interface of the async GAPIC client:
+    every RPC is awaited, streams and pagers are returned as async iterators. The latency is awaited, so it
+    does not block the event loop. Other attributes (e.g. rpcs and reset of an InstrumentedApi) are forwarded.
+    """
+    def __init__(self, api, latency: float = 0.0):
+        self.api = api
+        self.latency = latency
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self.api, name)
+        if name.startswith("_") or name == "reset" or not callable(attribute):
+            return attribute
+
+        async def call(*args, **kwargs):
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            result = attribute(*args, **kwargs)
+            if isinstance(result, (list, Iterator)):
+                return _AsyncIterator(result)
+            return result
+        return call
+
+
+class _AsyncIterator:
+    def __init__(self, items):
+        self._items = iter(items)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._items)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+def fake_async_client(latency: float = 0.0, project: str = PROJECT, api: Optional["FakeFirestoreApi"] = None) -> firestore.AsyncClient:
+    """A firestore.AsyncClient backed by an in-memory FakeFirestoreApi, pass the api of a fake_client to share its documents."""
+    client = firestore.AsyncClient(project=project, credentials=AnonymousCredentials())
+    client._firestore_api_internal = AsyncApi(InstrumentedApi(api or FakeFirestoreApi()), latency)
+    return client
+
+
+def instrument_client(client: firestore.Client, latency: float = 0.0) -> firestore.Client:
+    """Wraps the RPC API of an existing client (for example one connected to the emulator) in an InstrumentedApi."""
+    client._firestore_api_internal = InstrumentedApi(client._firestore_api, latency)
+    return client
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _segments(name: str) -> Tuple[str, ...]:
+    return tuple(name.split("/"))
+
+
+def _value_key(value) -> tuple:
+    """Sort key of a Value protobuf following the Firestore ordering of types and values."""
+    kind = value.WhichOneof("value_type")
+    if kind is None or kind == "null_value":
+        return (0,)
+    if kind == "boolean_value":
+        return (1, value.boolean_value)
+    if kind in ("integer_value", "double_value"):
+        number = getattr(value, kind)
+        return (2, -math.inf) if isinstance(number, float) and math.isnan(number) else (2, number)
+    if kind == "timestamp_value":
+        return (3, value.timestamp_value.seconds, value.timestamp_value.nanos)
+    if kind == "string_value":
+        return (4, value.string_value)
+    if kind == "bytes_value":
+        return (5, value.bytes_value)
+    if kind == "reference_value":
+        return (6, _segments(value.reference_value))
+    if kind == "geo_point_value":
+        return (7, value.geo_point_value.latitude, value.geo_point_value.longitude)
+    if kind == "array_value":
+        return (8, tuple(_value_key(item) for item in value.array_value.values))
+    if kind == "map_value":
+        return (9, tuple((key, _value_key(item)) for key, item in sorted(value.map_value.fields.items())))
+    return (10,)
+
+
+def _split_field_path(field_path: str) -> List[str]:
+    return [part.strip("`") for part in field_path.split(".")]
+
+
+def _get_field(fields, field_path: str):
+    """The Value protobuf at the dotted field path of a fields map, None if it does not exist."""
+    value = None
+    for part in _split_field_path(field_path):
+        if part not in fields:
+            return None
+        value = fields[part]
+        if value.WhichOneof("value_type") != "map_value":
+            fields = {}
+        else:
+            fields = value.map_value.fields
+    return value
+
+
+def _set_field(fields, field_path: str, value):
+    parts = _split_field_path(field_path)
+    for part in parts[:-1]:
+        if fields[part].WhichOneof("value_type") != "map_value":
+            fields[part].map_value.SetInParent()
+        fields = fields[part].map_value.fields
+    if value is None:
+        if parts[-1] in fields:
+            del fields[parts[-1]]
+    else:
+        fields[parts[-1]].CopyFrom(value)
+
+
+class FakeFirestoreApi:
+    """Implements the Firestore RPCs used by firebatch on an in-memory dict of Document protobufs."""
+    def __init__(self):
+        self.documents: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    # --- writes
+
+    def commit(self, request, metadata=(), **kwargs):
+        request = firestore_types.CommitRequest(request)._pb
+        now = _now()
+        results = []
+        with self._lock:
+            # all writes of a commit are validated before any is applied
+            for write_pb in request.writes:
+                self._check_precondition(write_pb)
+            for write_pb in request.writes:
+                self._apply(write_pb, now)
+                results.append(write.WriteResult(update_time=now))
+        return firestore_types.CommitResponse(write_results=results, commit_time=now)
+
+    def _check_precondition(self, write_pb):
+        name = write_pb.delete if write_pb.WhichOneof("operation") == "delete" else write_pb.update.name
+        if write_pb.HasField("current_document") and write_pb.current_document.WhichOneof("condition_type") == "exists":
+            exists = name in self.documents
+            if write_pb.current_document.exists and not exists:
+                raise NotFound(f"No document to update: {name}")
+            if not write_pb.current_document.exists and exists:
+                raise AlreadyExists(f"Document already exists: {name}")
+
+    def _apply(self, write_pb, now: datetime):
+        operation = write_pb.WhichOneof("operation")
+        if operation == "delete":
+            self.documents.pop(write_pb.delete, None)
+            return
+        if operation != "update":
+            raise FailedPrecondition(f"Unsupported write operation {operation}")
+
+        name = write_pb.update.name
+        existing = self.documents.get(name)
+        doc = document.Document()._pb
+        if existing is not None and write_pb.HasField("update_mask"):
+            doc.CopyFrom(existing)
+            for field_path in write_pb.update_mask.field_paths:
+                _set_field(doc.fields, field_path, _get_field(write_pb.update.fields, field_path))
+        else:
+            doc.CopyFrom(write_pb.update)
+        for transform in write_pb.update_transforms:
+            _set_field(doc.fields, transform.field_path, self._transformed(_get_field(doc.fields, transform.field_path), transform, now))
+
+        doc.name = name
+        if existing is not None:
+            doc.create_time.CopyFrom(existing.create_time)
+        else:
+            doc.create_time.FromDatetime(now)
+        doc.update_time.FromDatetime(now)
+        self.documents[name] = doc
+
+    @staticmethod
+    def _transformed(current, transform, now: datetime):
+        value = document.Value()._pb
+        kind = transform.WhichOneof("transform_type")
+        if kind == "set_to_server_value":
+            value.timestamp_value.FromDatetime(now)
+        elif kind == "increment":
+            increment = transform.increment
+            base = current if current is not None and current.WhichOneof("value_type") in ("integer_value", "double_value") else None
+            if base is None:
+                value.CopyFrom(increment)
+            elif base.WhichOneof("value_type") == "integer_value" and increment.WhichOneof("value_type") == "integer_value":
+                value.integer_value = base.integer_value + increment.integer_value
+            else:
+                value.double_value = getattr(base, base.WhichOneof("value_type")) + getattr(increment, increment.WhichOneof("value_type"))
+        elif kind in ("append_missing_elements", "remove_all_from_array"):
+            items = list(current.array_value.values) if current is not None and current.WhichOneof("value_type") == "array_value" else []
+            elements = getattr(transform, kind).values
+            keys = [_value_key(element) for element in elements]
+            if kind == "append_missing_elements":
+                present = {_value_key(item) for item in items}
+                items.extend(element for element, key in zip(elements, keys) if key not in present)
+            else:
+                items = [item for item in items if _value_key(item) not in keys]
+            value.array_value.SetInParent()
+            value.array_value.values.extend(items)
+        elif kind in ("maximum", "minimum"):
+            operand = getattr(transform, kind)
+            if current is None or _value_key(current)[0] != 2:
+                value.CopyFrom(operand)
+            else:
+                pick = max if kind == "maximum" else min
+                value.CopyFrom(pick(current, operand, key=_value_key))
+        return value
+
+    # --- reads
+
+    def batch_get_documents(self, request, metadata=(), **kwargs) -> Iterator[Any]:
+        request = firestore_types.BatchGetDocumentsRequest(request)._pb
+        now = _now()
+        with self._lock:
+            found = [(name, self.documents.get(name)) for name in request.documents]
+        for name, doc in found:
+            response = firestore_types.BatchGetDocumentsResponse(read_time=now)._pb
+            if doc is None:
+                response.missing = name
+            else:
+                response.found.CopyFrom(self._masked(doc, request.mask.field_paths if request.HasField("mask") else None))
+            yield firestore_types.BatchGetDocumentsResponse.wrap(response)
+
+    def run_query(self, request, metadata=(), **kwargs) -> Iterator[Any]:
+        request = firestore_types.RunQueryRequest(request)._pb
+        now = _now()
+        for doc in self._query(request.parent, request.structured_query):
+            response = firestore_types.RunQueryResponse(read_time=now)._pb
+            response.document.CopyFrom(doc)
+            yield firestore_types.RunQueryResponse.wrap(response)
+
+    def run_aggregation_query(self, request, metadata=(), **kwargs) -> Iterator[Any]:
+        request = firestore_types.RunAggregationQueryRequest(request)._pb
+        aggregation_query = request.structured_aggregation_query
+        documents = list(self._query(request.parent, aggregation_query.structured_query))
+        result = firestore_types.RunAggregationQueryResponse(read_time=_now())._pb
+        for aggregation in aggregation_query.aggregations:
+            kind = aggregation.WhichOneof("operator")
+            value = result.result.aggregate_fields[aggregation.alias]
+            if kind == "count":
+                limit = aggregation.count.up_to.value if aggregation.count.HasField("up_to") else None
+                value.integer_value = min(len(documents), limit) if limit is not None else len(documents)
+                continue
+            field_path = getattr(aggregation, kind).field.field_path
+            numbers = [_get_field(doc.fields, field_path) for doc in documents]
+            numbers = [number for number in numbers if number is not None and number.WhichOneof("value_type") in ("integer_value", "double_value")]
+            if kind == "sum":
+                if all(number.WhichOneof("value_type") == "integer_value" for number in numbers):
+                    value.integer_value = sum(number.integer_value for number in numbers)
+                else:
+                    value.double_value = sum(getattr(number, number.WhichOneof("value_type")) for number in numbers)
+            elif numbers:
+                value.double_value = sum(getattr(number, number.WhichOneof("value_type")) for number in numbers) / len(numbers)
+            else:
+                value.null_value = 0
+        yield firestore_types.RunAggregationQueryResponse.wrap(result)
+
+    def partition_query(self, request, metadata=(), **kwargs) -> List[Any]:
+        request = firestore_types.PartitionQueryRequest(request)._pb
+        names = [doc.name for doc in self._query(request.parent, request.structured_query)]
+        count = max(request.partition_count, 1)
+        split_points = sorted({names[len(names) * index // count] for index in range(1, count)}, key=_segments) if names else []
+        return [query_types.Cursor(values=[document.Value(reference_value=name)]) for name in split_points]
+
+    def list_documents(self, request, metadata=(), **kwargs) -> List[Any]:
+        request = firestore_types.ListDocumentsRequest(request)._pb
+        prefix = f"{request.parent}/{request.collection_id}/"
+        with self._lock:
+            names = set()
+            for name in self.documents:
+                if name.startswith(prefix):
+                    doc_id = name[len(prefix):].split("/", 1)[0]
+                    # documents that only exist because of their subcollections are "missing"
+                    if request.show_missing or f"{prefix}{doc_id}" in self.documents:
+                        names.add(f"{prefix}{doc_id}")
+        return [document.Document(name=name) for name in sorted(names, key=_segments)]
+
+    def list_collection_ids(self, request, metadata=(), **kwargs) -> List[str]:
+        request = firestore_types.ListCollectionIdsRequest(request)._pb
+        prefix = f"{request.parent}/"
+        with self._lock:
+            return sorted({name[len(prefix):].split("/", 1)[0] for name in self.documents if name.startswith(prefix)})
+
+    # --- query evaluation
+
+    def _query(self, parent: str, structured_query) -> Iterator[Any]:
+        selectors = structured_query.from_
+        prefix = f"{parent}/"
+        with self._lock:
+            candidates = [doc for name, doc in self.documents.items()
+                          if name.startswith(prefix) and self._selected(name[len(prefix):].split("/"), selectors)]
+
+        if structured_query.HasField("where"):
+            candidates = [doc for doc in candidates if self._matches(doc, structured_query.where)]
+
+        orders = [(order.field.field_path, order.direction) for order in structured_query.order_by]
+        if not any(field_path == "__name__" for field_path, _ in orders):
+            orders.append(("__name__", orders[-1][1] if orders else _Direction.ASCENDING))
+        # documents without a value for an ordered field are not part of the result
+        keyed = []
+        for doc in candidates:
+            values = [self._order_value(doc, field_path) for field_path, _ in orders]
+            if all(value is not None for value in values):
+                keyed.append(([_value_key(value) for value in values], doc))
+        directions = [direction for _, direction in orders]
+        keyed.sort(key=cmp_to_key(lambda a, b: self._compare(a[0], b[0], directions)))
+
+        if structured_query.HasField("start_at"):
+            start = structured_query.start_at
+            keys = [_value_key(value) for value in start.values]
+            keyed = [(key, doc) for key, doc in keyed
+                     if (self._compare(key[:len(keys)], keys, directions) >= 0 if start.before else self._compare(key[:len(keys)], keys, directions) > 0)]
+        if structured_query.HasField("end_at"):
+            end = structured_query.end_at
+            keys = [_value_key(value) for value in end.values]
+            keyed = [(key, doc) for key, doc in keyed
+                     if (self._compare(key[:len(keys)], keys, directions) < 0 if end.before else self._compare(key[:len(keys)], keys, directions) <= 0)]
+
+        documents = (doc for _, doc in keyed)
+        documents = itertools.islice(documents, structured_query.offset, None)
+        if structured_query.HasField("limit"):
+            documents = itertools.islice(documents, structured_query.limit.value)
+        mask = [field.field_path for field in structured_query.select.fields] if structured_query.HasField("select") else None
+        for doc in documents:
+            yield self._masked(doc, mask)
+
+    @staticmethod
+    def _selected(path: List[str], selectors) -> bool:
+        if len(path) % 2:
+            return False
+        for selector in selectors:
+            if selector.all_descendants and path[-2] == selector.collection_id:
+                return True
+            if len(path) == 2 and path[0] == selector.collection_id:
+                return True
+        return False
+
+    @staticmethod
+    def _masked(doc, field_paths: Optional[List[str]]):
+        if field_paths is None:
+            return doc
+        masked = document.Document()._pb
+        masked.name = doc.name
+        masked.create_time.CopyFrom(doc.create_time)
+        masked.update_time.CopyFrom(doc.update_time)
+        for field_path in field_paths:
+            value = _get_field(doc.fields, field_path)
+            if value is not None:
+                _set_field(masked.fields, field_path, value)
+        return masked
+
+    @staticmethod
+    def _order_value(doc, field_path: str):
+        if field_path == "__name__":
+            return document.Value(reference_value=doc.name)._pb
+        return _get_field(doc.fields, field_path)
+
+    @staticmethod
+    def _compare(a: List[tuple], b: List[tuple], directions: List[int]) -> int:
+        for key_a, key_b, direction in zip(a, b, directions):
+            if key_a != key_b:
+                result = -1 if key_a < key_b else 1
+                return -result if direction == _Direction.DESCENDING else result
+        return 0
+
+    def _matches(self, doc, filter_pb) -> bool:
+        kind = filter_pb.WhichOneof("filter_type")
+        if kind == "composite_filter":
+            results = (self._matches(doc, child) for child in filter_pb.composite_filter.filters)
+            return any(results) if filter_pb.composite_filter.op == query_types.StructuredQuery.CompositeFilter.Operator.OR else all(results)
+        if kind == "unary_filter":
+            unary = filter_pb.unary_filter
+            value = self._order_value(doc, unary.field.field_path)
+            is_null = value is not None and value.WhichOneof("value_type") == "null_value"
+            is_nan = value is not None and value.WhichOneof("value_type") == "double_value" and math.isnan(value.double_value)
+            return {_UnaryOperator.IS_NULL: is_null, _UnaryOperator.IS_NOT_NULL: value is not None and not is_null,
+                    _UnaryOperator.IS_NAN: is_nan, _UnaryOperator.IS_NOT_NAN: value is not None and not is_nan}[unary.op]
+
+        field_filter = filter_pb.field_filter
+        value = self._order_value(doc, field_filter.field.field_path)
+        if value is None:
+            return False
+        key, operand, op = _value_key(value), field_filter.value, field_filter.op
+        if op in (_Operator.ARRAY_CONTAINS, _Operator.ARRAY_CONTAINS_ANY):
+            if value.WhichOneof("value_type") != "array_value":
+                return False
+            items = {_value_key(item) for item in value.array_value.values}
+            operands = operand.array_value.values if op == _Operator.ARRAY_CONTAINS_ANY else [operand]
+            return any(_value_key(item) in items for item in operands)
+        if op in (_Operator.IN, _Operator.NOT_IN):
+            contained = key in {_value_key(item) for item in operand.array_value.values}
+            return contained if op == _Operator.IN else not contained and value.WhichOneof("value_type") != "null_value"
+        operand_key = _value_key(operand)
+        if op == _Operator.EQUAL:
+            return key == operand_key
+        if op == _Operator.NOT_EQUAL:
+            return key != operand_key and value.WhichOneof("value_type") != "null_value"
+        if key[0] != operand_key[0]:
+            return False  # range filters only match values of the same type
+        return {_Operator.LESS_THAN: key < operand_key, _Operator.LESS_THAN_OR_EQUAL: key <= operand_key,
+                _Operator.GREATER_THAN: key > operand_key, _Operator.GREATER_THAN_OR_EQUAL: key >= operand_key}[op]
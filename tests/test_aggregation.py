@@ -0,0 +1,25 @@
+from firebatch import operations
+from firebatch.utils import parse_query_condition
+
+def seed(db):
+    for index in range(10):
+        db.collection("orders").document(f"o{index}").set({"price": index, "status": "open" if index % 2 else "closed"})
+    db.collection("users").document("u1").collection("orders").document("o1").set({"price": 100, "status": "open"})
+
+def test_count(db):
+    assert operations.aggregate_collection("orders", False) == {"count": 10}
+    assert db._firestore_api.rpcs == {"run_aggregation_query": 1}
+
+def test_count_with_conditions(db):
+    conditions = [parse_query_condition("status == open"), parse_query_condition("price >= 5")]
+    aggregates = operations.aggregate_collection("orders", False, conditions, sum_fields=["price"], avg_fields=["price"])
+    assert aggregates == {"count": 3, "sum_price": 5 + 7 + 9, "avg_price": 7.0}
+
+def test_count_collection_group(db):
+    assert operations.aggregate_collection("orders", True, sum_fields=["price"]) == {"count": 11, "sum_price": 145}
+
+def test_count_with_limit(db):
+    assert operations.aggregate_collection("orders", False, limit=4)["count"] == 4
+
+def test_aggregation_alias():
+    assert operations.aggregation_alias("avg", "address.zip") == "avg_address_zip"
@@ -0,0 +1,156 @@
+import asyncio
+
+import pytest
+from google.api_core.exceptions import Aborted, InvalidArgument
+from tests.fake_firestore import fake_async_client
+from firebatch import aio
+from firebatch.utils import parse_query_condition
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def set(self, doc_ref, data, merge=False):
+        self.writes.append(('set', doc_ref, data))
+
+    def delete(self, doc_ref):
+        self.writes.append(('delete', doc_ref))
+
+    async def commit(self):
+        await self.db.commit(self.writes)
+
+class FakeDB:
+    def __init__(self, failures=(), latency=0.01):
+        self.failures = list(failures)
+        self.latency = latency
+        self.committed = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def batch(self):
+        return FakeBatch(self)
+
+    async def commit(self, writes):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            if self.failures:
+                raise self.failures.pop(0)
+            self.committed.append(writes)
+        finally:
+            self.in_flight -= 1
+
+def seed(db):
+    for index in range(50):
+        db.collection("users").document(f"u{index:02d}").set({"age": index})
+    for index in range(3):
+        db.collection("users").document(f"u{index:02d}").collection("orders").document("o").set({"total": index})
+
+@pytest.fixture
+def async_db(db):
+    return fake_async_client(api=db._firestore_api.api)
+
+def ids(db, path):
+    return sorted(doc.id for doc in db.collection(path).stream())
+
+async def collect(iterator):
+    return [item async for item in iterator]
+
+@pytest.mark.parametrize("parallel", [1, 4])
+def test_stream_documents(async_db, parallel):
+    documents = asyncio.run(collect(aio.stream_documents(async_db, "users", conditions=[parse_query_condition("age >= 10")], parallel=parallel, concurrency=2)))
+    assert sorted(document["__doc_id__"] for document in documents) == [f"u{index:02d}" for index in range(10, 50)]
+    assert documents[0]["__data__"].keys() == {"age"}
+    # the subcollection documents of the partitioned collection group are not part of the collection
+    assert all(document["__doc_id__"] != "o" for document in documents)
+
+def test_stream_documents_limit_and_ids_only(async_db):
+    documents = asyncio.run(collect(aio.stream_documents(async_db, "users", limit=5, ids_only=True, parallel=3)))
+    assert len(documents) == 5
+    assert all(document.keys() == {"__doc_id__"} for document in documents)
+
+def test_stream_collections(db, async_db):
+    for index in range(5):
+        db.collection("products").document(f"p{index}").set({"price": index})
+    items = asyncio.run(collect(aio.stream_collections(async_db, ["users", "products"], concurrency=1)))
+    assert sum(1 for path, _ in items if path == "users") == 50
+    assert sorted(document["__doc_id__"] for path, document in items if path == "products") == [f"p{index}" for index in range(5)]
+
+def test_aggregate(async_db):
+    aggregates = asyncio.run(aio.aggregate(async_db, "users", conditions=[parse_query_condition("age < 10")], sum_fields=["age"], avg_fields=["age"]))
+    assert aggregates == {"count": 10, "sum_age": 45, "avg_age": 4.5}
+
+def test_committer_bounds_batches_in_flight():
+    db = FakeDB()
+    async def run():
+        async with aio.AsyncBatchCommitter(db, batch_size=10, max_in_flight=3) as committer:
+            for index in range(95):
+                await committer.set(index, {"value": index})
+        return committer
+    committer = asyncio.run(run())
+    assert committer.committed_writes == 95
+    assert sorted(len(writes) for writes in db.committed) == [5] + [10] * 9
+    assert db.max_in_flight == 3
+
+def test_committer_retries_and_raises():
+    db = FakeDB(failures=[Aborted("contention")])
+    async def run(committer):
+        async with committer:
+            await committer.set("a", {})
+    committer = aio.AsyncBatchCommitter(db, backoff=0.001)
+    asyncio.run(run(committer))
+    assert committer.retries == 1 and len(db.committed) == 1
+
+    db = FakeDB(failures=[InvalidArgument("bad")])
+    with pytest.raises(InvalidArgument):
+        asyncio.run(run(aio.AsyncBatchCommitter(db)))
+
+def test_write_documents(db, async_db):
+    documents = [{"__doc_id__": f"n{index}", "__data__": {"at": "2024-01-01T00:00:00+00:00"}} for index in range(7)]
+    assert asyncio.run(aio.write_documents(async_db, "new", documents, timestamp_convert=True, batch_size=3)) == 7
+    assert async_db._firestore_api.rpcs["commit"] == 3
+    assert ids(db, "new") == [f"n{index}" for index in range(7)]
+    assert db.collection("new").document("n0").get().to_dict()["at"].year == 2024
+
+def test_delete_documents_recursive(db, async_db):
+    deleted = asyncio.run(aio.delete_documents(async_db, "users", ["u00", "u01", "u10"], concurrency=2))
+    assert deleted == {0: 3, 1: 2}
+    assert "u00" not in ids(db, "users") and len(ids(db, "users")) == 47
+    assert ids(db, "users/u00/orders") == [] and ids(db, "users/u02/orders") == ["o"]
+
+def test_delete_query_documents(db, async_db):
+    deleted = asyncio.run(aio.delete_query_documents(async_db, "users", conditions=[parse_query_condition("age >= 2")], recursive=False))
+    assert deleted == {0: 48}
+    assert ids(db, "users") == ["u00", "u01"]
+
+def test_iter_async(async_db):
+    documents = aio.iter_async(aio.stream_documents(async_db, "users", parallel=2), size=4)
+    assert len(list(documents)) == 50
+
+def test_iter_async_stops_early_and_raises():
+    async def numbers():
+        for index in range(100):
+            yield index
+        raise ValueError("broken")
+    iterator = aio.iter_async(numbers(), size=2)
+    assert next(iterator) == 0
+    iterator.close()  # the background loop finishes instead of blocking on the full queue
+    with pytest.raises(ValueError):
+        list(aio.iter_async(numbers()))
+
+def test_iter_threaded_keeps_order_stops_early_and_raises():
+    def numbers():
+        yield from range(1000)
+        raise ValueError("broken")
+    async def take(count):
+        taken = []
+        async for number in aio.iter_threaded(numbers(), chunk_size=7, buffer_size=2):
+            taken.append(number)
+            if len(taken) == count:
+                break
+        return taken
+    assert asyncio.run(take(10)) == list(range(10))
+    with pytest.raises(ValueError):
+        asyncio.run(take(None))
@@ -0,0 +1,64 @@
+import gzip
+import json
+import math
+import os
+from datetime import datetime, timezone
+from unittest import mock
+
+import pytest
+from click.testing import CliRunner
+from google.cloud.firestore import GeoPoint
+from firebatch import cli, firestore_client, operations
+
+def test_backup_discovers_all_collections(source, tmp_path):
+    manifest = operations.backup_database(str(tmp_path), db=source, workers=4)
+    paths = [entry["path"] for entry in manifest["collections"]]
+    assert paths == ["groups", "users", "users/ghost/orders", "users/u1/orders", "users/ghost/orders/o2/items", "users/u1/orders/o1/items"]
+    assert manifest["documents"] == 24
+    assert json.loads((tmp_path / "manifest.json").read_text()) == manifest
+    entry = manifest["collections"][1]
+    with gzip.open(tmp_path / entry["file"], "rt") as file:
+        documents = [json.loads(line) for line in file]
+    assert len(documents) == entry["documents"] == 20
+    assert documents[0]["__data__"]["created"] == {"__timestamp__": "2024-01-01T00:00:00+00:00"}
+
+def test_restore_round_trip(source, destination, tmp_path):
+    operations.backup_database(str(tmp_path), db=source)
+    restored = operations.restore_database(str(tmp_path), db=destination, workers=4)
+    assert sum(restored.values()) == 24
+    data = destination.document("users/u3").get().to_dict()
+    assert data["created"] == datetime(2024, 1, 1, tzinfo=timezone.utc)
+    assert data["location"] == GeoPoint(52.5, 13.4)
+    assert data["friend"].path == "users/u4"
+    assert destination.document("users/ghost/orders/o2/items/i2").get().to_dict() == {"sku": "b"}
+
+def test_restore_non_finite_doubles(source, destination, tmp_path):
+    source.document("groups/admins").set({"v": math.nan, "w": math.inf, "x": -math.inf})
+    operations.backup_database(str(tmp_path), db=source, collections=["groups"])
+    operations.restore_database(str(tmp_path), db=destination)
+    data = destination.document("groups/admins").get().to_dict()
+    assert math.isnan(data["v"]) and data["w"] == math.inf and data["x"] == -math.inf
+
+def test_restore_selected_collections(source, destination, tmp_path):
+    operations.backup_database(str(tmp_path), db=source, collections=["groups", "users"])
+    assert operations.restore_database(str(tmp_path), db=destination, collections=["groups"]) == {"groups": 1}
+    assert not destination.document("users/u3").get().exists
+
+def test_damaged_backup_writes_nothing(source, destination, tmp_path):
+    manifest = operations.backup_database(str(tmp_path), db=source, compression=None)
+    path = tmp_path / manifest["collections"][0]["file"]
+    path.write_text(path.read_text().replace("2", "3"))
+    with pytest.raises(ValueError, match="checksum"):
+        operations.restore_database(str(tmp_path), db=destination)
+    assert destination._firestore_api.rpcs["commit"] == 0
+
+def test_restore_without_manifest(tmp_path):
+    result = CliRunner().invoke(cli.cli, ["restore", str(tmp_path)])
+    assert result.exit_code == 1
+    assert "manifest.json' is missing" in result.output
+
+def test_backup_cli(source, tmp_path):
+    with mock.patch.object(firestore_client, "initialize_firestore_client", return_value=source):
+        result = CliRunner().invoke(cli.cli, ["backup", str(tmp_path), "-c", "groups", "--compression", "none"])
+    assert result.exit_code == 0, result.output
+    assert os.listdir(tmp_path / "collections") == ["000000.jsonl"]
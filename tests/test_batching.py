@@ -0,0 +1,106 @@
+import threading
+import time
+
+import pytest
+from google.api_core.exceptions import Aborted, InvalidArgument, ResourceExhausted
+from firebatch.batching import BatchCommitter
+from firebatch.ratelimit import rate_controlled
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def set(self, doc_ref, data, merge=False):
+        self.writes.append(('set', doc_ref, data))
+
+    def update(self, doc_ref, data):
+        self.writes.append(('update', doc_ref, data))
+
+    def delete(self, doc_ref):
+        self.writes.append(('delete', doc_ref))
+
+    def commit(self):
+        self.db.commit(self.writes)
+
+class FakeDB:
+    def __init__(self, failures=(), latency=0.0):
+        self.failures = list(failures)
+        self.latency = latency
+        self.committed = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def commit(self, writes):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            failure = self.failures.pop(0) if self.failures else None
+        time.sleep(self.latency)
+        with self.lock:
+            self.in_flight -= 1
+        if failure:
+            raise failure
+        with self.lock:
+            self.committed.append(writes)
+
+def test_batches_are_split_by_batch_size():
+    db = FakeDB()
+    with BatchCommitter(db, batch_size=10) as committer:
+        for i in range(25):
+            committer.set(f"doc{i}", {"i": i})
+    assert sorted(len(writes) for writes in db.committed) == [5, 10, 10]
+    assert committer.committed_writes == 25
+    assert len(committer.latencies) == 3
+
+def test_in_flight_limit_is_respected():
+    db = FakeDB(latency=0.02)
+    with BatchCommitter(db, batch_size=1, max_in_flight=3) as committer:
+        for i in range(20):
+            committer.delete(f"doc{i}")
+    assert db.max_in_flight <= 3
+    assert len(db.committed) == 20
+
+def test_retryable_errors_are_retried():
+    db = FakeDB(failures=[Aborted("contention"), Aborted("contention")])
+    with BatchCommitter(db, batch_size=5, max_in_flight=1, backoff=0.001) as committer:
+        for i in range(5):
+            committer.update(f"doc{i}", {"i": i})
+    assert committer.retries == 2
+    assert len(db.committed) == 1 and len(db.committed[0]) == 5
+
+def test_other_errors_are_raised():
+    db = FakeDB(failures=[InvalidArgument("bad data")])
+    with pytest.raises(InvalidArgument):
+        with BatchCommitter(db, batch_size=5) as committer:
+            committer.set("doc", {})
+
+def test_dry_run_does_not_commit():
+    db = FakeDB()
+    with BatchCommitter(db, dry_run=True) as committer:
+        committer.set("doc", {})
+    assert db.committed == []
+    assert committer.committed_writes == 1
+
+def test_progress_only_advances_over_committed_batches():
+    db = FakeDB(latency=0.001)
+    progress = []
+    with BatchCommitter(db, batch_size=2, max_in_flight=4, on_progress=progress.append) as committer:
+        for i in range(1, 11):
+            committer.set(f"doc{i}", {})
+            committer.mark(i)
+    assert progress == sorted(progress)
+    assert progress[-1] == 10
+
+def test_committer_backs_off_on_quota_errors():
+    db = FakeDB(failures=[ResourceExhausted("quota")])
+    with rate_controlled(max_concurrency=4) as rate, BatchCommitter(db, batch_size=10, backoff=0.001) as committer:
+        for index in range(50):
+            committer.set(f"doc{index}", {"index": index})
+    assert sum(len(writes) for writes in db.committed) == 50
+    assert rate.backoffs == 1
+    assert "1 backoffs" in committer.report()
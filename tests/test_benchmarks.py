@@ -0,0 +1,30 @@
+import pytest
+from google.cloud.firestore_v1.base_query import FieldFilter
+from tests.fake_firestore import fake_client
+from benchmarks.run import compare, run
+
+def test_fake_client_queries():
+    db = fake_client()
+    users = db.collection("users")
+    for i in range(10):
+        users.document(f"u{i}").set({"n": i})
+    users.document("u1").collection("posts").document("p1").set({"n": 1})
+
+    assert [doc.id for doc in users.where(filter=FieldFilter("n", ">=", 8)).stream()] == ["u8", "u9"]
+    assert [doc.id for doc in users.order_by("n", direction="DESCENDING").limit(2).stream()] == ["u9", "u8"]
+    assert [doc.id for doc in users.order_by("__name__").start_after([users.document("u7")]).stream()] == ["u8", "u9"]
+    assert [doc.id for doc in db.collection_group("posts").stream()] == ["p1"]
+    assert [collection.id for collection in users.document("u1").collections()] == ["posts"]
+    assert len(list(db.collection_group("users").get_partitions(3))) == 3
+    assert db._firestore_api.rpcs["commit"] == 11
+
+@pytest.mark.parametrize("shape", ["flat", "nested"])
+def test_run_all_commands(shape):
+    report = run(["write", "read", "update", "delete"], [shape], [30], isolate=False, verbose=False)
+    results = {result["command"]: result for result in report["results"]}
+    assert set(results) == {"write", "read", "update", "delete"}
+    assert results["write"]["rpcs"] == {"commit": 1}
+    assert results["read"]["rpcs"] == {"run_query": 1}
+    assert results["delete"]["rpcs"]["list_collection_ids"] == 30
+    assert all(result["docs_per_second"] > 0 for result in results.values())
+    assert len(compare(report, report)) == 4
@@ -0,0 +1,86 @@
+import io
+import json
+from datetime import datetime, timezone
+
+import pytest
+from google.cloud.firestore import GeoPoint
+from firebatch import operations
+from firebatch.cache import SnapshotCache, _json_path_literal, matches
+
+def seed(db):
+    for index in range(10):
+        db.collection("users").document(f"u{index}").set({"age": index, "name": f"user {index}", "tags": ["even" if index % 2 == 0 else "odd"],
+                                                            "created": datetime(2024, 1, 1 + index, tzinfo=timezone.utc), "address": {"city": "Berlin"}})
+    db.collection("users").document("nameless").set({"age": "unknown"})
+
+def read(cache, max_staleness=3600, **kwargs):
+    output = io.StringIO()
+    operations.export_cached_documents(output, "users", False, cache, max_staleness, **kwargs)
+    return [json.loads(line) for line in output.getvalue().splitlines()]
+
+def test_repeated_reads_are_answered_from_the_cache(db, tmp_path):
+    with SnapshotCache(str(tmp_path)) as cache:
+        assert len(read(cache)) == 11
+        assert db._firestore_api.rpcs["run_query"] == 1
+        documents = read(cache, conditions=[("age", ">=", 7)])
+        assert [document["__doc_id__"] for document in documents] == ["u7", "u8", "u9"]
+        assert documents[0]["__data__"]["created"] == {"__timestamp__": "2024-01-08T00:00:00+00:00"}
+        assert [document["__doc_id__"] for document in read(cache, conditions=[("name", "==", "user 3")])] == ["u3"]
+        assert db._firestore_api.rpcs["run_query"] == 1
+
+        db.collection("users").document("u3").update({"name": "renamed"})
+        assert [document["__doc_id__"] for document in read(cache, conditions=[("name", "==", "user 3")])] == ["u3"]
+        assert read(cache, refresh=True, conditions=[("name", "==", "user 3")]) == []
+        assert db._firestore_api.rpcs["run_query"] == 2
+        read(cache, max_staleness=0)
+        assert db._firestore_api.rpcs["run_query"] == 3
+
+def test_order_limit_and_select(db, tmp_path):
+    with SnapshotCache(str(tmp_path)) as cache:
+        documents = read(cache, order_by="age", limit=3, select=["age", "address.city"], timestamp_convert=True)
+        # numbers sort before strings, like in firestore
+        assert documents == [{"__doc_id__": f"u{index}", "__data__": {"age": index, "address": {"city": "Berlin"}}} for index in range(3)]
+        assert read(cache, order_by="age", raw=True)[-1] == {"age": "unknown"}
+        assert read(cache, conditions=[("tags", "array-contains", "odd")], ids_only=True, limit=2) == [{"__doc_id__": "u1"}, {"__doc_id__": "u3"}]
+
+@pytest.mark.parametrize("field, operator, value, expected", [
+    ("age", "<", 3, True), ("age", "<", "3", False), ("age", "==", 2.0, True), ("age", "==", True, False),
+    ("age", "!=", 3, True), ("missing", "!=", 3, False), ("missing", "==", "null", False), ("none", "==", "null", True),
+    ("age", "in", "[1, 2]", True), ("age", "not-in", "[1, 2]", False), ("none", "not-in", "[1]", False),
+    ("tags", "array-contains", "a", True), ("tags", "array-contains-any", '["x", "b"]', True),
+    ("created", ">", "2024-01-01", False), ("address.city", "==", "Berlin", True), ("address", "==", "Berlin", False),
+])
+def test_conditions_follow_the_firestore_types(field, operator, value, expected):
+    data = {"age": 2, "none": None, "tags": ["a", "b"], "created": {"__timestamp__": "2024-01-02T00:00:00Z"}, "address": {"city": "Berlin"}}
+    assert matches(data, field, operator, value) is expected
+
+def test_least_recently_used_snapshots_are_evicted(tmp_path):
+    with SnapshotCache(str(tmp_path), max_bytes=1000) as cache:
+        document = json.dumps({"text": "x" * 300})
+        cache.store("a", [("a/1", "1", document)], read_time=1)
+        cache.store("b", [("b/1", "1", document)], read_time=1)
+        list(cache.query("a"))
+        cache.store("c", [("c/1", "1", document), ("c/2", "2", document)], read_time=1)
+        assert cache.age("a") is not None
+        assert cache.age("b") is None
+        assert cache.age("c") is not None
+
+def test_geopoints_are_converted_on_output(db, tmp_path):
+    db.collection("users").document("u0").update({"location": GeoPoint(52.5, 13.4)})
+    with SnapshotCache(str(tmp_path)) as cache:
+        assert read(cache, conditions=[("age", "==", 0)])[0]["__data__"]["location"] == {"__geopoint__": {"latitude": 52.5, "longitude": 13.4}}
+        assert read(cache, conditions=[("age", "==", 0)], geopoint_convert=True)[0]["__data__"]["location"] == {"latitude": 52.5, "longitude": 13.4}
+
+@pytest.mark.parametrize("field", ["it's", "a') OR 1=1 --", 'say "hi"'])
+def test_quoted_field_names(tmp_path, field):
+    with SnapshotCache(str(tmp_path)) as cache:
+        cache.store("s", [("s/1", "1", json.dumps({field: "x"})), ("s/2", "2", json.dumps({field: "y"}))], read_time=1)
+        assert [doc_id for _, doc_id, _ in cache.query("s", [(field, "==", "x")])] == ["1"]
+
+def test_queries_use_the_field_index(tmp_path):
+    with SnapshotCache(str(tmp_path)) as cache:
+        cache.store("s", [("s/1", "1", json.dumps({"it's": "x"}))], read_time=1)
+        list(cache.query("s", [("it's", "==", "x")]))
+        path = _json_path_literal("it's")
+        plan = cache._connection.execute(f"EXPLAIN QUERY PLAN SELECT path FROM documents WHERE snapshot = 's' AND json_extract(data, {path}) = 'x'").fetchall()
+        assert "documents_field_it_s" in str(plan)
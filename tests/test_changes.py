@@ -0,0 +1,64 @@
+import io
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from google.cloud.firestore import GeoPoint
+from tests.fake_firestore import fake_client
+from firebatch import operations
+from firebatch.changes import canonical_hash
+
+def test_canonical_hash_ignores_key_order():
+    assert canonical_hash({"a": 1, "b": {"c": [1, 2], "d": None}}) == canonical_hash({"b": {"d": None, "c": [1, 2]}, "a": 1})
+    assert canonical_hash({"a": [1, 2]}) != canonical_hash({"a": [2, 1]})
+
+@pytest.mark.parametrize("value, other", [(1, 1.0), (1, True), (1, "1"), ({"a": 1}, [["a", 1]]), (b"a", "61")])
+def test_canonical_hash_distinguishes_types(value, other):
+    assert canonical_hash(value) != canonical_hash(other)
+
+def test_canonical_hash_of_firestore_types():
+    moment = datetime(2024, 1, 1, 12, tzinfo=timezone.utc)
+    assert canonical_hash(moment) == canonical_hash(moment.astimezone(timezone(timedelta(hours=2))))
+    assert canonical_hash(GeoPoint(1.5, 2.5)) == canonical_hash(GeoPoint(1.5, 2.5))
+    db = fake_client()
+    assert canonical_hash(db.document("users/a")) != canonical_hash(db.document("users/b"))
+
+def seed(db):
+    for index in range(10):
+        db.collection("users").document(f"u{index}").set({"name": f"user {index}", "tags": ["a"], "address": {"city": "Berlin"}})
+
+def jsonl(documents):
+    return io.StringIO("".join(json.dumps(document) + "\n" for document in documents))
+
+def test_write_only_changed(db):
+    documents = [{"__doc_id__": f"u{index}", "__data__": {"address": {"city": "Berlin"}, "tags": ["a"], "name": f"user {index}"}} for index in range(10)]
+    documents[3]["__data__"]["name"] = "renamed"
+    documents.append({"__doc_id__": "new", "__data__": {"name": "new"}})
+    operations.write_documents("users", jsonl(documents), timestamp_field="written", only_changed=True)
+    assert db._firestore_api.rpcs["batch_get_documents"] == 1
+    assert db._firestore_api.rpcs["commit"] == 1
+    assert db.collection("users").document("u3").get().get("name") == "renamed"
+    assert db.collection("users").document("new").get().exists
+    # the timestamp field is not compared, so the unchanged documents keep theirs
+    assert "written" not in db.collection("users").document("u0").get().to_dict()
+
+    db._firestore_api.reset()
+    operations.write_documents("users", jsonl(documents), timestamp_field="written", only_changed=True)
+    assert db._firestore_api.rpcs["commit"] == 0
+
+def test_update_only_changed(db):
+    updated_at = db.collection("users").document("u1").get().update_time
+    updates = [{"__doc_id__": "u1", "__data__": {"name": "user 1"}}, {"__doc_id__": "u2", "__data__": {"address.city": "Paris"}}]
+    operations.update_documents_in_firestore("users", updates, only_changed=True)
+    assert db._firestore_api.rpcs["commit"] == 1
+    assert db.collection("users").document("u1").get().update_time == updated_at
+    assert db.collection("users").document("u2").get().get("address.city") == "Paris"
+
+def test_update_query_only_changed(db):
+    db.collection("users").document("u5").update({"status": "active"})
+    updated_at = db.collection("users").document("u5").get().update_time
+    db._firestore_api.reset()
+    operations.update_query_documents("users", {"status": "active"}, only_changed=True)
+    assert db._firestore_api.rpcs["commit"] == 1
+    assert db.collection("users").document("u5").get().update_time == updated_at
+    assert sum(1 for doc in db.collection("users").stream() if doc.get("status") == "active") == 10
@@ -0,0 +1,45 @@
+import os
+
+import pytest
+from firebatch.checkpoint import Checkpoint
+
+def test_checkpoint_resume(tmp_path):
+    path = str(tmp_path / "progress.json")
+    checkpoint = Checkpoint(path, "write", "users")
+    assert not checkpoint.resumed
+    checkpoint.save(position=500)
+    assert not checkpoint.resumed  # saving progress does not make a fresh run a resumed one
+
+    resumed = Checkpoint(path, "write", "users")
+    assert resumed.resumed
+    assert resumed.get("position") == 500
+
+def test_checkpoint_positions(tmp_path):
+    path = str(tmp_path / "progress.json")
+    Checkpoint(path, "read", "users").save_positions({0: ("users/a", None), 3: ("users/x", {"age": 3})}, count=2)
+    checkpoint = Checkpoint(path, "read", "users")
+    assert checkpoint.get("positions") == {"0": {"path": "users/a", "cursor": None}, "3": {"path": "users/x", "cursor": {"age": 3}}}
+    assert checkpoint.get("count") == 2
+
+def test_checkpoint_of_other_command(tmp_path):
+    path = str(tmp_path / "progress.json")
+    Checkpoint(path, "write", "users").save(position=1)
+    with pytest.raises(ValueError, match="belongs to 'write users'"):
+        Checkpoint(path, "delete", "users")
+
+def test_checkpoint_complete(tmp_path):
+    path = str(tmp_path / "progress.json")
+    checkpoint = Checkpoint(path, "write", "users")
+    checkpoint.save(position=1)
+    checkpoint.complete()
+    assert not os.path.exists(path)
+
+def test_checkpoint_shards(tmp_path):
+    path = str(tmp_path / "progress.json")
+    checkpoint = Checkpoint(path, "write", "users")
+    checkpoint.save_shard("part-00000.jsonl", 500)
+    checkpoint.save_shard("part-00001.jsonl", 20, done=True)
+    assert Checkpoint(path, "write", "users").get("shards") == {
+        "part-00000.jsonl": {"position": 500, "done": False},
+        "part-00001.jsonl": {"position": 20, "done": True},
+    }
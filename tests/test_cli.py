@@ -0,0 +1,54 @@
+from unittest import mock
+
+import pytest
+from click.testing import CliRunner
+from tests.fake_firestore import fake_client
+from firebatch import firestore_client
+from firebatch.cli import cli, parse_script
+
+@pytest.fixture
+def db():
+    db = fake_client()
+    for index in range(5):
+        db.collection("users").document(f"u{index}").set({"age": index})
+    created = []
+    def create(credentials, project):
+        created.append(db)
+        return db
+    with mock.patch.object(firestore_client.pool, "credentials", return_value=(None, None)), \
+         mock.patch.object(firestore_client.pool, "_create", side_effect=create):
+        yield created
+
+def test_parse_script():
+    lines = ["# backup", "", "firebatch read -c users -w 'name == Ann Lee'  # quoted", "count -c users"]
+    assert list(parse_script(lines)) == [(3, ["read", "-c", "users", "-w", "name == Ann Lee"]), (4, ["count", "-c", "users"])]
+
+def test_run_script_shares_the_client(db, tmp_path):
+    script = tmp_path / "script.txt"
+    script.write_text(f"read -c users -o {tmp_path / 'users.jsonl'}\nwrite -c copy {tmp_path / 'users.jsonl'}\ncount -c copy\n")
+    result = CliRunner().invoke(cli, ["run", str(script)])
+    assert result.exit_code == 0, result.output
+    assert result.stdout.strip() == '{"count": 5}'
+    assert len(db) == 1
+
+def test_run_stops_at_the_first_failure(db, tmp_path):
+    result = CliRunner().invoke(cli, ["run"], input=f"write -c copy {tmp_path / 'missing.jsonl'}\ncount -c users\n")
+    assert result.exit_code == 1 and '"count"' not in result.stdout
+    assert "Stopped at line 1" in result.output
+
+def test_run_keep_going_after_an_exit(db, tmp_path):
+    updates = tmp_path / "updates.jsonl"
+    updates.write_text('{"__doc_id__": "u1", "__data__": {"age": 2}}\n' * 2)
+    result = CliRunner().invoke(cli, ["run", "--keep-going"], input=f"update -c users {updates}\ncount -c users\n")
+    assert result.exit_code == 1 and '{"count": 5}' in result.stdout
+    assert "1 of 2 commands failed" in result.output
+
+def test_run_checks_all_commands_first(db):
+    result = CliRunner().invoke(cli, ["run"], input="count -c users\nrun other.txt\n")
+    assert result.exit_code == 2 and "line 2" in result.output
+    assert '"count"' not in result.stdout
+
+def test_run_checks_all_options_first(db):
+    result = CliRunner().invoke(cli, ["run"], input="count -c users\ncount -c users -w bad\n")
+    assert result.exit_code == 2 and "line 2" in result.output
+    assert '"count"' not in result.stdout
@@ -0,0 +1,102 @@
+import io
+import json
+from datetime import timezone
+
+import pytest
+pa = pytest.importorskip("pyarrow")
+import pyarrow.parquet as pq
+
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+from google.cloud.firestore_v1 import GeoPoint
+from firebatch import operations
+from firebatch.columnar import EXTRA_COLUMN, arrow_schema, detect_format, infer_schema_spec, iter_columnar_documents, write_columnar_stream
+
+def documents(db):
+    created = DatetimeWithNanoseconds(2024, 1, 2, 3, 4, 5, 123456, tzinfo=timezone.utc)
+    return [
+        {"__doc_id__": "a", "__data__": {"name": "Ann", "age": 31, "created": created, "location": GeoPoint(1.5, 2.5),
+                                         "owner": db.document("users/a"), "tags": ["x", "y"], "address": {"city": "Graz", "zip": 8010}}},
+        {"__doc_id__": "b", "__data__": {"name": "Bob", "age": "unknown", "nickname": None, "address": {"city": None}}},
+        {"__doc_id__": "c", "__data__": {"name": "Cid", "visits": [{"at": created}], "address": {"city": "Wien", "zip": 1010, "floor": 2}}},
+    ]
+
+def _plain(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    if isinstance(value, GeoPoint):
+        return [value.latitude, value.longitude]
+    return value.path
+
+def comparable(document):
+    return json.loads(json.dumps(document, default=_plain))
+
+@pytest.mark.parametrize("format", ["parquet", "arrow"])
+@pytest.mark.parametrize("row_group_size", [1, 2, 100])
+def test_round_trip_is_lossless(db, format, row_group_size):
+    output = io.BytesIO()
+    assert write_columnar_stream(output, documents(db), format, row_group_size=row_group_size) == 3
+    output.seek(0)
+    restored = list(iter_columnar_documents(output, format, db))
+    assert [comparable(document) for document in restored] == [comparable(document) for document in documents(db)]
+    assert isinstance(restored[0]["__data__"]["location"], GeoPoint)
+    assert restored[0]["__data__"]["owner"].path == "users/a"
+
+def test_native_column_types(db):
+    output = io.BytesIO()
+    # the schema is inferred from the first row group, the first document here
+    write_columnar_stream(output, documents(db), "parquet", row_group_size=1)
+    table = pq.read_table(io.BytesIO(output.getvalue()))
+    schema = table.schema
+    assert schema.field("created").type == pa.timestamp("us", tz="UTC")
+    assert schema.field("age").type == pa.int64()
+    assert pa.types.is_struct(schema.field("location").type)
+    assert schema.field("owner").type == pa.string()
+    assert schema.field("tags").type == pa.list_(pa.string())
+    # values that do not fit the inferred columns are kept as json
+    assert json.loads(table.column(EXTRA_COLUMN)[1].as_py()) == {"age": "unknown", "nickname": None, "address": {"city": None}}
+
+def test_row_groups_are_written_incrementally(db):
+    output = io.BytesIO()
+    write_columnar_stream(output, ({"__doc_id__": str(index), "__data__": {"index": index}} for index in range(25)), "parquet", row_group_size=10)
+    assert pq.ParquetFile(io.BytesIO(output.getvalue())).num_row_groups == 3
+
+def test_schema_spec(db):
+    spec = {"name": "string", "age": "float64", "tags": ["string"], "address": "json"}
+    output = io.BytesIO()
+    write_columnar_stream(output, documents(db), "parquet", spec=spec)
+    schema = pq.read_schema(io.BytesIO(output.getvalue()))
+    assert schema.names == ["__doc_id__", "name", "age", "tags", "address", EXTRA_COLUMN]
+    output.seek(0)
+    restored = list(iter_columnar_documents(output, "parquet", db))
+    assert comparable(restored[2]) == comparable(documents(db)[2])
+
+def test_infer_schema_spec():
+    assert infer_schema_spec([{"a": 1, "b": None, "c": [1]}, {"a": 1.5, "b": "x", "c": [2.5], "d": {}}]) == \
+        {"a": "float64", "b": "string", "c": ["float64"], "d": "json"}
+    assert infer_schema_spec([{"a": 1}, {"a": "x"}]) == {"a": "json"}
+
+def test_invalid_schema_spec():
+    with pytest.raises(ValueError, match="Unknown type"):
+        arrow_schema({"a": "integer"})
+
+def test_empty_export(db):
+    output = io.BytesIO()
+    assert write_columnar_stream(output, [], "arrow") == 0
+    output.seek(0)
+    assert list(iter_columnar_documents(output, "arrow", db)) == []
+
+def test_detect_format():
+    assert detect_format("users.parquet") == "parquet"
+    assert detect_format("users.feather") == "arrow"
+    assert detect_format("users.jsonl") is None and detect_format(None) is None
+
+def test_write_imports_parquet(db, tmp_path):
+    path = tmp_path / "users.parquet"
+    with open(path, "wb") as file:
+        write_columnar_stream(file, documents(db), "parquet")
+    with open(path) as file:
+        operations.write_documents("imported", file)
+    snapshots = {doc.id: doc.to_dict() for doc in db.collection("imported").stream()}
+    assert sorted(snapshots) == ["a", "b", "c"]
+    assert snapshots["a"]["location"] == GeoPoint(1.5, 2.5)
+    assert snapshots["b"] == {"name": "Bob", "age": "unknown", "nickname": None, "address": {"city": None}}
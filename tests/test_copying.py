@@ -0,0 +1,39 @@
+from datetime import datetime, timezone
+
+from click.testing import CliRunner
+from google.cloud.firestore import GeoPoint
+from firebatch import cli, operations
+
+def test_copy_keeps_the_native_values(source, destination):
+    copied = operations.copy_collection_documents("users", "users", source, destination, parallel=4)
+    assert copied == {0: 20}
+    data = destination.collection("users").document("u3").get().to_dict()
+    assert data["age"] == 3
+    assert data["created"] == datetime(2024, 1, 1, tzinfo=timezone.utc)
+    assert data["location"] == GeoPoint(52.5, 13.4)
+    assert destination._firestore_api.rpcs["commit"] == 1
+    assert not destination.collection("users").document("u1").collection("orders").document("o1").get().exists
+
+def test_copy_recursive_with_rewritten_references(source, destination):
+    copied = operations.copy_collection_documents("users", "people", source, destination, recursive=True, rewrite_references=True)
+    assert copied == {0: 20, 1: 1, 2: 2}
+    assert destination.document("people/u1/orders/o1/items/i1").get().to_dict() == {"sku": "a"}
+    assert destination.document("people/ghost/orders/o2/items/i2").get().to_dict() == {"sku": "b"}
+    assert not destination.document("people/ghost").get().exists
+    data = destination.collection("people").document("u3").get().to_dict()
+    assert data["friend"].path == "people/u4"
+    assert data["group"].path == "groups/admins"
+
+def test_copy_query(source, destination):
+    copied = operations.copy_collection_documents("users", "adults", source, destination, conditions=[("age", ">=", 18)], limit=1)
+    assert copied == {0: 1}
+    assert [doc.id for doc in destination.collection("adults").stream()] == ["u18"]
+
+def test_copy_dry_run(source, destination):
+    assert operations.copy_collection_documents("users", "users", source, destination, dry_run=True) == {0: 20}
+    assert destination._firestore_api.rpcs["commit"] == 0
+
+def test_copy_onto_itself_is_rejected():
+    result = CliRunner().invoke(cli.cli, ["copy", "--src", "users", "--dst", "users/"])
+    assert result.exit_code == 2
+    assert "same collection" in result.output
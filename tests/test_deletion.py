@@ -0,0 +1,67 @@
+from firebatch.deletion import bounded_map, delete_collection_recursive, delete_documents_recursive
+from concurrent.futures import ThreadPoolExecutor
+
+class FakeCollection:
+    def __init__(self, path, documents):
+        self.path = path
+        self.documents = documents
+
+    def list_documents(self, page_size=None):
+        return iter(self.documents)
+
+class FakeDocument:
+    def __init__(self, path, subcollections=()):
+        self.path = path
+        self.subcollections = list(subcollections)
+        self.probed = False
+
+    def collections(self):
+        self.probed = True
+        return iter(self.subcollections)
+
+class FakeCommitter:
+    def __init__(self):
+        self.deleted = []
+        self.positions = []
+
+    def delete(self, doc_ref):
+        self.deleted.append(doc_ref.path)
+
+    def mark(self, position):
+        self.positions.append(position)
+
+def make_tree():
+    comments = FakeCollection("users/a/posts/p1/comments", [FakeDocument("users/a/posts/p1/comments/c1")])
+    posts = FakeCollection("users/a/posts", [FakeDocument("users/a/posts/p1", [comments]), FakeDocument("users/a/posts/p2")])
+    return [FakeDocument("users/a", [posts]), FakeDocument("users/b")]
+
+def test_delete_documents_recursive_walks_levels():
+    committer = FakeCommitter()
+    deleted_per_level = delete_documents_recursive(make_tree(), committer, workers=2)
+    assert deleted_per_level == {0: 2, 1: 2, 2: 1}
+    assert sorted(committer.deleted) == sorted([
+        "users/a", "users/b", "users/a/posts/p1", "users/a/posts/p2", "users/a/posts/p1/comments/c1",
+    ])
+
+def test_delete_documents_without_recursion_skips_probe():
+    committer = FakeCommitter()
+    documents = make_tree()
+    assert delete_documents_recursive(documents, committer, recursive=False) == {0: 2}
+    assert not any(doc.probed for doc in documents)
+
+def test_delete_collection_recursive():
+    committer = FakeCommitter()
+    collection = FakeCollection("users", make_tree())
+    assert delete_collection_recursive(collection, committer) == {0: 2, 1: 2, 2: 1}
+
+def test_bounded_map_keeps_order():
+    with ThreadPoolExecutor(4) as executor:
+        assert list(bounded_map(executor, lambda x: x * 2, range(100), 3)) == [x * 2 for x in range(100)]
+
+def test_delete_documents_recursive_resumes_after_skip():
+    committer = FakeCommitter()
+    deleted_per_level = delete_documents_recursive(make_tree(), committer, skip=1, workers=2)
+    # the skipped document is not deleted again, but its subcollections still are
+    assert deleted_per_level == {0: 1, 1: 2, 2: 1}
+    assert "users/a" not in committer.deleted
+    assert committer.positions == [2]
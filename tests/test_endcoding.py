@@ -0,0 +1,111 @@
+import json
+import math
+from io import StringIO
+
+import pytest
+from datetime import datetime, timezone
+from google.cloud.firestore_v1 import ArrayRemove, ArrayUnion, DELETE_FIELD, GeoPoint, Increment, SERVER_TIMESTAMP
+from firebatch.endcoding import convert_to_firestore_types, document_encoder, expand_field_paths, field_path_tree, is_iso_timestamp, parse_timestamp, to_json, write_json_stream
+
+DOCUMENTS = [
+    {"__doc_id__": "a", "__data__": {"name": "Test Name 1", "tags": ["x", "y"], "nested": {"value": 10}}},
+    {"__doc_id__": "b", "__data__": {"name": "multi\nline", "tags": [], "nested": {}}},
+]
+
+@pytest.mark.parametrize("documents", [DOCUMENTS, DOCUMENTS[:1], []])
+def test_write_json_stream_matches_to_json(documents):
+    output = StringIO()
+    count = write_json_stream(output, iter(documents), 'json')
+    assert count == len(documents)
+    assert output.getvalue() == to_json(documents, 2)
+
+def test_write_json_stream_jsonl():
+    output = StringIO()
+    count = write_json_stream(output, iter(DOCUMENTS), 'jsonl')
+    lines = output.getvalue().splitlines()
+    assert count == len(lines) == len(DOCUMENTS)
+    assert [json.loads(line) for line in lines] == DOCUMENTS
+
+@pytest.mark.parametrize("indent", [None, 2])
+def test_document_encoder_keeps_non_finite_doubles(indent):
+    document = {"x": math.nan, "y": math.inf, "nested": [{"z": -math.inf}], "none": None}
+    decoded = json.loads(document_encoder(indent)(document))
+    assert math.isnan(decoded["x"]) and decoded["y"] == math.inf and decoded["nested"] == [{"z": -math.inf}]
+    assert decoded["none"] is None
+
+def test_write_json_stream_is_lazy():
+    output = StringIO()
+
+    def documents():
+        yield DOCUMENTS[0]
+        # the first document must already be written before the next one is requested
+        assert output.getvalue()
+        yield DOCUMENTS[1]
+
+    write_json_stream(output, documents(), 'jsonl')
+
+@pytest.mark.parametrize("value, expected", [
+    ("2024-01-02T03:04:05Z", datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)),
+    ("2024-01-02T03:04:05.123456789Z", datetime(2024, 1, 2, 3, 4, 5, 123456, tzinfo=timezone.utc)),
+    ("2024-01-02T03:04:05.5+00:00", datetime(2024, 1, 2, 3, 4, 5, 500000, tzinfo=timezone.utc)),
+    ("2024-01-02T03:04:05", datetime(2024, 1, 2, 3, 4, 5)),
+])
+def test_parse_timestamp(value, expected):
+    assert is_iso_timestamp(value)
+    assert parse_timestamp(value) == expected
+
+@pytest.mark.parametrize("value", ["", "hello world", "2024-01-02", "2024-13-02T03:04:05Z", "x" * 25])
+def test_is_not_iso_timestamp(value):
+    assert not is_iso_timestamp(value)
+
+def test_convert_to_firestore_types():
+    data = {"created": "2024-01-02T03:04:05Z", "place": {"latitude": 1.0, "longitude": 2.0},
+            "wrapped": [{"__timestamp__": "2024-01-02T03:04:05+00:00"}, {"__geopoint__": {"latitude": 3.0, "longitude": 4.0}}],
+            "name": "2024"}
+    converted = convert_to_firestore_types(None, data, True, True)
+    assert converted["created"] == datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+    assert converted["place"] == GeoPoint(1.0, 2.0)
+    assert converted["wrapped"] == [datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc), GeoPoint(3.0, 4.0)]
+    assert converted["name"] == "2024"
+
+def test_field_path_tree():
+    assert field_path_tree(["a.b", "c", "a.d.e"]) == {"a": {"b": None, "d": {"e": None}}, "c": None}
+    assert field_path_tree(["a", "a.b"]) == {"a": None}
+
+def test_convert_only_field_paths():
+    data = {"created": "2024-01-02T03:04:05Z", "other": "2024-01-02T03:04:05Z",
+            "items": [{"at": "2024-01-02T03:04:05Z", "note": "2024-01-02T03:04:05Z"}]}
+    converted = convert_to_firestore_types(None, data, True, False, field_path_tree(["created", "items.at"]))
+    assert isinstance(converted["created"], datetime)
+    assert converted["other"] == data["other"]
+    assert isinstance(converted["items"][0]["at"], datetime)
+    assert converted["items"][0]["note"] == data["items"][0]["note"]
+
+def test_convert_transforms():
+    data = {"visits": {"__increment__": 1}, "stats": {"score": {"__increment__": -2.5}},
+            "tags": {"__array_union__": ["new", {"__timestamp__": "2024-01-02T03:04:05+00:00"}]}, "old": {"__array_remove__": ["x"]},
+            "seen": {"__server_timestamp__": True}, "legacy": {"__delete_field__": True}}
+    converted = convert_to_firestore_types(None, data, False, False, transforms=True)
+    assert converted["visits"] == Increment(1) and converted["stats"]["score"] == Increment(-2.5)
+    assert converted["tags"] == ArrayUnion(["new", datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)])
+    assert converted["old"] == ArrayRemove(["x"])
+    assert converted["seen"] is SERVER_TIMESTAMP and converted["legacy"] is DELETE_FIELD
+    with pytest.raises(ValueError, match="list of values"):
+        convert_to_firestore_types(None, {"tags": {"__array_union__": "new"}}, False, False, transforms=True)
+
+def test_convert_transforms_outside_field_paths():
+    data = {"created": "2024-01-02T03:04:05Z", "other": "2024-01-02T03:04:05Z", "stats": {"views": {"__increment__": 1}}}
+    converted = convert_to_firestore_types(None, data, True, False, field_path_tree(["created"]), transforms=True)
+    assert isinstance(converted["created"], datetime) and converted["other"] == data["other"]
+    assert converted["stats"]["views"] == Increment(1)
+
+def test_convert_keeps_transform_markers_literal():
+    # written and restored data is stored as it is, only updates apply transforms
+    data = {"visits": {"__increment__": 1}, "seen": {"__server_timestamp__": True}}
+    assert convert_to_firestore_types(None, data, False, False) == data
+    assert convert_to_firestore_types(None, data, False, False, field_path_tree(["visits"])) == data
+
+def test_expand_field_paths():
+    assert expand_field_paths({"a.b": 1, "a.c.d": 2, "e": {"f": 3}, "e.g": 4, "`h.i`": 5}) == {"a": {"b": 1, "c": {"d": 2}}, "e": {"f": 3, "g": 4}, "h.i": 5}
+    with pytest.raises(ValueError, match="conflicts"):
+        expand_field_paths({"a": 1, "a.b": 2})
@@ -0,0 +1,96 @@
+import gzip
+import json
+import os
+
+import pytest
+from firebatch.fileio import detect_compression, expand_paths, open_input, open_output, parse_size, shard_name, write_shards
+from firebatch.utils import iter_documents
+
+DOCUMENTS = [{"__doc_id__": str(i), "__data__": {"value": i, "text": "x" * i}} for i in range(20)]
+
+def write_jsonl(shard, documents) -> int:
+    count = 0
+    for document in documents:
+        shard.write(json.dumps(document) + "\n")
+        count += 1
+    return count
+
+@pytest.mark.parametrize("name, compression", [("a.jsonl", None), ("a.jsonl.gz", "gzip"), ("a.json.zst", "zstd"), (None, None)])
+def test_detect_compression(name, compression):
+    assert detect_compression(name) == compression
+
+def test_gzip_roundtrip(tmp_path):
+    path = str(tmp_path / "docs.jsonl.gz")
+    with open_output(path) as output:
+        write_jsonl(output, DOCUMENTS[:10])
+    # a resumed export appends a second gzip member
+    with open_output(path, append=True) as output:
+        write_jsonl(output, DOCUMENTS[10:])
+    with gzip.open(path, "rt") as file:
+        assert len(file.readlines()) == len(DOCUMENTS)
+    with open_input(path) as file:
+        assert list(iter_documents(file)) == DOCUMENTS
+
+def test_zstd_roundtrip(tmp_path):
+    pytest.importorskip("zstandard")
+    path = str(tmp_path / "docs.jsonl.zst")
+    with open_output(path) as output:
+        write_jsonl(output, DOCUMENTS[:10])
+    with open_output(path, append=True) as output:
+        write_jsonl(output, DOCUMENTS[10:])
+    with open_input(path) as file:
+        assert list(iter_documents(file)) == DOCUMENTS
+
+def test_uncompressed_file(tmp_path):
+    path = str(tmp_path / "docs.jsonl")
+    with open_output(path, "none") as output:
+        write_jsonl(output, DOCUMENTS)
+    with open_input(path) as file:
+        assert file.buffer.seekable()  # parquet and arrow are read from the buffer
+        assert list(iter_documents(file)) == DOCUMENTS
+
+def test_expand_paths(tmp_path):
+    for index in (2, 0, 1):
+        (tmp_path / shard_name(index, "jsonl")).write_text("")
+    assert expand_paths([str(tmp_path / "part-*.jsonl"), "-"]) == [str(tmp_path / shard_name(index, "jsonl")) for index in range(3)] + ["-"]
+    with pytest.raises(FileNotFoundError):
+        expand_paths([str(tmp_path / "*.parquet")])
+
+@pytest.mark.parametrize("value, size", [("512", 512), ("64k", 64 * 1024), ("100MB", 100 * 1024 ** 2), ("1.5G", int(1.5 * 1024 ** 3))])
+def test_parse_size(value, size):
+    assert parse_size(value) == size
+
+def test_parse_size_invalid():
+    with pytest.raises(ValueError):
+        parse_size("a lot")
+
+def test_write_shards_by_count(tmp_path):
+    paths = []
+    def open_shard(sequence):
+        paths.append(str(tmp_path / shard_name(0, "jsonl.gz", sequence)))
+        return open_output(paths[-1])
+    assert write_shards(iter(DOCUMENTS), open_shard, write_jsonl, max_documents=6) == len(DOCUMENTS)
+    assert [path.rsplit("/", 1)[1] for path in paths] == [f"part-00000-0000{i}.jsonl.gz" for i in range(4)]
+    shards = []
+    for path in paths:
+        with open_input(path) as file:
+            shards.append(list(iter_documents(file)))
+    assert [len(shard) for shard in shards] == [6, 6, 6, 2]
+    assert [document for shard in shards for document in shard] == DOCUMENTS
+
+def test_write_shards_by_size(tmp_path):
+    paths = []
+    def open_shard(sequence):
+        paths.append(str(tmp_path / shard_name(0, "jsonl", sequence)))
+        return open_output(paths[-1])
+    documents = [{"__doc_id__": str(i), "__data__": {"text": "x" * 20000}} for i in range(10)]
+    assert write_shards(documents, open_shard, write_jsonl, max_bytes=50000) == len(documents)
+    # the size is checked between documents, so a shard ends with the document that crosses the limit
+    assert len(paths) == 4
+    assert all(os.path.getsize(path) <= 50000 + 20100 for path in paths)
+
+def test_write_shards_without_documents(tmp_path):
+    path = str(tmp_path / shard_name(0, "jsonl"))
+    assert write_shards([], lambda sequence: open_output(path), write_jsonl) == 0
+    with open(path) as file:
+        assert file.read() == ""
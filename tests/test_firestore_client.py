@@ -0,0 +1,64 @@
+import subprocess
+import sys
+from unittest import mock
+
+import pytest
+from google.auth.credentials import AnonymousCredentials
+from benchmarks.importtime import import_times, lazy_modules_imported
+from firebatch.firestore_client import ClientPool, LazyClient
+
+class FakeClient:
+    def collection(self, name):
+        return f"collection {name}"
+
+def test_lazy_client_is_created_on_first_use():
+    created = []
+    def factory():
+        created.append(FakeClient())
+        return created[-1]
+
+    db = LazyClient(factory)
+    assert not db.initialized and created == []
+    assert db.collection("users") == "collection users"
+    assert db.collection("orders") == "collection orders"
+    assert db.initialized and len(created) == 1
+    assert db.client is created[0]
+
+def test_cli_import_does_not_load_heavy_modules():
+    assert lazy_modules_imported(import_times("firebatch.cli")) == []
+
+def test_help_without_firestore():
+    result = subprocess.run([sys.executable, "-m", "firebatch", "read", "--help"], capture_output=True, text=True)
+    assert result.returncode == 0 and "--collection" in result.stdout
+
+@pytest.fixture
+def anonymous_pool():
+    pool = ClientPool(size=2, channel_options={"grpc.keepalive_time_ms": 10000})
+    with mock.patch.object(pool, "credentials", return_value=(AnonymousCredentials(), "firebatch-test")):
+        yield pool
+    pool.close()
+
+def test_pool_reuses_clients_round_robin(anonymous_pool):
+    first, second, third = anonymous_pool.get(), anonymous_pool.get(), anonymous_pool.get()
+    assert first is not second and third is first
+
+def test_client_uses_the_channel_with_the_options(anonymous_pool):
+    # fails when the installed client library no longer takes the GAPIC client _connect hands to it
+    from google.cloud.firestore_v1.services.firestore.transports.grpc import FirestoreGrpcTransport
+    create_channel = FirestoreGrpcTransport.create_channel
+    channels = []
+    def record(*args, **kwargs):
+        channels.append((create_channel(*args, **kwargs), dict(kwargs["options"])))
+        return channels[-1][0]
+    with mock.patch.object(FirestoreGrpcTransport, "create_channel", side_effect=record):
+        client = anonymous_pool.get()
+        channel = client._firestore_api.transport.grpc_channel
+    assert len(channels) == 1 and channels[0][0] is channel
+    assert channels[0][1]["grpc.keepalive_time_ms"] == 10000 and channels[0][1]["grpc.max_receive_message_length"] == -1
+
+def test_pool_configure_replaces_clients(anonymous_pool):
+    client = anonymous_pool.get()
+    anonymous_pool.configure(size=1)
+    assert anonymous_pool.get() is not client
+    with pytest.raises(ValueError):
+        anonymous_pool.configure(size=0)
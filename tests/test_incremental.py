@@ -0,0 +1,74 @@
+import io
+import json
+from datetime import datetime, timezone
+from unittest import mock
+
+import pytest
+from firebatch import operations
+from firebatch.incremental import Watermark, merge_documents
+
+def export(watermark, **kwargs):
+    output = io.StringIO()
+    operations.export_changed_documents(output, "users", False, watermark, **kwargs)
+    return [json.loads(line) for line in output.getvalue().splitlines()]
+
+def at(hour):
+    return datetime(2024, 1, 1, hour, tzinfo=timezone.utc)
+
+def seed(db):
+    for index in range(5):
+        db.collection("users").document(f"u{index}").set({"name": f"user {index}", "updated": at(index)})
+
+def test_update_time_watermark(db, tmp_path):
+    path = str(tmp_path / "users.watermark")
+    assert len(export(Watermark(path, "users"))) == 5
+    # unchanged documents are read, but not exported
+    assert export(Watermark(path, "users")) == [{"__doc_id__": "u4", "__data__": {"name": "user 4", "updated": {"__timestamp__": at(4).isoformat()}}}]
+    db.collection("users").document("u1").update({"name": "changed"})
+    db.collection("users").document("u9").set({"name": "new"})
+    # u4 holds the watermark itself and is exported again
+    assert sorted(document["__doc_id__"] for document in export(Watermark(path, "users"))) == ["u1", "u4", "u9"]
+    assert sorted(document["__doc_id__"] for document in export(Watermark(path, "users"))) == ["u9"]
+
+def test_field_watermark_is_filtered_on_the_server(db, tmp_path):
+    path = str(tmp_path / "users.watermark")
+    assert len(export(Watermark(path, "users", "updated"))) == 5
+    with open(path) as file:
+        assert json.load(file)["value"] == {"__timestamp__": at(4).isoformat()}
+
+    db.collection("users").document("u2").update({"name": "changed", "updated": at(6)})
+    db._firestore_api.reset()
+    documents = export(Watermark(path, "users", "updated"), select=["name"])
+    assert sorted(document["__doc_id__"] for document in documents) == ["u2", "u4"]
+    assert all(document["__data__"].keys() == {"name", "updated"} for document in documents)
+    assert db._firestore_api.rpcs["run_query"] == 1
+    assert Watermark(path, "users", "updated").value == at(6)
+
+def test_failed_export_keeps_the_watermark(db, tmp_path):
+    path = str(tmp_path / "users.watermark")
+    export(Watermark(path, "users", "updated"))
+    db.collection("users").document("u0").update({"updated": at(8)})
+    with mock.patch.object(operations, "write_document_stream", side_effect=OSError("disk full")), pytest.raises(OSError):
+        export(Watermark(path, "users", "updated"))
+    assert Watermark(path, "users", "updated").value == at(4)
+
+def test_watermark_of_another_field(tmp_path):
+    path = str(tmp_path / "users.watermark")
+    with open(path, "w") as file:
+        json.dump({"collection": "users", "field": "updated", "value": 1}, file)
+    with pytest.raises(ValueError):
+        Watermark(path, "users")
+
+def test_merge_documents():
+    snapshot = [{"__doc_id__": "a", "__data__": {"v": 1}}, {"__doc_id__": "b", "__data__": {"v": 1}}, {"__doc_id__": "c", "__data__": {"v": 1}}]
+    first = [{"__doc_id__": "b", "__data__": {"v": 2}}, {"__doc_id__": "d", "__data__": {"v": 2}}]
+    second = [{"__doc_id__": "b", "__data__": {"v": 3}}, {"__doc_id__": "e", "__data__": {"v": 3}}]
+    merged = list(merge_documents(snapshot, [first, second]))
+    assert [(document["__doc_id__"], document["__data__"]["v"]) for document in merged] == [("a", 1), ("b", 3), ("c", 1), ("d", 2), ("e", 3)]
+
+def test_merge_collection_group_documents_by_path():
+    snapshot = [{"__doc_id__": "o", "__doc_path__": "users/a/orders/o", "__data__": {}}, {"__doc_id__": "o", "__doc_path__": "users/b/orders/o", "__data__": {}}]
+    delta = [{"__doc_id__": "o", "__doc_path__": "users/b/orders/o", "__data__": {"paid": True}}]
+    assert [document["__data__"] for document in merge_documents(snapshot, [delta])] == [{}, {"paid": True}]
+    with pytest.raises(ValueError):
+        list(merge_documents([{"name": "raw"}], [[]]))
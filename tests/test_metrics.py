@@ -0,0 +1,60 @@
+import json
+from io import StringIO
+
+import pytest
+from firebatch.metrics import Metrics, metrics, profiled
+from firebatch.endcoding import write_json_stream
+
+def test_disabled_metrics_record_nothing():
+    recorder = Metrics()
+    with recorder.timer("parse"):
+        pass
+    recorder.count("rpcs", method="commit")
+    assert list(recorder.timed([1, 2], "parse", "documents")) == [1, 2]
+    assert recorder.wrap(len, "encode") is len
+    assert recorder.snapshot()["phases"] == [] and recorder.snapshot()["counters"] == []
+
+def test_metrics_phases_and_counters():
+    recorder = Metrics()
+    recorder.enable(command="write", collection="users")
+    with recorder.timer("rpc", method="commit"):
+        pass
+    recorder.count("rpcs", method="commit")
+    recorder.count("rpcs", 2, method="commit")
+    assert list(recorder.timed(iter("abc"), "parse", "documents_parsed")) == ["a", "b", "c"]
+    write = recorder.wrap(StringIO().write, "output", counter="bytes_written")
+    write("hello")
+
+    snapshot = recorder.snapshot()
+    phases = {(phase["phase"], phase.get("method")): phase["count"] for phase in snapshot["phases"]}
+    assert phases == {("rpc", "commit"): 1, ("parse", None): 3, ("output", None): 1}
+    counters = {(counter["name"], counter.get("method")): counter["value"] for counter in snapshot["counters"]}
+    assert counters == {("rpcs", "commit"): 3, ("documents_parsed", None): 3, ("bytes_written", None): 5}
+    json.dumps(snapshot)
+
+    assert "rpc commit" in recorder.summary()
+    prometheus = recorder.to_prometheus()
+    assert 'firebatch_rpcs_total{collection="users",command="write",method="commit"} 3' in prometheus
+    assert 'firebatch_phase_seconds_count{collection="users",command="write",phase="parse"} 3' in prometheus
+
+def test_write_json_stream_metrics():
+    metrics.enable()
+    try:
+        output = StringIO()
+        write_json_stream(output, iter([{"a": 1}, {"b": 2}]), 'jsonl')
+        counters = {counter["name"]: counter["value"] for counter in metrics.snapshot()["counters"]}
+    finally:
+        metrics.disable()
+    assert counters == {"documents_written": 2, "bytes_written": len(output.getvalue())}
+
+def test_profiled_cprofile(tmp_path):
+    path = str(tmp_path / "profile.pstats")
+    with profiled("cprofile", path):
+        sum(range(1000))
+    import pstats
+    assert pstats.Stats(path).total_calls > 0
+
+def test_profiled_unknown():
+    with pytest.raises(ValueError):
+        with profiled("perf"):
+            pass
@@ -0,0 +1,51 @@
+import pytest
+from tests.fake_firestore import fake_client
+from firebatch.partitions import partition_cursors, partition_group, partition_query, stream_partitions
+
+class FakeQuery:
+    def __init__(self, docs, error=None):
+        self.docs = docs
+        self.error = error
+
+    def stream(self):
+        yield from self.docs
+        if self.error:
+            raise self.error
+
+def identity(doc):
+    return doc
+
+def test_stream_partitions_ordered():
+    queries = [FakeQuery(list(range(start, start + 50))) for start in range(0, 500, 50)]
+    documents = list(stream_partitions(queries, identity, ordered=True, buffer_size=5))
+    assert documents == list(range(500))
+
+def test_stream_partitions_unordered_contains_all_documents():
+    queries = [FakeQuery(list(range(start, start + 50))) for start in range(0, 500, 50)]
+    documents = list(stream_partitions(queries, identity, buffer_size=5))
+    assert sorted(documents) == list(range(500))
+
+def test_stream_partitions_stops_early():
+    queries = [FakeQuery(list(range(10000))) for _ in range(4)]
+    documents = stream_partitions(queries, identity, buffer_size=2)
+    assert next(documents) == 0
+    documents.close()  # must not hang on the blocked download threads
+
+def test_stream_partitions_propagates_errors():
+    queries = [FakeQuery([1, 2]), FakeQuery([3], error=RuntimeError("stream failed"))]
+    with pytest.raises(RuntimeError, match="stream failed"):
+        list(stream_partitions(queries, identity, ordered=True))
+
+@pytest.mark.parametrize("partition_count", [2, 3, 5, 20])
+def test_collection_partitions_read_only_the_collection(partition_count):
+    db = fake_client()
+    for index in range(6):
+        db.collection("posts").document(f"p{index}").set({"index": index})
+        # same-named collections before, below and after the top level one in the partitions of the group
+        db.collection("authors").document(f"a{index}").collection("posts").document("x").set({"index": index})
+        db.collection("posts").document(f"p{index}").collection("posts").document("x").set({"index": index})
+        db.collection("users").document(f"u{index}").collection("posts").document("x").set({"index": index})
+    group, collection_ref = partition_group(db, "posts", False)
+    queries = [partition_query(db, group, start, end, collection_ref=collection_ref) for start, end in partition_cursors(group, partition_count)]
+    paths = [doc.reference.path for query in queries if query is not None for doc in query.stream()]
+    assert paths == [f"posts/p{index}" for index in range(6)]
@@ -0,0 +1,45 @@
+import io
+import json
+
+import pytest
+from firebatch import operations
+from firebatch.partitions import stream_pages
+from firebatch.utils import parse_query_condition
+
+def seed(db):
+    for index in range(10):
+        db.collection("users").document(f"u{index}").set({"age": index, "name": f"user {index}", "address": {"city": "Graz", "zip": 8010}})
+        db.collection("users").document(f"u{index}").collection("posts").document("p").set({"text": "hello"})
+
+def export(**options) -> list:
+    output = io.StringIO()
+    operations.export_collection_documents(output, collection_group=options.pop("collection_group", False), **options)
+    return [json.loads(line) for line in output.getvalue().splitlines()]
+
+def test_select(db):
+    documents = export(collection_path="users", select=["name", "address.city"])
+    assert documents[0] == {"__doc_id__": "u0", "__data__": {"name": "user 0", "address": {"city": "Graz"}}}
+
+def test_select_includes_cursor_fields(db):
+    documents = export(collection_path="users", select=["name"], conditions=[parse_query_condition("age >= 8")], page_size=1)
+    assert [document["__data__"] for document in documents] == [{"name": "user 8", "age": 8}, {"name": "user 9", "age": 9}]
+
+@pytest.mark.parametrize("parallel", [1, 3])
+def test_ids_only(db, parallel):
+    documents = export(collection_path="users", ids_only=True, parallel=parallel, ordered=True)
+    assert documents == [{"__doc_id__": f"u{index}"} for index in range(10)]
+
+def test_ids_only_collection_group(db):
+    documents = export(collection_path="posts", collection_group=True, ids_only=True)
+    assert documents[0] == {"__doc_id__": "p", "__doc_path__": "users/u0/posts/p"}
+
+@pytest.mark.parametrize("page_size, limit, pages", [(3, None, 4), (5, None, 3), (3, 7, 3), (20, None, 1)])
+def test_page_size(db, page_size, limit, pages):
+    documents = export(collection_path="users", order_by="age", page_size=page_size, limit=limit)
+    assert [document["__doc_id__"] for document in documents] == [f"u{index}" for index in range(limit or 10)]
+    assert db._firestore_api.rpcs == {"run_query": pages}
+
+def test_stream_pages(db):
+    query = db.collection("users").order_by("age")
+    assert [doc.id for doc in stream_pages(query, 4, limit=6)] == [f"u{index}" for index in range(6)]
+    assert [doc.id for doc in stream_pages(query, 4, limit=0)] == []
@@ -0,0 +1,71 @@
+import pytest
+from firebatch import operations
+from firebatch.checkpoint import Checkpoint
+from firebatch.utils import parse_query_condition
+
+def seed(db):
+    for index in range(10):
+        db.collection("orders").document(f"o{index}").set({"total": index, "status": "open" if index < 6 else "closed"})
+        db.collection("orders").document(f"o{index}").collection("items").document("i").set({"sku": index})
+
+def ids(db, path):
+    return sorted(doc.id for doc in db.collection(path).stream())
+
+def test_delete_by_query(db):
+    operations.delete_query_documents("orders", conditions=[parse_query_condition("status == closed")])
+    assert ids(db, "orders") == [f"o{index}" for index in range(6)]
+    assert ids(db, "orders/o7/items") == []
+    assert ids(db, "orders/o1/items") == ["i"]
+
+def test_delete_by_query_with_limit_and_pages(db):
+    operations.delete_query_documents("orders", limit=4, recursive=False, page_size=3)
+    assert db._firestore_api.rpcs["run_query"] == 2
+    assert ids(db, "orders") == [f"o{index}" for index in range(4, 10)]
+
+def test_delete_by_collection_group_query(db):
+    operations.delete_query_documents("items", collection_group=True, conditions=[parse_query_condition("sku >= 8")])
+    assert ids(db, "orders/o8/items") == [] and ids(db, "orders/o9/items") == []
+    assert ids(db, "orders/o7/items") == ["i"]
+
+def test_delete_by_query_dry_run(db):
+    operations.delete_query_documents("orders", conditions=[parse_query_condition("status == open")], dry_run=True)
+    assert len(ids(db, "orders")) == 10
+    assert "commit" not in db._firestore_api.rpcs
+
+def test_update_by_query(db):
+    updated = operations.update_query_documents("orders", {"status": "archived", "archived_at": "2024-01-02T03:04:05Z"},
+                                                conditions=[parse_query_condition("total < 3")], timestamp_convert=True)
+    assert updated == 3
+    documents = {doc.id: doc.to_dict() for doc in db.collection("orders").stream()}
+    assert [doc_id for doc_id, data in documents.items() if data["status"] == "archived"] == ["o0", "o1", "o2"]
+    assert documents["o0"]["archived_at"].year == 2024 and documents["o0"]["total"] == 0
+
+def test_update_by_query_with_transforms(db):
+    db.collection("orders").document("o0").set({"tags": ["a", "b"], "legacy": True, "stats": {"views": 1}}, merge=True)
+    db._firestore_api.reset()
+    operations.update_query_documents("orders", {"total": {"__increment__": 10}, "stats.views": {"__increment__": 1},
+                                                 "tags": {"__array_union__": ["c"]}, "legacy": {"__delete_field__": True}},
+                                      conditions=[parse_query_condition("status == open")])
+    assert db._firestore_api.rpcs["commit"] == 1 and "batch_get_documents" not in db._firestore_api.rpcs
+    data = db.collection("orders").document("o0").get().to_dict()
+    assert data == {"total": 10, "status": "open", "tags": ["a", "b", "c"], "stats": {"views": 2}}
+    assert db.collection("orders").document("o7").get().to_dict()["total"] == 7
+
+def test_upsert_with_dotted_field_paths(db):
+    updates = [{"__doc_id__": "o1", "__data__": {"stats.views": {"__increment__": 1}}},
+               {"__doc_id__": "new", "__data__": {"stats.views": {"__increment__": 1}, "tags": {"__array_union__": ["x"]}}}]
+    operations.update_documents_in_firestore("orders", updates, upsert=True)
+    assert db.collection("orders").document("o1").get().to_dict() == {"total": 1, "status": "open", "stats": {"views": 1}}
+    assert db.collection("orders").document("new").get().to_dict() == {"stats": {"views": 1}, "tags": ["x"]}
+
+def test_duplicate_ids_stop_the_update_and_resume_with_the_checkpoint(db, tmp_path, capsys):
+    path = str(tmp_path / "progress.json")
+    def update(ids):
+        updates = ({"__doc_id__": doc_id, "__data__": {"total": {"__increment__": 100}}} for doc_id in ids)
+        operations.update_documents_in_firestore("orders", updates, batch_size=2, checkpoint=Checkpoint(path, "update", "orders"))
+    with pytest.raises(SystemExit):
+        update(["o0", "o1", "o2", "o0"])
+    assert "Error duplicate keys: {'o0'} at input document 4" in capsys.readouterr().err
+    # the corrected file continues after the committed batch, every increment is applied once
+    update(["o0", "o1", "o2", "o3"])
+    assert [db.document(f"orders/o{index}").get().get("total") for index in range(5)] == [100, 101, 102, 103, 4]
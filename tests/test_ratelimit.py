@@ -0,0 +1,55 @@
+from firebatch import ratelimit
+from firebatch.ratelimit import RateController, rate_controlled
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+def controller(**kwargs) -> RateController:
+    clock = FakeClock()
+    return RateController(clock=clock, sleep=clock.sleep, **kwargs), clock
+
+def test_ramp_up_follows_500_50_5():
+    rate, clock = controller(ramp_up=True, max_ops_per_sec=1000)
+    assert rate.rate == 500
+    clock.now = 299
+    assert rate.rate == 500
+    clock.now = 300
+    assert rate.rate == 750
+    clock.now = 600
+    assert rate.rate == 1000
+
+def test_batches_are_spaced_by_the_rate():
+    rate, clock = controller(ramp_up=True)
+    for _ in range(3):
+        rate.acquire(500)
+        rate.release()
+    assert clock.sleeps == [1.0, 1.0]
+
+def test_contention_halves_rate_and_concurrency():
+    rate, clock = controller(max_ops_per_sec=800, max_concurrency=4)
+    rate.acquire(100)
+    rate.release(contention=True)
+    assert (rate.rate, rate.concurrency, rate.backoffs) == (400, 2, 1)
+    clock.now = 300
+    assert rate.rate == 600
+    for _ in range(2):
+        rate.acquire(1)
+        rate.release()
+    assert rate.concurrency == 3
+
+def test_only_given_limits_create_a_controller():
+    with rate_controlled() as rate:
+        assert rate is None and ratelimit.rate_control is None
+    with rate_controlled(max_concurrency=2) as rate:
+        assert ratelimit.rate_control is rate
+        assert rate.rate is None
+    assert ratelimit.rate_control is None
@@ -0,0 +1,82 @@
+import json
+import math
+from io import StringIO
+
+import pytest
+from firebatch.utils import iter_documents, parse_query_condition, prefetch, projection_fields, read_documents
+
+DOCUMENTS = [{"__doc_id__": str(i), "__data__": {"value": i, "text": "x" * i, "list": [1, 2.5, None]}} for i in range(50)]
+
+class ChunkedReader(StringIO):
+    """Returns at most a few characters per read to exercise the chunk boundaries."""
+    def read(self, size=-1):
+        return super().read(min(size, 7) if size and size > 0 else 7)
+
+@pytest.mark.parametrize("text", [
+    json.dumps(DOCUMENTS),
+    json.dumps(DOCUMENTS, indent=2),
+    "\n".join(json.dumps(doc) for doc in DOCUMENTS) + "\n",
+])
+def test_iter_documents_detects_format(text):
+    assert list(iter_documents(StringIO(text))) == DOCUMENTS
+    assert list(iter_documents(ChunkedReader(text), chunk_size=3)) == DOCUMENTS
+
+def test_iter_documents_jsonl_with_large_chunks():
+    text = "\n".join(json.dumps(doc) for doc in DOCUMENTS)
+    assert list(iter_documents(StringIO(text), chunk_size=1000)) == DOCUMENTS
+    assert list(iter_documents(StringIO(text), format="jsonl")) == DOCUMENTS
+
+@pytest.mark.parametrize("chunk_size", [3, 1000])
+def test_iter_documents_pretty_printed_after_single_lines(chunk_size):
+    # the first lines are whole values, the later ones are pretty-printed
+    text = "\n".join(json.dumps(doc) for doc in DOCUMENTS[:5]) + "\n" + "\n".join(json.dumps(doc, indent=2) for doc in DOCUMENTS[5:])
+    assert list(iter_documents(StringIO(text), chunk_size=chunk_size)) == DOCUMENTS
+    assert list(iter_documents(ChunkedReader(text), chunk_size=chunk_size)) == DOCUMENTS
+
+@pytest.mark.parametrize("format", ["auto", "jsonl"])
+def test_iter_documents_non_finite_doubles(format):
+    text = '{"v": NaN, "w": Infinity}\n{"v": 1, "w": -Infinity}\n'
+    documents = list(iter_documents(StringIO(text), format))
+    assert math.isnan(documents[0]["v"]) and documents[0]["w"] == math.inf and documents[1] == {"v": 1, "w": -math.inf}
+
+def test_iter_documents_single_object():
+    assert read_documents(StringIO(json.dumps(DOCUMENTS[3], indent=2))) == [DOCUMENTS[3]]
+
+def test_iter_documents_numbers_across_chunks():
+    assert list(iter_documents(ChunkedReader("[1234567890123, 2, 345678901]"), chunk_size=2)) == [1234567890123, 2, 345678901]
+
+def test_iter_documents_empty():
+    assert read_documents(StringIO("  \n")) == []
+    assert read_documents(StringIO("[ ]")) == []
+
+@pytest.mark.parametrize("text", ["[{}, {}", "[{} {}]", "[{}] {}", "{} garbage"])
+def test_iter_documents_invalid(text):
+    with pytest.raises(Exception, match="Unknown file format"):
+        read_documents(StringIO(text))
+
+def test_iter_documents_is_lazy():
+    documents = iter_documents(StringIO("[" + json.dumps(DOCUMENTS[0]) + ", {broken"))
+    assert next(documents) == DOCUMENTS[0]
+    with pytest.raises(Exception):
+        next(documents)
+
+def test_prefetch():
+    assert list(prefetch(iter(range(1000)), size=3)) == list(range(1000))
+
+def test_prefetch_propagates_errors():
+    def failing():
+        yield 1
+        raise RuntimeError("parse error")
+    with pytest.raises(RuntimeError, match="parse error"):
+        list(prefetch(failing()))
+
+def test_prefetch_stops_early():
+    items = prefetch(iter(range(100000)), size=2)
+    assert next(items) == 0
+    items.close()
+
+def test_projection_fields():
+    conditions = [parse_query_condition("age >= 18"), parse_query_condition("status == active")]
+    assert projection_fields(None, conditions=conditions) is None
+    assert projection_fields(["name", "age"], conditions=conditions, order_by="created") == ["name", "age", "created"]
+    assert projection_fields(None, ids_only=True, conditions=conditions) == ["__name__", "age"]
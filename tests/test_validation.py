@@ -0,0 +1,53 @@
+import io
+import json
+from unittest import mock
+
+import pytest
+pydantic = pytest.importorskip("pydantic")
+from firebatch import operations
+from firebatch.checkpoint import Checkpoint
+from firebatch.validation import DocumentValidator, InvalidDocument
+
+class User(pydantic.BaseModel):
+    name: str
+    age: int
+
+VALIDATOR = f"{__name__}:User"
+
+def jsonl(documents):
+    return io.StringIO("".join(json.dumps(document) + "\n" for document in documents))
+
+def users(count, invalid=()):
+    return [{"__doc_id__": f"u{index}", "__data__": {"name": f"user {index}", "age": "unknown" if index in invalid else index}} for index in range(count)]
+
+def test_rejects_are_collected(db):
+    rejects = io.StringIO()
+    with DocumentValidator(VALIDATOR, rejects, batch_size=4) as validate:
+        operations.write_documents("users", jsonl(users(10, invalid={2, 7})), validate=validate)
+    assert (validate.valid, validate.rejected) == (8, 2)
+    assert sorted(doc.id for doc in db.collection("users").stream()) == [f"u{index}" for index in range(10) if index not in (2, 7)]
+    rejected = [json.loads(line) for line in rejects.getvalue().splitlines()]
+    assert [reject["document"]["__doc_id__"] for reject in rejected] == ["u2", "u7"]
+    assert rejected[0]["errors"][0]["loc"] == ["age"]
+
+def test_first_reject_stops_without_a_rejects_file(db):
+    with DocumentValidator(VALIDATOR) as validate, pytest.raises(InvalidDocument, match="u3"):
+        operations.update_documents_in_firestore("users", users(5, invalid={3}), upsert=True, validate=validate)
+
+def test_checkpoint_positions_count_the_rejects(db, tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / "write.checkpoint"), "write", "users")
+    with DocumentValidator(VALIDATOR, io.StringIO()) as validate, mock.patch.object(Checkpoint, "complete"):
+        operations.write_documents("users", jsonl(users(6, invalid={1, 5})), checkpoint=checkpoint, validate=validate)
+    # a resumed run skips the rejected documents as well
+    assert checkpoint.get("position") == 6
+
+def test_validation_processes(db):
+    rejects = io.StringIO()
+    with DocumentValidator(VALIDATOR, rejects, processes=2, batch_size=3) as validate:
+        documents = list(validate(users(20, invalid={0, 19})))
+    assert [document is None for document in documents] == [index in (0, 19) for index in range(20)]
+    assert len(rejects.getvalue().splitlines()) == 2
+
+def test_unknown_validator():
+    with pytest.raises(ValueError):
+        DocumentValidator("firebatch.validation:Missing")